@@ -1,6 +1,6 @@
 # Build a classifier
-# Save it to JSON
-# Load the params from JSON
+# Save it as a model artifact
+# Load it back without retraining
 
 
 from numpy.random import choice
@@ -21,6 +21,11 @@ for tweet in choice(some_tweets, 20):
     print("Relevance: {}, Predicted Relevance: {}; text: {}"
           .format(actual_relevance, predicted_relevance, tweet.text))
 
+fname = tc.save("relevance_model.joblib")
+tc = TweetClassifier.load(fname)
+
 cv = CrossValidator(tc)
 rate = cv.misclass_rate(some_tweets)
-print("Cross Validation Misclassification Rate: {}".format(rate))
\ No newline at end of file
+print("Cross Validation Misclassification Rate: {}".format(rate))
+metrics = cv.cross_validate(some_tweets, kfolds=10)
+print("10-fold Stratified Cross Validation: {}".format(metrics))
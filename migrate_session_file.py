@@ -0,0 +1,21 @@
+#! /usr/bin/env python
+"""
+Migrate a Format III session file into a SQLite tweet database
+
+Usage:
+$ migrate_session_file.py preppy_session.json preppy_session.db
+
+The journal of the session file (preppy_session.journal) is applied
+too. Afterwards, point Preppy at the .db file instead of the .json file.
+"""
+
+import sys
+from preppy.session_store import migrate_session_file
+
+
+fname_in = sys.argv[1] if len(sys.argv) > 1 else "preppy_session.json"
+fname_out = sys.argv[2] if len(sys.argv) > 2 else "preppy_session.db"
+
+store = migrate_session_file(fname_in, fname_out)
+print("Database {} contains {} tweets".format(fname_out, len(store)))
+store.close()
@@ -1,16 +1,39 @@
 from preppy.misc import get_logger, write_json, read_json, enforce_extension
 from preppy.preptweet import PrepTweet
 from preppy.metadata import MetaData
+from preppy.tweet_list import TweetList
+from preppy.features import Vocabulary, document_term_matrix
 from sklearn.ensemble import RandomForestClassifier
+from itertools import islice
+import time
+import joblib
+import sklearn
 
-from numpy import (
-    zeros_like, vectorize, array
-)
+from numpy import array
 
 
 logger = get_logger(__file__)
 
 
+# version of the files written by TweetClassifier.save()
+MODEL_ARTIFACT_VERSION = 1
+
+
+def corpus_matrix(tweets, token_cache=None):
+    """
+    The document-term matrix of some tweets over all of their words
+    :param tweets: list of PrepTweet objects
+    :param token_cache: Optional TokenCache to take the words of the tweets
+        from; the matrix then spans the vocabulary of the cache
+    :return: tuple (scipy.sparse.csr_matrix, Vocabulary of its columns)
+    """
+    if token_cache is not None:
+        return token_cache.matrix(tweets), token_cache.vocabulary
+    documents = [tweet.words for tweet in tweets]
+    vocabulary = Vocabulary.from_documents(documents)
+    return document_term_matrix(documents, vocabulary), vocabulary
+
+
 class TweetClassifier(object):
     """
     An object to classify things
@@ -40,7 +63,10 @@ class TweetClassifier(object):
         # use the RF model
         self.model = RandomForestClassifier()
 
-    def train(self, tweets, variable_name=None):
+        # what the model was trained on (see fit_matrix)
+        self.training = {}
+
+    def train(self, tweets, variable_name=None, token_cache=None):
         """
         Using words in self.indicator_words, train the model using indicator variables
         as predictors.
@@ -48,26 +74,40 @@ class TweetClassifier(object):
         :param tweets: list of PrepTweet objects
         :param variable_name: name of the variable to train on
             overrides what is set by __init__
+        :param token_cache: Optional TokenCache to take the words of the tweets from
         :return: NoneType
         """
         if variable_name is not None:
             self.warn_if_trained(self.variable_name, variable_name)
             self.variable_name = variable_name
-        responses = []
-        indicators = []
         for tweet in tweets:
             assert isinstance(tweet, PrepTweet)
-            value = tweet.lookup(self.variable_name)
-            words = tweet.words
-            self.add_words(words=words, value=value)
-            responses.append(value)
+        responses = array([tweet.lookup(self.variable_name) for tweet in tweets])
+        x, vocabulary = corpus_matrix(tweets, token_cache)
+        self.fit_matrix(x, responses, vocabulary)
+
+    def fit_matrix(self, x, y, vocabulary):
+        """
+        Train the model on a document-term matrix
+        The indicator words are chosen among the columns of x
+        (see factor_select_initial).
+        :param x: sparse document-term matrix (see document_term_matrix)
+        :param y: array of responses, one per row of x
+        :param vocabulary: Vocabulary of the columns of x
+        :return: NoneType
+        """
+        self.words = {}
+        for level in sorted(set(y)):
+            columns = x[y == level].getnnz(axis=0).nonzero()[0]
+            self.words[str(level)] = {vocabulary.words[i] for i in columns}
         self.factor_select_initial()
-        for tweet in tweets:
-            ind = self.evaluate_indicators(tweet.words)
-            indicators.append(ind)
-        x = array(indicators, ndmin=2, dtype=int)
-        y = array(responses)
-        self.model.fit(x, y)
+        self.model.fit(x[:, vocabulary.columns(self.indicator_words)], y)
+        self.training = {
+            "n_tweets": int(x.shape[0]),
+            "levels": {str(level): int((y == level).sum()) for level in self.model.classes_},
+            "n_indicator_words": len(self.indicator_words),
+            "time": time.time()
+        }
 
     def predict(self, tweets):
         """
@@ -76,36 +116,77 @@ class TweetClassifier(object):
         :return: array of predictions
         """
         if isinstance(tweets, (list, tuple)):
-            output = []
-            for tweet in tweets:
-                output.append(self.discriminant(tweet.words))
-            return array(output).squeeze()
+            documents = [tweet.words for tweet in tweets]
+            return self.model.predict(self.feature_matrix(documents)).squeeze()
         elif isinstance(tweets, PrepTweet):
             return self.discriminant(tweets.words)
 
+    def predict_batches(self, tweets, batch_size=10000, token_cache=None):
+        """
+        Score many tweets, one batch at a time
+        Each batch is turned into one indicator matrix and scored with
+        a single call to the model, and only one batch is held in memory
+        (a TweetList with a session store is read as it goes).
+        :param tweets: TweetList, or iterable of PrepTweet objects
+        :param batch_size: number of tweets per batch
+        :param token_cache: Optional TokenCache to take the words of the tweets from
+            (by default, that of the TweetList, if any)
+        :return: generator of tuples (list of id strings, array of predictions,
+            array of probabilities with one column per value in self.model.classes_)
+        """
+        if isinstance(tweets, TweetList):
+            token_cache = token_cache or tweets.token_cache
+            tweets = tweets.tweets.values()
+        tweets = iter(tweets)
+        vocabulary = Vocabulary(self.indicator_words)
+        while True:
+            batch = list(islice(tweets, batch_size))
+            if not batch:
+                return
+            documents = token_cache.documents(batch) if token_cache is not None \
+                else [tweet.words for tweet in batch]
+            x = document_term_matrix(documents, vocabulary)
+            probabilities = self.model.predict_proba(x)
+            predictions = self.model.classes_[probabilities.argmax(axis=1)]
+            yield [tweet.id_str for tweet in batch], predictions, probabilities
+
+    def predict_matrix(self, x, vocabulary):
+        """
+        Predict the responses of the rows of a document-term matrix
+        :param x: sparse document-term matrix (see document_term_matrix)
+        :param vocabulary: Vocabulary of the columns of x; must contain
+            all the indicator words
+        :return: array of predictions
+        """
+        return self.model.predict(x[:, vocabulary.columns(self.indicator_words)])
+
     def discriminant(self, words):
         """
         Evaluate the discriminant function
         :param words: list or set of words observed
         :return: predicted value for the variable named in self.variable_name
         """
-        indicators = self.evaluate_indicators(words)
-        indicators = array(indicators, ndmin=2)  # I am fine with 1d arrays but scikit-learn raises deprecation warning
-        prediction = self.model.predict(indicators)
-        return prediction
+        return self.model.predict(self.feature_matrix([words]))
+
+    def feature_matrix(self, documents):
+        """
+        The indicator matrix of some documents:
+        one row per document, one column per indicator word
+        :param documents: list of lists of words (None is empty)
+        :return: scipy.sparse.csr_matrix
+        """
+        return document_term_matrix(documents, Vocabulary(self.indicator_words))
 
     def evaluate_indicators(self, tweet_words):
         """
-        Vectorize the operation of evaluating presence of each
+        Evaluate the presence of each indicator word
         :param tweet_words: set of words observed
         :return: list of integers
         """
         if tweet_words is None:
-            return [0. for word in self.indicator_words]
+            return [0 for word in self.indicator_words]
         tweet_words = set(tweet_words)
-        evaluate = vectorize(lambda _word: int(_word in tweet_words))
-        indicators = evaluate(self.indicator_words)
-        return indicators
+        return [int(word in tweet_words) for word in self.indicator_words]
 
     def get_word_specificity(self):
         # TODO: Move this feature from the ReportWriter to this class
@@ -129,7 +210,7 @@ class TweetClassifier(object):
                 w2.update(self.words.get(other_level))
             specific_words = w1 - w2
             indicators.update(specific_words)
-        self.indicator_words = list(indicators)
+        self.indicator_words = sorted(indicators)
 
     def add_words(self, words, value):
         """
@@ -161,9 +242,63 @@ class TweetClassifier(object):
         """
         return len(self.indicator_words) > 0
 
+    def save(self, fname, compress=0):
+        """
+        Write out this model, fitted estimator included, as a versioned
+        joblib artifact that load() can read back without retraining
+        Leave compress at 0 to let load() memory-map the large arrays.
+        :param fname: name of the file to write (.joblib)
+        :param compress: joblib compression level (0 to 9)
+        :return: name of the file written
+        """
+        fname = enforce_extension(fname, ".joblib")
+        artifact = {
+            "version": MODEL_ARTIFACT_VERSION,
+            "sklearn_version": sklearn.__version__,
+            "variable_name": self.variable_name,
+            "indicator_words": list(self.indicator_words),
+            "words": {value: sorted(words) for value, words in self.words.items()},
+            "training": dict(self.training),
+            "model": self.model
+        }
+        joblib.dump(artifact, fname, compress=compress)
+        return fname
+
+    @classmethod
+    def load(cls, fname, mmap_mode='r'):
+        """
+        Instantiate this class from a file written by save()
+        :param fname: name of the joblib file
+        :param mmap_mode: how to memory-map the large arrays of the
+            estimator (see joblib.load); None reads them into memory
+        :return: an instance of this class
+        :raises ValueError: if the file is not a model artifact of
+            MODEL_ARTIFACT_VERSION
+        """
+        fname = enforce_extension(fname, ".joblib")
+        artifact = joblib.load(fname, mmap_mode=mmap_mode)
+        if not isinstance(artifact, dict):
+            raise ValueError("{} holds a {}, not a TweetClassifier model artifact "
+                             "(expected version {})"
+                             .format(fname, type(artifact).__name__, MODEL_ARTIFACT_VERSION))
+        if artifact.get("version") != MODEL_ARTIFACT_VERSION:
+            raise ValueError("{} is a version {} model artifact, expected version {}"
+                             .format(fname, artifact.get("version"), MODEL_ARTIFACT_VERSION))
+        if artifact["sklearn_version"] != sklearn.__version__:
+            logger.warning("{} was saved with scikit-learn {}, this is {}"
+                           .format(fname, artifact["sklearn_version"], sklearn.__version__))
+        obj = cls(artifact["variable_name"])
+        obj.indicator_words = artifact["indicator_words"]
+        obj.words = {value: set(words) for value, words in artifact["words"].items()}
+        obj.training = artifact["training"]
+        obj.model = artifact["model"]
+        return obj
+
     def to_json(self, fname):
         """
         Write out the contents of this model to a json file
+        Only the parameters of the estimator are written, not the fitted
+        estimator itself; use save() to keep a trained model.
         :param fname: name of the json file to write
         :return:
         """
@@ -187,7 +322,7 @@ class TweetClassifier(object):
         Make the word sets into lists
         :return: dictionary
         """
-        d = self.__dict__
+        d = dict(self.__dict__)
         # convert to list to be json safe
         d['words'] = {value: list(words) for value, words in self.words.items()}
         d['model'] = dict(self.model.get_params())
@@ -198,12 +333,15 @@ class TweetClassifier(object):
         """
         Instantiate this class from a dict
         But make the word lists into sets
+        The estimator gets the saved parameters but is not fitted.
         :param d: dictionary produced by TweetClassifier().as_dict
         :return: an instance of this class
         """
-        obj = cls()
+        obj = cls(d['variable_name'])
         obj.__dict__.update(d)
         obj.words = {value: set(words) for value, words in d['words'].items()}
+        obj.model = RandomForestClassifier(**d['model'])
+        return obj
 
     @staticmethod
     def assert_all_elements_are_strings(words):
@@ -2,9 +2,75 @@
 A cross validator class
 """
 
-from sklearn.model_selection import KFold
-from numpy import array
-from preppy.binaryclassifier import TweetClassifier
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.model_selection import KFold, StratifiedKFold
+from sklearn.metrics import precision_recall_fscore_support
+from numpy import array, empty
+from preppy.binaryclassifier import TweetClassifier, corpus_matrix
+
+
+# the corpus of the worker processes (see _init_worker)
+_corpus = None
+
+
+def _init_worker(x, y, vocabulary):
+    """
+    Receive the corpus once per worker process, instead of once per fold
+    """
+    global _corpus
+    _corpus = (x, y, vocabulary)
+
+
+def _run_fold(variable_name, i_train, i_test):
+    x, y, vocabulary = _corpus
+    return fit_fold(x, y, vocabulary, variable_name, i_train, i_test)
+
+
+def fit_fold(x, y, vocabulary, variable_name, i_train, i_test):
+    """
+    Train a fresh model on some rows of a document-term matrix
+    and predict the others
+    The predictors found in the training set will
+    be different for each fold.
+    :param x: sparse document-term matrix
+    :param y: array of responses
+    :param vocabulary: Vocabulary of the columns of x
+    :param variable_name: name of the variable to predict
+    :param i_train: row numbers to train on
+    :param i_test: row numbers to predict
+    :return: tuple (i_test, array of predictions)
+    """
+    model = TweetClassifier(variable_name)
+    model.fit_matrix(x[i_train], y[i_train], vocabulary)
+    return i_test, model.predict_matrix(x[i_test], vocabulary)
+
+
+def classification_metrics(actual, predicted):
+    """
+    Summarize predictions of a discrete variable
+    With two values, precision, recall and f1 are those of the larger
+    value (e.g. relevant); otherwise they are averaged over the values.
+    :param actual: array of actual values
+    :param predicted: array of predicted values
+    :return: dict with accuracy, misclass, precision, recall, f1 and n
+    """
+    n = len(actual)
+    accuracy = float((predicted == actual).sum()) / n
+    levels = sorted(set(actual) | set(predicted))
+    if len(levels) == 2:
+        average, positive = "binary", levels[-1]
+    else:
+        average, positive = "macro", 1
+    precision, recall, f1, _ = precision_recall_fscore_support(
+        actual, predicted, average=average, pos_label=positive, zero_division=0)
+    return {
+        "n": n,
+        "accuracy": accuracy,
+        "misclass": 1. - accuracy,
+        "precision": float(precision),
+        "recall": float(recall),
+        "f1": float(f1)
+    }
 
 
 class CrossValidator(object):
@@ -22,24 +88,61 @@ class CrossValidator(object):
         :param kfolds: Number of groups to withhold and refit.
         :return:
         """
-        tweets = array(tweets)
-        result = []
-        n_total = len(tweets)
-        kf = KFold(n_splits=kfolds).split(tweets)
-        for i_train, i_test in kf:
-            train = tweets[i_train]
-            test  = tweets[i_test]
-            model = TweetClassifier(self.variable_name)
-            model.train(tweets=train)
-            # The predictors found in the training set will
-            # be different for each fold.
-            predicted = model.predict(tweets=test.tolist())
-            actual = [tweet.lookup(self.variable_name)
-                      for tweet in test]
-            actual = array(actual)
-            n = len(test)
-            rate = sum(predicted != actual) / n
-            result.append((n, rate))
-        average_misclass_rate = \
-            sum([n * rate / n_total for n, rate in result])
-        return average_misclass_rate
+        return self.cross_validate(tweets, kfolds=kfolds, stratified=False)["misclass"]
+
+    def cross_validate(self, tweets, kfolds=10, stratified=True, max_workers=None,
+                       random_state=None, token_cache=None):
+        """
+        Cross validate the model on some coded tweets
+        The tweets are tokenized once, into one document-term matrix
+        over the words of all tweets; see cross_validate_matrix.
+        :param tweets: list of tweets
+        :param kfolds: Number of groups to withhold and refit.
+        :param stratified: If True, every fold has about the same
+            share of each value of the variable
+        :param max_workers: number of worker processes
+            (default: one per CPU; 1 runs the folds in this process)
+        :param random_state: If not None, shuffle the tweets with this
+            seed before splitting them into folds
+        :param token_cache: Optional TokenCache to take the words of the tweets from
+        :return: dict of metrics (see classification_metrics)
+        """
+        y = array([tweet.lookup(self.variable_name) for tweet in tweets])
+        x, vocabulary = corpus_matrix(tweets, token_cache)
+        return self.cross_validate_matrix(x, y, vocabulary, kfolds=kfolds,
+                                          stratified=stratified, max_workers=max_workers,
+                                          random_state=random_state)
+
+    def cross_validate_matrix(self, x, y, vocabulary, kfolds=10, stratified=True,
+                              max_workers=None, random_state=None):
+        """
+        Cross validate the model on a document-term matrix
+        The folds run in a pool of processes; every process receives
+        the matrix once. The predictions of all folds are pooled before
+        computing the metrics, so misclass equals the average fold
+        misclassification rate weighted by fold size.
+        :param x: sparse document-term matrix
+        :param y: array of responses, one per row of x
+        :param vocabulary: Vocabulary of the columns of x
+        :return: dict of metrics (see classification_metrics)
+        """
+        shuffle = random_state is not None
+        if stratified:
+            splitter = StratifiedKFold(n_splits=kfolds, shuffle=shuffle, random_state=random_state)
+        else:
+            splitter = KFold(n_splits=kfolds, shuffle=shuffle, random_state=random_state)
+        folds = list(splitter.split(x, y))
+        predicted = empty(len(y), dtype=y.dtype)
+        if max_workers == 1:
+            results = (fit_fold(x, y, vocabulary, self.variable_name, i_train, i_test)
+                       for i_train, i_test in folds)
+            for i_test, fold_predicted in results:
+                predicted[i_test] = fold_predicted
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                     initargs=(x, y, vocabulary)) as executor:
+                results = executor.map(_run_fold, [self.variable_name] * len(folds),
+                                       *zip(*folds))
+                for i_test, fold_predicted in results:
+                    predicted[i_test] = fold_predicted
+        return classification_metrics(y, predicted)
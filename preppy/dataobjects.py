@@ -1,11 +1,117 @@
+import re
+import time
+import hashlib
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
-from preppy.misc import read_json, write_json, MISSING, get_logger
+from preppy.httpclient import shared_client
+from preppy.misc import read_json, write_json, MISSING, get_logger, TokenBucket
 
 
 logger = get_logger(__file__)
 
 
+def normalize_place_name(place_name):
+    """
+    Normalize a place name so that trivially different spellings
+    ("New Haven,  CT " and "new haven, ct") share one cache entry
+    :param place_name: str
+    :return: str
+    """
+    return re.sub(r"\s+", " ", place_name).strip().casefold()
+
+
+# Profile locations that are not places. Checked after removing
+# everything but letters and spaces (so "** everywhere **" matches).
+VAGUE_PLACES = frozenset([
+    "everywhere", "anywhere", "somewhere", "wherever", "worldwide",
+    "world", "the world", "earth", "planet earth", "global", "globe",
+    "universe", "the universe", "internet", "the internet", "online",
+    "cyberspace", "here", "home", "heaven", "hell", "your heart",
+    "in your heart", "on the road", "in my head"
+])
+
+
+def is_plausible_place(place_name):
+    """
+    Say whether a (normalized) profile location is worth geocoding
+    Locations without any letters or digits ("...", "!!!")
+    and well known non-places ("everywhere", "planet earth") are not.
+    :param place_name: str
+    :return: BoolType
+    """
+    if re.search(r"[^\W_]", place_name) is None:
+        return False
+    letters = re.sub(r"\s+", " ", re.sub(r"[^\w\s]|[\d_]", "", place_name)).strip()
+    return letters.casefold() not in VAGUE_PLACES
+
+
+class CacheEntry(object):
+    OK = "OK"
+    ZERO_RESULTS = "ZERO_RESULTS"
+    ERROR = "ERROR"
+
+    def __init__(self, results=None, status=OK, timestamp=None, error=None):
+        """
+        One cached geocoding lookup
+        :param results: dict; first result of the API response ({} if none)
+        :param status: CacheEntry.OK, CacheEntry.ZERO_RESULTS (the API
+            knows no such place) or CacheEntry.ERROR (the lookup failed)
+        :param timestamp: time of the lookup (seconds since the epoch).
+            None if unknown.
+        :param error: Optional. Description of the error
+        """
+        self.results = results or {}
+        self.status = status
+        self.timestamp = timestamp
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Instantiate this class from the output of as_dict
+        Entries written before lookups were timestamped (a bare results
+        dict, {} for a failed lookup) are accepted too.
+        :param d: dict
+        :return: an instance of this class
+        """
+        if isinstance(d, dict) and {"results", "status", "timestamp"} <= set(d):
+            return cls(d["results"], d["status"], d["timestamp"], d.get("error"))
+        if d:
+            return cls(d, cls.OK)
+        return cls({}, cls.ERROR, error="unknown (legacy entry)")
+
+    @property
+    def as_dict(self):
+        output = {
+            "results": self.results,
+            "status": self.status,
+            "timestamp": self.timestamp
+        }
+        if self.error is not None:
+            output["error"] = self.error
+        return output
+
+    @property
+    def is_hit(self):
+        return self.status == self.OK
+
+    def is_expired(self, ttl, now=None):
+        """
+        Say whether this entry is older than ttl
+        Entries of unknown age are expired unless ttl is None.
+        :param ttl: time to live in seconds (None: never expires)
+        :param now: Optional. The current time
+        :return: BoolType
+        """
+        if ttl is None:
+            return False
+        if self.timestamp is None:
+            return True
+        return (now or time.time()) - self.timestamp > ttl
+
+
 class DataObject(object):
     """
     A base object for storing and manipulating data
@@ -45,15 +151,41 @@ class DataObject(object):
 
 
 class PlaceInfo(DataObject):
-    def __init__(self, data=None, config_file=None):
+    def __init__(self, data=None, config_file=None, url=None, max_workers=8,
+                 ttl=None, negative_ttl=30 * 24 * 3600, error_ttl=24 * 3600,
+                 max_entries=100000, low_water=0.9, client=None):
         """
         Initialize a PlaceCoordinates class object
 
         :param data: dictionary of the form
-            {place : coords, ...}
+            {place : CacheEntry.as_dict, ...}
+            (older files of the form {place: results} work too)
         :param config_file: configuration file that
             contains the api key for the requests
+        :param url: Optional. Geocoding endpoint (default: Google Geocoding API)
+        :param max_workers: default number of concurrent requests
+            in get_coordinates_batch()
+        :param ttl: seconds after which a found place is looked up again
+            (None: never)
+        :param negative_ttl: seconds after which a place the API did
+            not know is looked up again (None: never)
+        :param error_ttl: seconds after which a failed lookup is retried
+        :param max_entries: maximum number of cached places. The oldest
+            entries (failures and misses first) are dropped beyond that.
+        :param low_water: once the cache is full, evict down to this
+            fraction of max_entries at once, so that the cache is not
+            sorted again on every insert
+        :param client: Optional. HttpClient to send the requests through
+            (default: shared_client())
         """
+        self.ttl = {
+            CacheEntry.OK: ttl,
+            CacheEntry.ZERO_RESULTS: negative_ttl,
+            CacheEntry.ERROR: error_ttl
+        }
+        self.max_entries = max_entries
+        self.low_water = low_water
+        self._lock = threading.Lock()
         DataObject.__init__(self)
         self.data = data
         self.api_key = None
@@ -63,8 +195,37 @@ class PlaceInfo(DataObject):
                 self.api_key = configuration["google"]["keys"]["api_key"]
             except KeyError:
                 raise KeyError("Config json file must have key path google>keys>api_key. Google API not in use.")
-        self.url_geocode_resource = "https://maps.googleapis.com/maps/api/geocode/json"
+        self.url_geocode_resource = url or "https://maps.googleapis.com/maps/api/geocode/json"
         self.api_counter = 0
+        self.max_workers = max_workers
+        self.client = client or shared_client()
+        self.session = self.client.session
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, d):
+        if d is not None:
+            assert isinstance(d, dict)
+            entries = [(key, CacheEntry.from_dict(value)) for key, value in d.items()]
+            entries.sort(key=lambda item: item[1].timestamp or 0)
+            self._data = dict(entries)
+            self._evict()
+
+    def to_json(self, fname):
+        """
+        Write out the cache as a json file (expired entries are left out)
+        :param fname: the name of the json file to write
+        :return: None
+        """
+        now = time.time()
+        write_json({
+            key: entry.as_dict
+            for key, entry in self.data.items()
+            if not self._is_expired(entry, now)
+        }, fname)
 
     def get_coordinates(self, place_name):
         """
@@ -72,28 +233,156 @@ class PlaceInfo(DataObject):
         :param place_name: the name of the place
         :return: tuple of floats (latitude, longitude)
         """
-        if place_name in self.data:
-            coords = self._get_coords_from_self(place_name)
+        key = self._cache_key(place_name)
+        if self._is_cached(key):
+            coords = self._get_coords_from_self(key)
+        elif not is_plausible_place(key):
+            coords = MISSING
         else:
-            coords = self._get_coords_from_api(place_name)
+            coords = self._get_coords_from_api(key)
         return coords
 
+    def get_coordinates_batch(self, place_names, max_workers=None,
+                              rate=10, max_calls=None):
+        """
+        Return the coordinates of many places
+        Place names are normalized and deduplicated first; only the
+        unique, plausible names that are not cached (or whose entry
+        has expired) are sent to the API, with at most max_workers
+        requests in flight and at most rate requests per second.
+        :param place_names: iterable of place names (None is skipped)
+        :param max_workers: number of concurrent requests
+            (default: self.max_workers)
+        :param rate: maximum number of API calls per second
+        :param max_calls: Optional. Maximum number of API calls to make.
+            Places that are left unresolved (or whose lookup failed)
+            are missing from the output.
+        :return: dict of the form {place_name: coords (or MISSING)}
+        """
+        keys = {}
+        for place_name in place_names:
+            if place_name is not None and place_name not in keys:
+                keys[place_name] = self._cache_key(place_name)
+        to_query = []  # in first-seen order
+        queued = set()
+        skipped = set()
+        for key in keys.values():
+            if key in queued or key in skipped or self._is_cached(key):
+                continue
+            if is_plausible_place(key):
+                to_query.append(key)
+                queued.add(key)
+            else:
+                skipped.add(key)
+        if skipped:
+            logger.debug("Not geocoding {:d} implausible places".format(len(skipped)))
+        if max_calls is not None:
+            to_query = to_query[:max(max_calls, 0)]
+        if to_query:
+            logger.info("Geocoding {:d} unique places ({:d} names)"
+                        .format(len(to_query), len(keys)))
+            bucket = TokenBucket(rate)
+
+            def query(key):
+                bucket.acquire()
+                try:
+                    self._query_geocode_api(key)
+                except requests.RequestException as e:
+                    logger.warning("Geocoding {:} failed: {:}".format(key, e))
+
+            with ThreadPoolExecutor(max_workers or self.max_workers) as executor:
+                list(executor.map(query, to_query))
+        return {
+            place_name: MISSING if key in skipped else self._get_coords_from_self(key)
+            for place_name, key in keys.items()
+            if key in skipped or self._is_resolved(key)
+        }
+
     def get_zip_code(self, place_name):
         """
         Get the US Zip code of a place
         :param place_name: the name of the place
         :return: string representation of the zip code
         """
-        if place_name in self.data:
-            zc = self._get_zip_code_from_self(place_name)
+        key = self._cache_key(place_name)
+        if self._is_cached(key):
+            zc = self._get_zip_code_from_self(key)
+        elif not is_plausible_place(key):
+            zc = MISSING
         else:
-            zc = self._get_zip_code_from_api(place_name)
+            zc = self._get_zip_code_from_api(key)
         return zc
 
     # ----------------------------------------------------------------
     # - Protected methods -
     # ----------------------------------------------------------------
 
+    def _cache_key(self, place_name):
+        """
+        The key under which a place is cached in self.data
+        Entries stored before names were normalized keep their key.
+        :param place_name: name of the place
+        :return: str
+        """
+        if place_name in self.data:
+            return place_name
+        return normalize_place_name(place_name)
+
+    def _is_expired(self, entry, now=None):
+        return entry.is_expired(self.ttl.get(entry.status), now)
+
+    def _is_cached(self, key):
+        """
+        Say whether a place has a cache entry that has not expired
+        :param key: cache key of the place (see _cache_key)
+        :return: BoolType
+        """
+        entry = self.data.get(key)
+        return entry is not None and not self._is_expired(entry)
+
+    def _is_resolved(self, key):
+        """
+        Say whether the API gave an answer (found or not) for a place
+        :param key: cache key of the place
+        :return: BoolType
+        """
+        entry = self.data.get(key)
+        return entry is not None and entry.status != CacheEntry.ERROR
+
+    def _store(self, key, entry):
+        """
+        Put an entry into the cache, dropping old entries if it is full
+        :param key: cache key of the place
+        :param entry: CacheEntry
+        :return: NoneType
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = entry
+            self._evict()
+
+    def _evict(self):
+        """
+        Drop expired entries, then failures and misses, then found
+        places, oldest first, once more than max_entries are cached
+        Entries are dropped until low_water * max_entries are left, so
+        the cost of sorting the cache is spread over many inserts.
+        :return: NoneType
+        """
+        if self.max_entries is None or len(self._data) <= self.max_entries:
+            return
+        target = min(self.max_entries, int(self.max_entries * self.low_water))
+        excess = len(self._data) - target
+        now = time.time()
+        order = sorted(
+            self._data,
+            key=lambda k: (not self._is_expired(self._data[k], now),
+                           self._data[k].is_hit)
+        )  # sorted() is stable, so this keeps the age order within a group
+        for key in order[:excess]:
+            del self._data[key]
+        logger.debug("Evicted {:d} places from the cache".format(excess))
+
     def _query_geocode_api(self, place_name):
         """
         This is the method that makes a call to the Google Geocoding API
@@ -103,14 +392,20 @@ class PlaceInfo(DataObject):
         :return: dict
             specifically: response.json()["results"][0]
         """
-        response = requests.get(
-            url=self.url_geocode_resource,
-            params={
-                "address": place_name,
-                "key": self.api_key
-            }
-        )
-        self.api_counter += 1
+        with self._lock:
+            self.api_counter += 1
+        try:
+            response = self.session.get(
+                url=self.url_geocode_resource,
+                params={
+                    "address": place_name,
+                    "key": self.api_key
+                }
+            )
+        except requests.RequestException as e:
+            self._store(place_name, CacheEntry(
+                status=CacheEntry.ERROR, timestamp=time.time(), error=str(e)))
+            raise
         results = self.store_results(place_name, response)
         return results
 
@@ -143,8 +438,8 @@ class PlaceInfo(DataObject):
         :param place_name: name of the place (key in self.data)
         :return: tuple of floats (latitude, longitude)
         """
-        results = self.data.get(place_name)
-        return self._get_coords_from_results(results)
+        entry = self.data.get(self._cache_key(place_name))
+        return self._get_coords_from_results(entry and entry.results)
 
     def _get_zip_code_from_self(self, place_name):
         """
@@ -152,22 +447,37 @@ class PlaceInfo(DataObject):
         :param place_name: name of the place
         :return: string representation of the zip code
         """
-        results = self.data.get(place_name)
-        return self._get_zip_code_from_results(results)
+        entry = self.data.get(self._cache_key(place_name))
+        return self._get_zip_code_from_results(entry and entry.results)
 
     def store_results(self, place_name, response):
         """
         Store the results from a search in self.data
+        Misses (status ZERO_RESULTS) and failed requests are
+        stored too, so that they are not retried before their
+        time to live has passed.
         :param place_name: name of the place
         :param response: http response object from google geocoding api
         :return: results dict (parsed from json response)
         """
         try:
-            results_dict = response.json()['results'][0]
-        except:
-            results_dict = {}
+            body = response.json()
+        except ValueError:
+            body = {}
+        if not isinstance(body, dict):
+            body = {}
+        results = body.get("results")
+        if results:
+            entry = CacheEntry(results[0], CacheEntry.OK, time.time())
+        elif body.get("status") == CacheEntry.ZERO_RESULTS:
+            entry = CacheEntry({}, CacheEntry.ZERO_RESULTS, time.time())
+        else:
+            error = (body.get("error_message") or body.get("status")
+                     or "HTTP {:}".format(response.status_code))
+            entry = CacheEntry({}, CacheEntry.ERROR, time.time(), error)
+        results_dict = entry.results
         if place_name is not None:
-            self.data.update({place_name: results_dict})
+            self._store(place_name, entry)
         return results_dict
 
     @staticmethod
@@ -209,4 +519,72 @@ class PlaceInfo(DataObject):
             zc = d.get("address_components")[iz.index(True)]["long_name"]
             return zc
         except:
-            return MISSING
\ No newline at end of file
+            return MISSING
+
+
+def normalize_tweet_text(text):
+    """
+    Reduce a tweet text to what matters for NLU, so that retweets and
+    copies of the same text share one NLU cache entry: drop the
+    "RT @user:" prefix and links, lower case, collapse white space
+    :param text: str
+    :return: str
+    """
+    text = re.sub(r"^RT @\w+:\s*", "", text)
+    text = re.sub(r"https?://\S+", " ", text)
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class NLUCache(DataObject):
+    def __init__(self, data=None):
+        """
+        A persistent cache of NLU responses, keyed by the hash of the
+        normalized tweet text (see normalize_tweet_text)
+        :param data: dictionary of the form {text hash: NLU response}
+        """
+        DataObject.__init__(self, data)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text):
+        """
+        The key under which the NLU response for a text is cached
+        :param text: tweet text
+        :return: str; sha1 hex digest of the normalized text
+        """
+        return hashlib.sha1(normalize_tweet_text(text).encode("utf-8")).hexdigest()
+
+    def get(self, text, count=True):
+        """
+        Return the cached NLU response for a text (None if there is none)
+        :param text: tweet text
+        :param count: If True, count the lookup as a hit or a miss
+            (see hit_rate)
+        :return: dict or NoneType
+        """
+        response = self.data.get(self.key(text))
+        if count:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def put(self, text, response):
+        """
+        Cache the NLU response for a text
+        :param text: tweet text
+        :param response: NLU response (dict)
+        :return: NoneType
+        """
+        self.data[self.key(text)] = response
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of the lookups that were found in the cache
+        :return: float (0. if there were no lookups)
+        """
+        n = self.hits + self.misses
+        return self.hits / n if n else 0.
@@ -0,0 +1,94 @@
+"""
+Sparse text features for the tweet classifiers.
+
+A Vocabulary gives every word a column number, and document_term_matrix
+turns a list of documents (each a list of words, e.g. PrepTweet.words)
+into a scipy.sparse CSR matrix in one pass:
+
+    vocabulary = Vocabulary.from_documents(documents)
+    x = document_term_matrix(documents, vocabulary)
+    x[i, vocabulary.index[word]] == 1  # if document i contains word
+
+Words that are not in the vocabulary are ignored, so the same
+vocabulary can be applied to new documents.
+"""
+
+from array import array
+from numpy import asarray, int8, int32, int64, ones
+from scipy.sparse import csr_matrix
+
+
+class Vocabulary(object):
+    def __init__(self, words=()):
+        """
+        A fixed list of words, each with its own column number
+        :param words: iterable of strings; duplicates are ignored
+        """
+        self.words = []  # column number: word
+        self.index = {}  # word: column number
+        self.update(words)
+
+    def add(self, word):
+        """
+        Add a word to the vocabulary if it is not in it already
+        :param word: str
+        :return: column number of the word
+        """
+        column = self.index.get(word)
+        if column is None:
+            column = self.index[word] = len(self.words)
+            self.words.append(word)
+        return column
+
+    def update(self, words):
+        for word in words:
+            self.add(word)
+
+    def columns(self, words):
+        """
+        The column numbers of some words of this vocabulary
+        :param words: iterable of strings in this vocabulary
+        :return: list of ints
+        """
+        return [self.index[word] for word in words]
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.index
+
+    @classmethod
+    def from_documents(cls, documents):
+        """
+        The vocabulary of all words in some documents, in sorted order
+        :param documents: iterable of lists of words (None is empty)
+        :return: Vocabulary
+        """
+        words = set()
+        for document in documents:
+            if document:
+                words.update(document)
+        return cls(sorted(words))
+
+
+def document_term_matrix(documents, vocabulary, dtype=int8):
+    """
+    Indicate, for every document, which words of the vocabulary it contains
+    :param documents: iterable of lists of words (None is empty)
+    :param vocabulary: Vocabulary
+    :param dtype: numpy dtype of the matrix
+    :return: scipy.sparse.csr_matrix of shape (documents, len(vocabulary))
+        with a 1 where a document contains a word
+    """
+    index = vocabulary.index
+    indptr = array("q", [0])
+    indices = array("i")
+    for document in documents:
+        if document:
+            indices.extend(sorted({index[word] for word in document if word in index}))
+        indptr.append(len(indices))
+    return csr_matrix(
+        (ones(len(indices), dtype=dtype), asarray(indices, dtype=int32),
+         asarray(indptr, dtype=int64)),
+        shape=(len(indptr) - 1, len(vocabulary)))
@@ -0,0 +1,127 @@
+"""
+One HTTP connection pool and retry policy for every web API preppy talks to.
+
+Google Geocoding (PlaceInfo) and Twitter (the twitter.Api session)
+send their requests through the same HttpClient, so connections are
+kept alive and reused across calls, every request has a timeout, and
+GET requests that fail with a 5xx status are retried with jittered
+exponential backoff (honouring Retry-After).
+
+Each failure is retried by exactly one layer: 429 (rate limited) is
+not retried here but left to the caller, e.g. the rate limit handling
+of twitter.Api, and POST requests are not retried here either. Watson
+NLU has its own client without retries ("watson"), because NLUEnricher
+retries failed requests itself.
+
+    client = shared_client()
+    response = client.get(url, params={...})
+    client.mount(api._session)  # route another requests.Session through it
+"""
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class ServerErrorRetry(Retry):
+    # urllib3 retries any 429 that has a Retry-After header, whatever
+    # the status_forcelist; leave 429 to the caller (see module docstring)
+    RETRY_AFTER_STATUS_CODES = frozenset([503])
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, timeout=None, *args, **kwargs):
+        """
+        An HTTPAdapter that applies a default timeout
+        to requests that do not set one
+        :param timeout: seconds, or a tuple (connect, read)
+        """
+        self.timeout = timeout
+        HTTPAdapter.__init__(self, *args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return HTTPAdapter.send(self, request, timeout=timeout, **kwargs)
+
+
+class HttpClient(object):
+    def __init__(self, pool_maxsize=16, timeout=(5., 30.), max_retries=3,
+                 backoff=0.5, max_backoff=30.,
+                 retry_methods=("GET", "HEAD"), retry_statuses=RETRY_STATUSES):
+        """
+        A pooled requests.Session with timeouts and retries
+        :param pool_maxsize: number of connections kept alive per host
+        :param timeout: default timeout in seconds, or a tuple
+            (connect timeout, read timeout)
+        :param max_retries: number of retries after a failed request
+        :param backoff: base delay between retries in seconds; the delay
+            doubles with every retry and has up to this much random jitter
+        :param max_backoff: longest delay between two retries in seconds
+        :param retry_methods: HTTP methods that may be retried
+        :param retry_statuses: HTTP statuses that are retried
+        """
+        self.timeout = timeout
+        self.retry = ServerErrorRetry(
+            total=max_retries,
+            status_forcelist=retry_statuses,
+            allowed_methods=frozenset(retry_methods),
+            backoff_factor=backoff,
+            backoff_max=max_backoff,
+            backoff_jitter=backoff,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        self.adapter = TimeoutHTTPAdapter(
+            timeout=timeout,
+            pool_connections=pool_maxsize,
+            pool_maxsize=pool_maxsize,
+            max_retries=self.retry)
+        self.session = requests.Session()
+        self.mount(self.session)
+
+    def mount(self, session):
+        """
+        Send the requests of another requests.Session through this
+        client's connection pool and retry policy
+        :param session: requests.Session
+        :return: the session
+        """
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def shared_client(name="default", **kwargs):
+    """
+    An HttpClient that is shared by all of preppy
+    :param name: name of the client; "default" for Google and Twitter,
+        "watson" for Watson NLU
+    :param kwargs: HttpClient arguments, used when the client is created
+    :return: HttpClient
+    """
+    with _shared_clients_lock:
+        client = _shared_clients.get(name)
+        if client is None:
+            client = _shared_clients[name] = HttpClient(**kwargs)
+        return client
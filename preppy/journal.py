@@ -0,0 +1,176 @@
+"""
+An append-only log of the changes made to a preppy session.
+
+Instead of rewriting the whole session file at the end of every run,
+new tweets and metadata records are appended to a journal file that
+lives next to the session file (preppy_session.journal). The journal
+is replayed on top of the session file when the session is loaded and
+is folded back into the session file (compacted) once it has grown
+large relative to the session file.
+
+Each line of the journal is one json object:
+    {"op": "tweet", "id_str": ..., "tweet": PrepTweet.as_dict}
+    {"op": "record", "id_str": ..., "param": ..., "user_id": ..., "value": ...}
+    {"op": "clear", "id_str": ..., "param": ...}
+"""
+
+import os
+import json
+from preppy.misc import get_logger, enforce_extension
+from preppy.preptweet import PrepTweet
+
+
+logger = get_logger(__file__)
+
+
+def journal_file_name(session_file_name):
+    """
+    Name of the journal file that belongs to a session file
+    :param session_file_name: path to the session file
+    :return: str
+    """
+    return enforce_extension(session_file_name, ".journal")
+
+
+class SessionJournal(object):
+    def __init__(self, path):
+        """
+        Return an instance of the SessionJournal class
+        :param path: path to the journal file
+        """
+        self.path = path
+        self.pending = []
+
+    @classmethod
+    def for_session_file(cls, session_file_name):
+        """
+        Instantiate the journal that belongs to a session file
+        :param session_file_name: path to the session file
+        :return: an instance of this class
+        """
+        return cls(journal_file_name(session_file_name))
+
+    @property
+    def size(self):
+        """
+        Size of the journal file in bytes (0 if it does not exist)
+        :return: int
+        """
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def log_tweet(self, tweet):
+        """
+        Record that a tweet was added to (or replaced in) the session
+        :param tweet: PrepTweet
+        :return: NoneType
+        """
+        self.pending.append({
+            "op": "tweet",
+            "id_str": tweet.id_str,
+            "tweet": tweet.as_dict
+        })
+
+    def log_record(self, id_str, param, user_id, value):
+        """
+        Record that a piece of metadata was recorded for a tweet
+        See TweetList.record_metadata
+        :return: NoneType
+        """
+        self.pending.append({
+            "op": "record",
+            "id_str": id_str,
+            "param": param,
+            "user_id": user_id,
+            "value": value
+        })
+
+    def log_clear(self, id_str, param=None):
+        """
+        Record that the metadata of a tweet was cleared
+        See TweetList.clear_metadata
+        :return: NoneType
+        """
+        self.pending.append({
+            "op": "clear",
+            "id_str": id_str,
+            "param": param
+        })
+
+    def flush(self):
+        """
+        Append the pending changes to the journal file
+        :return: integer; the number of changes written
+        """
+        n = len(self.pending)
+        if n == 0:
+            return n
+        with open(self.path, "a") as fh:
+            if self._ends_with_partial_line():
+                # start a fresh line after a crash during a previous flush
+                fh.write("\n")
+            for entry in self.pending:
+                fh.write(json.dumps(entry, sort_keys=True) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.pending = []
+        logger.debug("Appended {:d} changes to {:}".format(n, self.path))
+        return n
+
+    def _ends_with_partial_line(self):
+        if self.size == 0:
+            return False
+        with open(self.path, "rb") as fh:
+            fh.seek(-1, os.SEEK_END)
+            return fh.read(1) != b"\n"
+
+    def discard(self):
+        """
+        Throw away the journal (pending changes and file)
+        Call this only after the changes it holds have been
+        written to the session file.
+        :return: NoneType
+        """
+        self.pending = []
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def replay(self, tweet_list):
+        """
+        Apply the changes stored in the journal file to a TweetList
+        A partially written last line (e.g. from a crash during
+        flush) is ignored.
+        :param tweet_list: TweetList to modify in place
+            (it should not have a journal attached yet)
+        :return: integer; the number of changes applied
+        """
+        if not os.path.isfile(self.path):
+            return 0
+        n = 0
+        with open(self.path, "r") as fh:
+            for line_number, line in enumerate(fh, 1):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping unreadable line {:d} of {:}"
+                                   .format(line_number, self.path))
+                    continue
+                op = entry.get("op")
+                if op == "tweet":
+                    tweet_list.add_tweets([PrepTweet.from_dict(entry["tweet"])])
+                elif op == "record":
+                    tweet_list.record_metadata(
+                        id_str=entry["id_str"],
+                        param=entry["param"],
+                        user_id=entry["user_id"],
+                        value=entry["value"])
+                elif op == "clear":
+                    tweet_list.clear_metadata(entry["id_str"], entry["param"])
+                else:
+                    logger.warning("Unknown journal operation {:}".format(op))
+                    continue
+                n += 1
+        logger.info("Replayed {:d} changes from {:}".format(n, self.path))
+        return n
@@ -0,0 +1,112 @@
+"""
+The keyword relevance classifier of scripts/keyword_classify.R, in python.
+
+A tweet is relevant if its text matches any of the keyword patterns
+below (the same patterns and case rules as keyword_classify.R). All
+patterns are compiled into one regular expression, so each text is
+searched once. Matching is ASCII only, like the R script, which turns
+the text into ASCII before matching.
+
+Results are recorded as relevance metadata under the coder name
+"keyword_classify.R", so the tweets coded by the R script and the
+ones coded here are interchangeable (see MetaData.keyword_relevant).
+"""
+
+import re
+from preppy.misc import get_logger
+
+
+logger = get_logger(__file__)
+
+
+KEYWORD_CODER = "keyword_classify.R"
+
+# (name, pattern, case insensitive), as in keyword_classify.R
+KEYWORDS = (
+    ("PrEP", r"PrEP", False),
+    ("STI", r"\bST[ID]{1}\b", True),
+    ("truvada", r"truvada", True),
+    ("hiv", r"\bhiv\b", True),
+    ("aids", r"\baids\b", True),
+    ("hivaids", r"hivaids", True),
+    ("hiv_aids", r"hiv/aids", False),
+    ("gay", r"\bgay", True),
+    ("msm", r"\bmsm\b", True),
+    ("sex", r"\bsex\b", True),
+    ("trans", r"\btrans\b", True),
+    ("transgender", r"transgender", True),
+    ("bareback", r"bareback", True),
+    ("prevention", r"prevention", True),
+    ("medication", r"medication", True),
+    ("prescription", r"prescription", True),
+    ("gilead", r"\bgilead\b", True),
+    ("bethegen", r"bethegeneration", True),
+    ("united", r"united healthcare", True),
+    ("FDA", r"\bFDA\b", True),
+    ("CDC", r"\bCDC(gov)?\b", True),
+    ("US_FDA", r"US_FDA", True),
+    ("insurance", r"insurance", True),
+    ("drug", r"\bdrug\b", True),
+    ("fag", r"\bfags?\b", True),
+    ("queer", r"queer", True)
+)
+
+
+def compile_keywords(keywords):
+    """
+    Compile one pattern that matches if any of the keywords matches
+    Case insensitive keywords are wrapped in a (?i:...) group.
+    :param keywords: list of (name, pattern, case insensitive) tuples
+    :return: compiled regular expression
+    """
+    alternatives = "|".join(
+        "(?i:{:})".format(pattern) if case_insensitive else "(?:{:})".format(pattern)
+        for name, pattern, case_insensitive in keywords)
+    return re.compile(alternatives, re.ASCII)
+
+
+KEYWORD_PATTERN = compile_keywords(KEYWORDS)
+
+
+def is_keyword_relevant(text):
+    """
+    Say whether a tweet text matches any of the keywords
+    :param text: str (None is not relevant)
+    :return: BoolType
+    """
+    if not isinstance(text, str):
+        return False
+    return KEYWORD_PATTERN.search(text) is not None
+
+
+def classify_tweets(tweet_list, reclassify=False):
+    """
+    Code the relevance of tweets with the keyword classifier
+    Records 1 (relevant) or 0 (irrelevant) for coder KEYWORD_CODER.
+    :param tweet_list: TweetList
+    :param reclassify: If True, classify every tweet. By default, only
+        the tweets that have not been keyword classified yet are.
+    :return: tuple of ints (number of tweets classified, number relevant)
+    """
+    if reclassify:
+        done = set()
+    elif tweet_list.has_store:
+        done = {tweet.id_str for tweet in tweet_list.tweets.select(
+            coded_for="relevance", coded_by=KEYWORD_CODER)}
+    else:
+        done = tweet_list.index.lookup("coded_by", "relevance", KEYWORD_CODER)
+    todo = [(id_str, tweet) for id_str, tweet in tweet_list.tweets.items()
+            if id_str not in done]
+    n_relevant = 0
+    for id_str, tweet in todo:
+        relevant = is_keyword_relevant(tweet.text)
+        n_relevant += relevant
+        tweet_list.record_metadata(
+            id_str=id_str,
+            param="relevance",
+            user_id=KEYWORD_CODER,
+            value=int(relevant)
+        )
+    logger.info("Out of {:d} tweets: {:d} relevant {:d} irrelevant"
+                .format(len(todo), n_relevant, len(todo) - n_relevant))
+    return len(todo), n_relevant
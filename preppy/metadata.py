@@ -1,4 +1,5 @@
 from numpy import mean
+from functools import lru_cache
 from preppy.misc import CodeBook, MISSING, get_logger, read_csv
 import re
 
@@ -10,6 +11,46 @@ logger = get_logger(__file__)
 AIDSVU_CITIES = read_csv("cities_of_interest.csv")  # this from aidvu.org
 
 
+def compile_cities_pattern(cities):
+    """
+    Compile one pattern that finds every city of a list at once.
+    Each city is a named group c0, c1, ... inside a lookahead, so that
+    re.finditer reports, at every position of a string, the first city
+    (in list order) that matches there.
+    :param cities: list of [city, state] rows (see AIDSVU_CITIES)
+    :return: compiled regular expression
+    """
+    alternatives = "|".join(
+        "(?P<c{:d}>{:})".format(i, city)
+        for i, (city, state) in enumerate(cities))
+    return re.compile("(?=(?:{:}))".format(alternatives))
+
+
+CITIES_PATTERN = compile_cities_pattern(AIDSVU_CITIES or [])
+
+
+@lru_cache(maxsize=65536)
+def _match_city(place_name):
+    """
+    The first city of AIDSVU_CITIES (in list order) found anywhere
+    in place_name. Results are memoized for the 65536 most recently
+    used place names (user locations are free text, so the set of
+    names is unbounded).
+    :param place_name: str
+    :return: str or False
+    """
+    first = None
+    for match in CITIES_PATTERN.finditer(place_name):
+        i = int(match.lastgroup[1:])
+        if first is None or i < first:
+            first = i
+            if first == 0:
+                break
+    if first is None:
+        return False
+    return AIDSVU_CITIES[first][0]
+
+
 def place_of_interest(place_name):
     """
     Is the place interesting to the thesis?
@@ -19,20 +60,14 @@ def place_of_interest(place_name):
         (possibly from twitter user place attribute)
     :return: BoolType
     """
-    if place_name is None:
+    if place_name is None or not AIDSVU_CITIES:
+        return False
+    if not isinstance(place_name, str):
+        logger.error("place_name: {}".format(place_name))
+        logger.error("Expected a string, got {}".format(type(place_name)))
         return False
-    for city, state in AIDSVU_CITIES:
-        # May want to add some better logic here to reduce frequency of false matches
-        try:
-            matches = re.search(pattern=city, string=place_name)
-            if matches:
-                return city  # I want to know which city it matched
-            else:
-                continue
-        except TypeError as e:
-            logger.error("city: {}, state: {}, place_name: {}".format(city, state, place_name))
-            logger.error(e)
-    return False
+    # May want to add some better logic here to reduce frequency of false matches
+    return _match_city(place_name)  # I want to know which city it matched
 
 
 class MetaData(object):
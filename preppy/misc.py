@@ -5,9 +5,12 @@ import shutil
 import logging
 import datetime
 import itertools
+import threading
 from twitter import Status
 from twitter.api import Api
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from preppy.httpclient import shared_client
 
 
 MISSING = None
@@ -117,6 +120,41 @@ class ReverseLookup(object):
         return self._lookup[value]
 
 
+class TokenBucket(object):
+    """
+    A thread safe token bucket rate limiter.
+    Tokens are added at a fixed rate up to a maximum (the burst size);
+    acquire() takes one token, waiting for it if necessary.
+    """
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens (default: rate, min 1)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, sleeping until one is available
+        :return: NoneType
+        """
+        while True:
+            with self.lock:
+                current = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (current - self.last) * self.rate)
+                self.last = current
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
 def warn_of_error(action):
     """
     Decorator for PrepTweet properties
@@ -201,14 +239,18 @@ def cull_old_files(_dir=None, n_keep=10):
             os.remove(file_path)
 
 
-def get_latest_file(_dir=None):
+def get_latest_file(_dir=None, ext=None):
     """
     Determine the path to the latest backup file
     :param _dir: directory to search
+    :param ext: if given, only consider files with this extension
     :return: path to backup file
     """
     with cd(_dir):
         file_list = os.listdir(".")
+        if ext is not None:
+            file_list = [fn for fn in file_list
+                         if os.path.splitext(fn)[1] == ext]
         file_list.sort(key=date_modified)
         latest_file = file_list[-1]
         return os.path.join(_dir, latest_file)
@@ -264,7 +306,7 @@ def ask_param(param_name, tweet, api=None):
     return str(param)
 
 
-def backup_session(destination_dir, file_name):
+def backup_session(destination_dir, file_name, uid=None):
     """
     Copy the latest session file into the
         backup directory and rename with
@@ -272,6 +314,9 @@ def backup_session(destination_dir, file_name):
     :param destination_dir: the directory into which the
         backed up session file will be placed
     :param file_name: path to file
+    :param uid: suffix for the backup file name. Defaults to
+        the current date and time. Pass the same uid to back up
+        files that belong together (session file and journal).
     :return:
     """
     if not os.path.isfile(file_name):
@@ -280,7 +325,9 @@ def backup_session(destination_dir, file_name):
     if not os.path.isdir(destination_dir):
         os.mkdir(destination_dir)
     basename, extension = os.path.splitext(file_name)
-    uid = "_" + date_string()
+    if uid is None:
+        uid = date_string()
+    uid = "_" + uid
     destination = os.path.join(
         destination_dir,
         basename + uid + extension
@@ -318,6 +365,7 @@ def get_twitter_api(config_file):
         api = Api(sleep_on_rate_limit=True,
                   tweet_mode='extended',
                   **keys)
+        shared_client().mount(api._session)
         return api
     except:
         logger.warning("Unable to connect to Twitter API. "
@@ -366,6 +414,116 @@ def read_json(fn=None):
     return d
 
 
+class JsonObjectStream(object):
+    """
+    Incrementally parse the top level object of a json file,
+    yielding one (key, value) pair at a time.
+
+    Only the value currently being decoded (plus one chunk of
+    the file) is held in memory, so reading a multi-GB session
+    file needs about as much memory as its largest entry.
+    """
+    def __init__(self, fh, chunk_size=2**20):
+        """
+        :param fh: file handle opened in text mode
+        :param chunk_size: number of characters to read at a time
+        """
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.chars_read = 0
+        self.eof = False
+
+    @property
+    def position(self):
+        """
+        Number of characters of the file consumed so far
+        :return: int
+        """
+        return self.chars_read - (len(self.buffer) - self.pos)
+
+    def items(self):
+        """
+        Generate the (key, value) pairs of the top level object
+        :return: generator of tuples
+        """
+        self._expect("{")
+        self._skip_whitespace()
+        if self.buffer.startswith("}", self.pos):
+            self.pos += 1
+            return
+        while True:
+            key = self._decode()
+            if not isinstance(key, str):
+                raise ValueError("Expected a string key at "
+                                 "character {:}".format(self.position))
+            self._expect(":")
+            value = self._decode()
+            yield key, value
+            if self._expect(",}") == "}":
+                return
+
+    def _read_more(self):
+        """
+        Append the next chunk of the file to the buffer
+        Discards the part of the buffer that has been consumed
+        :return: BoolType; False if the end of the file was reached
+        """
+        chunk = self.fh.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.chars_read += len(chunk)
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            self.pos = json.decoder.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._read_more():
+                return
+
+    def _expect(self, characters):
+        """
+        Consume a single structural character
+        :param characters: the characters that are allowed here
+        :return: the character that was consumed
+        """
+        self._skip_whitespace()
+        if self.pos >= len(self.buffer):
+            raise ValueError("Unexpected end of json file")
+        character = self.buffer[self.pos]
+        if character not in characters:
+            raise ValueError("Expected one of '{:}' at character {:}, found '{:}'"
+                             .format(characters, self.position, character))
+        self.pos += 1
+        return character
+
+    def _decode(self):
+        """
+        Decode the next json value, reading more of the file
+        until the whole value is in the buffer.
+        :return: the decoded value
+        """
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._read_more():
+                    continue
+                raise
+            if end == len(self.buffer) and not self.eof and self._read_more():
+                # a value ending exactly at the end of the buffer
+                # (e.g. a number) might continue in the next chunk
+                continue
+            self.pos = end
+            return value
+
+
 def read_csv(fname, default=None):
     """
     Return a list of lists by reading a CSV file
@@ -429,39 +587,124 @@ def grouper(n, iterable):
         yield chunk
 
 
-def rehydrate_tweets(id_list, api):
+def read_rehydration_checkpoint(checkpoint_file, since=None):
+    """
+    Read the IDs of the batches that rehydrate_tweets() completed
+    :param checkpoint_file: path to the checkpoint file
+    :param since: Optional. Only return IDs hydrated at or after this
+        time (seconds since the epoch)
+    :return: set of id strings
+    """
+    done = set()
+    if checkpoint_file is None or not os.path.isfile(checkpoint_file):
+        return done
+    with open(checkpoint_file, "r") as fh:
+        for line in fh:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # partially written last line
+            if since is None or entry["time"] >= since:
+                done.update(entry["ids"])
+    return done
+
+
+def prune_rehydration_checkpoint(checkpoint_file, since):
+    """
+    Drop the batches hydrated before a time from a checkpoint file
+    (see rehydrate_tweets), so that the file does not keep growing.
+    The file is replaced atomically.
+    :param checkpoint_file: path to the checkpoint file
+    :param since: time (seconds since the epoch) of the oldest batch to keep
+    :return: int; number of batches kept
+    """
+    if checkpoint_file is None or not os.path.isfile(checkpoint_file):
+        return 0
+    n = 0
+    temp_file = checkpoint_file + ".tmp"
+    with open(checkpoint_file, "r") as fh, open(temp_file, "w") as out:
+        for line in fh:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry["time"] >= since:
+                out.write(line)
+                n += 1
+    os.replace(temp_file, checkpoint_file)
+    return n
+
+
+def rehydrate_tweets(id_list, api, checkpoint_file=None, since=None, on_batch=None):
     """
     Given a list of tweet ID strings (not integers),
         return a dict of tweets of the form
             {id_str: Status, ...}
+    Tweets are looked up 100 at a time. While one batch is handed to
+    on_batch, the next one is already being requested. When the rate
+    limit is used up, this waits until the limit resets.
     :param id_list: list of strings
     :param api: twitter.Api instance
+    :param checkpoint_file: Optional. Each completed batch is appended to
+        this file (one json line: time and IDs), after on_batch returns.
+        IDs found in it are skipped (see since), so that an interrupted
+        run can be resumed.
+    :param since: Optional. Only skip the IDs that the checkpoint file says
+        were hydrated at or after this time (seconds since the epoch).
+        The older batches are dropped from the file once the run completes.
+        Default: skip every ID in the checkpoint file.
+    :param on_batch: Optional. function(dict of Status instances) that
+        applies a batch of results, e.g. to a TweetList. If given, the
+        results are not kept and the returned dict is empty.
     :return: dict of Status instances
         primary key: id_str
     """
     assert isinstance(api, Api)
     get_status_url = "https://api.twitter.com/1.1/statuses/lookup.json"
+    done = read_rehydration_checkpoint(checkpoint_file, since)
+    if done:
+        logger.info("Skipping {:d} tweets that were already rehydrated".format(len(done)))
+    batches = grouper(100, (id_str for id_str in id_list if id_str not in done))
     api_calls = 0
     output = {}
-    for _ids in grouper(100, id_list):
-        data = {"id": ",".join(_ids)}
-        assert isinstance(api, Api)
+
+    def fetch(_ids):
         rate_lim = api.CheckRateLimit(get_status_url)
         if rate_lim.remaining == 0:
-            time.sleep(60*15)
+            wait = max(rate_lim.reset - time.time(), 0) + 1
+            logger.info("Rate limit reached, waiting {:.0f} seconds".format(wait))
+            time.sleep(wait)
         response = api._RequestUrl(
             get_status_url,
             verb="GET",
-            data=data)
+            data={"id": ",".join(_ids)})
         logger.info("Made Twitter API call")
-        api_calls += 1
-        for tweet_dict in response.json():
-            tweet = Status.NewFromJsonDict(tweet_dict)
-            logger.info("Updated {:}".format(tweet.id_str))
-            output.update({tweet.id_str: tweet})
+        return {tweet.id_str: tweet for tweet in
+                map(Status.NewFromJsonDict, response.json())}
+
+    with ThreadPoolExecutor(1) as executor:
+        _ids = next(batches, None)
+        future = executor.submit(fetch, _ids) if _ids else None
+        while future is not None:
+            tweets = future.result()
+            api_calls += 1
+            next_ids = next(batches, None)
+            next_future = executor.submit(fetch, next_ids) if next_ids else None
+            logger.info("Updated {:d} tweets".format(len(tweets)))
+            if on_batch is not None:
+                on_batch(tweets)
+            else:
+                output.update(tweets)
+            if checkpoint_file is not None:
+                with open(checkpoint_file, "a") as fh:
+                    fh.write(json.dumps({"time": time.time(), "ids": list(_ids)}) + "\n")
+            _ids, future = next_ids, next_future
+    if checkpoint_file is not None and since is not None:
+        prune_rehydration_checkpoint(checkpoint_file, since)
     logger.info("Made {:} API calls".format(api_calls))
     return output
 
+
 def read_rscript_output(id_file):
     """Get IDs of tweets classified as relevant by keyword_classify.R
     Assumes a .csv file with one column and one column header"""
@@ -8,20 +8,26 @@ user interface to ask questions relevant to HIV researchers. Python chosen as
 the language because of the Tornado and Scikit-Learn packages.
 """
 
+import os
+import time
+import threading
 from getpass import getuser
-from preppy.dataobjects import PlaceInfo
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from preppy.dataobjects import PlaceInfo, NLUCache
 from preppy.misc import (
     get_twitter_api, write_json,
     backup_session, make_list, cull_old_files,
     ask_param, MISSING, rehydrate_tweets,
-    get_logger, read_rscript_output, GOOGLE_GEOCODING
+    get_logger, read_rscript_output, GOOGLE_GEOCODING,
+    date_string, TokenBucket, enforce_extension
 )
+from preppy.keyword_classifier import classify_tweets
+from preppy.session_store import is_database
+from preppy.token_cache import TokenCache
 from preppy.metadata import CODE_BOOK, place_of_interest
 from preppy.preptweet import PrepTweet
 from preppy.tweet_list import TweetList
-from preppy.watson import NLU
-from watson_developer_cloud.natural_language_understanding_v1 import Features, SentimentOptions
-from watson_developer_cloud.watson_service import WatsonApiException
+from preppy.watson import NLU, NLUEnricher
 
 
 logger = get_logger(__file__)
@@ -31,24 +37,44 @@ class Preppy(object):
     def __init__(self, session_file_path,
                  backup_dir=None,
                  config_file=None,
-                 place_info="place_info.json"):
+                 place_info="place_info.json",
+                 lazy=False,
+                 nlu_cache="nlu_cache.json"):
         """
         Return an instance of Preppy class
         :param str session_file_path: Name of a session file (optional)
+            A .db or .sqlite file is opened as a SQLiteTweetStore
         :param backup_dir: path to backups directory
         :param config_file: path to configuration file that contains the API keys
         :param place_info: path to the place info file (from PlaceInfo.to_json())
+        :param lazy: If True, keep the stored tweets as raw dicts until
+            their twitter.Status objects are needed (see PrepTweet)
+        :param nlu_cache: path to the NLU response cache (see NLUCache)
         """
         self.session_file_path = session_file_path
-        if session_file_path:
+        self.journal = None
+        if session_file_path and is_database(session_file_path):
+            self.tweets = TweetList.from_database(
+                self.session_file_path, lazy=lazy)
+        elif session_file_path:
             self.tweets = TweetList.from_session_file(
-                self.session_file_path)
+                self.session_file_path, lazy=lazy)
+            self.journal = self.tweets.journal
         else:
             self.tweets = TweetList()
+        # tokenized tweet texts, kept next to the session file
+        self.token_cache = TokenCache.for_session_file(session_file_path) \
+            if session_file_path else TokenCache()
+        self.tweets.attach_token_cache(self.token_cache)
+        # rewrite the whole session file once the journal
+        # exceeds this fraction of the session file size
+        self.compaction_ratio = 0.25
         self.backups_dir = backup_dir
         self.api = get_twitter_api(config_file)
         self.placeinfo = PlaceInfo.from_json(fname=place_info, config_file=config_file)
         self.nlu = NLU(config_file)
+        self.nlu_cache_path = nlu_cache
+        self.nlu_cache = NLUCache.from_json(nlu_cache)
 
     @property
     def as_dict(self):
@@ -92,11 +118,11 @@ class Preppy(object):
         #----------------------------------------------------------------------
 
         :param BoolType lsb: Last Session Backstop.
-            See self.sequentially_search() docstring
+            See self.search_terms() docstring
         :return: NoneType
         """
         self.status_prior(term)
-        self.sequentially_search(term, last_session_backstop=lsb)
+        self.search_terms(term, last_session_backstop=lsb)
         self.status_posterior()
 
     def sequentially_search(self, terms, lang='en',
@@ -128,6 +154,64 @@ class Preppy(object):
             logger.info("Added {:d} tweets related to {:}"
                         .format(n_added, term))
 
+    def search_terms(self, terms, lang='en', last_session_backstop=False,
+                     max_workers=4, calls_per_window=180, window=15 * 60,
+                     max_iter=180):
+        """
+        Search for several terms at once
+        Each term is paged through in its own thread; all threads draw
+        from one rate limit budget of calls_per_window GetSearch calls
+        per window seconds. Every page goes straight into self.tweets.
+        :param {tuple, list} terms: list of search terms
+        :param str lang: Tweet language.
+        :param BoolType last_session_backstop: see sequentially_search()
+        :param max_workers: number of terms searched at the same time
+        :param calls_per_window: search calls allowed per rate limit window
+        :param window: length of the rate limit window in seconds
+        :param max_iter: maximum number of pages per term
+        :return: NoneType. Modifies self.tweets in place
+        """
+        terms = make_list(terms)
+        since_id = self.tweets.max_id \
+            if last_session_backstop else None
+        bucket = TokenBucket(float(calls_per_window) / window,
+                             capacity=calls_per_window)
+        lock = threading.Lock()
+
+        def search(term):
+            query = {
+                "term": term,
+                "count": 100,
+                "lang": lang,
+                "result_type": "recent"
+            }
+            if since_id is not None:
+                query.update({"since_id": since_id})
+            n_added = 0
+            term_min_id = None
+            for _ in range(max_iter):
+                if term_min_id is not None:
+                    query.update({"max_id": str(term_min_id - 1)})
+                bucket.acquire()
+                response = self.api.GetSearch(**query)
+                page_min_id = min((status.id for status in response), default=None)
+                if page_min_id is None or (term_min_id is not None
+                                           and page_min_id >= term_min_id):
+                    break
+                term_min_id = page_min_id
+                with lock:
+                    n_added += self.add_tweets(response)
+            logger.info("Added {:d} tweets related to {:}".format(n_added, term))
+            return n_added
+
+        with ThreadPoolExecutor(max(1, min(max_workers, len(terms)))) as executor:
+            futures = {executor.submit(search, term): term for term in terms}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error("Search for {:} failed: {:}".format(futures[future], e))
+
     def search_single_term(self, query):
         """
         Search using a query dictionary
@@ -167,14 +251,20 @@ class Preppy(object):
         len2 = len(self.tweets)
         return len2 - len1
 
-    def encode_user_location(self, nmax=None, apimax=None):
+    def encode_user_location(self, nmax=None, apimax=100):
         """
         For each tweet that has user location attribute, encode location
         coordinates for that tweet using the PlaceInfo class (which uses
         the Google Geocoding API)
+        The unique user places are geocoded concurrently in one batch
+        (see PlaceInfo.get_coordinates_batch).
+        :param nmax: Optional. Maximum number of tweets to encode
+        :param apimax: Maximum number of Google API calls
+            (a negative number or None for no limit)
         :return: NoneType
         """
-        n = 0
+        max_calls = None if apimax is None or apimax < 0 else apimax
+        candidates = []
         for tweet in self.tweets.tweets.values():
             assert isinstance(tweet, PrepTweet)
             user_place = tweet.user_place
@@ -184,11 +274,25 @@ class Preppy(object):
                     or not tweet.keyword_relevant\
                     or tweet.has_geotag:
                 continue
-            coords = self.placeinfo.get_coordinates(user_place)
+            candidates.append((tweet.id_str, user_place, place_name))
+            if nmax and len(candidates) >= nmax:
+                break
+        coords_by_place = self.placeinfo.get_coordinates_batch(
+            [user_place for _, user_place, _ in candidates],
+            max_calls=max_calls)
+        if max_calls is not None and self.placeinfo.api_counter >= max_calls:
+            logger.info("Hit apimax: %d" % max_calls)
+        n = 0
+        for id_str, user_place, place_name in candidates:
+            if user_place not in coords_by_place:
+                # not geocoded because of apimax
+                continue
+            coords = coords_by_place[user_place]
             msg = "Place Name: {}".format(user_place)
             if coords:
                 msg += ", Coordinates {}".format(coords)
-                tweet.metadata.record(
+                self.tweets.record_metadata(
+                    id_str=id_str,
                     param="user_place_coordinates",
                     user_id=GOOGLE_GEOCODING,
                     value=coords
@@ -196,18 +300,14 @@ class Preppy(object):
             if place_name:
                 # there is some degree of error here which is introduced in place_of_interest() function call
                 msg += ", City {}".format(place_name)
-                tweet.metadata.record(
+                self.tweets.record_metadata(
+                    id_str=id_str,
                     param="user_city",
                     user_id=GOOGLE_GEOCODING,
                     value=place_name
                 )
             n += 1
             logger.info(msg)
-            if n >= nmax:
-                break
-            if self.placeinfo.api_counter >= apimax:
-                logger.info("Hit apimax: %d" % apimax)
-                break
         logger.info("Successfully encoded {} user place coordinates".format(n))
         logger.info("Did so by making {} api calls to Google".format(self.placeinfo.api_counter))
         self.placeinfo.to_json("place_info.json")
@@ -221,63 +321,128 @@ class Preppy(object):
 
         # this should be much safer.
         # pass file as a param, check if it exists, is in the right format, etc.
-        relevant_ids = read_rscript_output("relevant_ids.csv")
+        relevant_ids = set(read_rscript_output("relevant_ids.csv"))
         for ID, tweet in self.tweets.tweets.items():
             assert isinstance(tweet, PrepTweet)
             if ID in relevant_ids:
-                tweet.metadata.record(
+                self.tweets.record_metadata(
+                    id_str=ID,
                     param="relevance",
                     user_id="keyword_classify.R",
                     value=1
                 )
             else:
-                tweet.metadata.record(
+                self.tweets.record_metadata(
+                    id_str=ID,
                     param="relevance",
                     user_id="keyword_classify.R",
                     value=0
                 )
         # TODO add logging information
 
-    def get_nlu_data(self, sample_size=None, randomize=False):
+    def encode_keyword_relevance(self, reclassify=False):
+        """
+        Code the relevance of the tweets with the keyword classifier
+        (the rules of keyword_classify.R, run in python; see
+        preppy.keyword_classifier). Only tweets that have not been
+        keyword classified yet are classified, unless reclassify is True.
+        :param reclassify: If True, classify all tweets again
+        :return: NoneType
+        """
+        classify_tweets(self.tweets, reclassify=reclassify)
+
+    def get_nlu_data(self, sample_size=None, randomize=False,
+                     max_workers=8, checkpoint_every=100):
+        """
+        Run the tweets from get_tweets_for_watson through Watson NLU
+        Tweets whose (normalized) text is in the NLU cache are filled in
+        from it, and tweets with the same text are sent only once.
+        Requests are made concurrently (see NLUEnricher). Results are
+        recorded as they arrive and saved every checkpoint_every tweets,
+        so an interrupted run picks up where it stopped: tweets that
+        have NLU data are not sent again.
+        :param sample_size: number of tweets to analyze
+        :param randomize: pick the tweets at random
+        :param max_workers: number of concurrent requests
+        :param checkpoint_every: number of results between saves
+        :return: float; the fraction of the tweets processed (filled in
+            from the cache or sent) that needed no API call
+        """
         # TODO check if tweet in cities of interest
         # TODO progressbar
-        tweets = self.tweets.get_tweets_for_watson(sample_size, randomize)
-        features = Features(sentiment=SentimentOptions())
-        logger.info(msg="Getting NLU data for %d tweets" % len(tweets))
-        n = 0
+        self.nlu_cache.hits = self.nlu_cache.misses = 0
+        tweets = self.tweets.get_tweets_for_watson(
+            sample_size, randomize, cache=self.nlu_cache)
+        duplicates = {}
         for tweet in tweets:
-            try:
-                response = self.nlu.analyze(features=features, text=tweet.text)
-            except WatsonApiException:
-                logger.info(msg="WatsonApiException on tweet %s" % tweet.id_str)
-                continue
-            except KeyboardInterrupt:
-                logger.info("User interrupted get_nlu_data call on tweet %s" % tweet.id_str)
-                break
-            except Exception as e:
-                logger.error("Unexpected error in get_nlu_data on tweet %s, aborting function call." % tweet.id_str)
-                logger.error("Unexpected error: %s" % e)
-                break
-            else:
+            duplicates.setdefault(NLUCache.key(tweet.text), []).append(tweet)
+        logger.info(msg="Getting NLU data for %d tweets (%d unique texts)"
+                        % (len(tweets), len(duplicates)))
+
+        def record(tweet, response):
+            self.nlu_cache.put(tweet.text, response)
+            for duplicate in duplicates[NLUCache.key(tweet.text)]:
                 self.tweets.record_metadata(
-                    id_str=tweet.id_str,
+                    id_str=duplicate.id_str,
                     param='nlu',
                     user_id='watson_nlu',
                     value=response
                 )
-                n += 1
 
-        logger.info("Successfully got NLU data for %d tweets." % n)
+        enricher = NLUEnricher(self.nlu.analyze, max_workers=max_workers)
+        n, n_failed = enricher.run(
+            [group[0] for group in duplicates.values()],
+            record, self.checkpoint, checkpoint_every)
+        self.nlu_cache.to_json(self.nlu_cache_path)
+        logger.info("Successfully got NLU data for %d texts (%d failed)." % (n, n_failed))
+        # processed: the tweets filled in from the cache and the tweets sent
+        n_total = self.nlu_cache.hits + len(tweets)
+        n_saved = self.nlu_cache.hits + len(tweets) - len(duplicates)
+        if not n_total:
+            return 0.
+        logger.info("NLU cache hit rate %.1f%%; %d of %d tweets (%.1f%%) needed no API call."
+                    % (100. * self.nlu_cache.hit_rate, n_saved, n_total,
+                       100. * n_saved / n_total))
+        return n_saved / n_total
+
+    def checkpoint(self):
+        """
+        Save the changes made so far without rewriting the session file
+        :return: NoneType
+        """
+        if self.tweets.has_store:
+            self.tweets.tweets.commit()
+        elif self.journal is not None:
+            self.journal.flush()
 
-    def rehydrate_tweets(self):
+    def rehydrate_tweets(self, max_age=24 * 3600):
         """
         Rehydrate tweets from web
+        Every batch is saved as soon as it has been applied, and recorded
+        in a checkpoint file next to the session file, so an interrupted
+        run can be started again without repeating the finished batches.
+        :param max_age: tweets rehydrated less than this many seconds
+            ago (according to the checkpoint file) are skipped; older
+            entries are dropped from the file at the end of the run
+        :return: NoneType
         """
         id_list = self.tweets.id_list
-        tweets_dict = rehydrate_tweets(id_list, self.api)
-        tweets_added = len(tweets_dict)
-        logger.info("Rehydrated {:} tweets".format(tweets_added))
-        self.add_tweets(tweets_dict)
+        checkpoint_file = None
+        if self.session_file_path:
+            checkpoint_file = enforce_extension(self.session_file_path, ".rehydrated")
+        counter = [0]
+
+        def apply_batch(tweets_dict):
+            for id_str, status in tweets_dict.items():
+                self.tweets.replace_status(id_str, status)
+            self.checkpoint()
+            counter[0] += len(tweets_dict)
+
+        rehydrate_tweets(id_list, self.api,
+                         checkpoint_file=checkpoint_file,
+                         since=time.time() - max_age,
+                         on_batch=apply_batch)
+        logger.info("Rehydrated {:} tweets".format(counter[0]))
 
     def encode_variable(self,
                         variable_name,
@@ -349,15 +514,56 @@ class Preppy(object):
             if max_tweets != 0 and tweet_count >= max_tweets:
                 break
 
-    def write_session_file(self):
+    def write_session_file(self, compact=None):
+        """
+        Save the current session
+        The changes made during this run are appended to the session
+        journal. The whole session file is only rewritten (and the
+        journal emptied) when the journal has grown large compared to
+        the session file, or when compact is True.
+        :param compact: If True, always rewrite the session file.
+            If None, rewrite it only when the journal is too large.
+        :return: NoneType
+        """
+        self.token_cache.save()
+        if self.tweets.has_store:
+            self.tweets.tweets.commit()
+            return
+        if self.journal is None:
+            write_json(self.as_dict, self.session_file_path)
+            return
+        n = self.journal.flush()
+        logger.info("Saved {:d} changes to {:}".format(n, self.journal.path))
+        if compact or self.journal_needs_compaction():
+            self.compact_session_file()
+
+    def journal_needs_compaction(self):
+        """
+        Say whether the journal should be folded into the session file
+        :return: BoolType
+        """
+        if not os.path.isfile(self.session_file_path):
+            return True
+        session_size = os.path.getsize(self.session_file_path)
+        return self.journal.size > self.compaction_ratio * session_size
+
+    def compact_session_file(self):
         """
-        Write a json file of the current session
+        Rewrite the whole session file and empty the journal
         :return: NoneType
         """
-        output = self.as_dict
-        write_json(output, self.session_file_path)
+        logger.info("Compacting session journal into {:}"
+                    .format(self.session_file_path))
+        write_json(self.as_dict, self.session_file_path)
+        self.journal.discard()
 
     def cleanup_session(self):
         self.write_session_file()
-        backup_session(self.backups_dir, self.session_file_path)
-        cull_old_files(self.backups_dir, n_keep=10)
+        uid = date_string()
+        n_keep = 10
+        if self.journal is not None and self.journal.size > 0:
+            # keep the journal with the session file it applies to
+            backup_session(self.backups_dir, self.journal.path, uid=uid)
+            n_keep *= 2
+        backup_session(self.backups_dir, self.session_file_path, uid=uid)
+        cull_old_files(self.backups_dir, n_keep=n_keep)
@@ -9,7 +9,7 @@ which uses primary keys "metadata" and "tweets".
 """
 
 import os
-from numpy import array, zeros
+from numpy import array, zeros, stack
 from twitter import Status
 from preppy.misc import (
     read_json, ReverseLookup, MISSING,
@@ -28,19 +28,27 @@ regions = ReverseLookup(d["regions"])
 
 
 class PrepTweet(object):
-    def __init__(self, status, metadata=None, **kwargs):
+    def __init__(self, status, metadata=None, lazy=False, **kwargs):
         """
         A class to wrap twitter.Status objects up with
         customizable metadata objects
         :param status: Status or dict returned by Status.AsDict()
         :param metadata: MetaData or dict returned by MetaData.as_dict
-        """
-
+        :param lazy: If True and status is a dict, keep the dict and
+            only build the Status object when self.status is accessed.
+            The properties of this class read the dict directly.
+        """
+        self._status = None
+        self._raw_status = None
+        # bounding box centroid, see coordinates and compute_centroids()
+        self._centroid = None
         if isinstance(status, Status):
-            self.status = status
+            self._status = status
         elif isinstance(status, dict):
-            self.status = Status(**status)
-            self.status = Status(**status)
+            if lazy:
+                self._raw_status = status
+            else:
+                self._status = Status(**status)
 
         if metadata is None:
             self.metadata = MetaData()
@@ -53,26 +61,81 @@ class PrepTweet(object):
             # set attributes for whatever else you want using keyword args
             setattr(self, k.lower(), v)
 
+    @property
+    def status(self):
+        """
+        The twitter.Status object of this tweet
+        Built from the raw dict on first access in lazy mode.
+        :return: Status
+        """
+        if self._status is None and self._raw_status is not None:
+            self._status = Status(**self._raw_status)
+            self._raw_status = None
+        return self._status
+
+    @status.setter
+    def status(self, status):
+        self._status = status
+        self._raw_status = None
+        self._centroid = None
+
+    @property
+    def is_hydrated(self):
+        """
+        Say whether the Status object has been built (see lazy in __init__)
+        :return: BoolType
+        """
+        return self._raw_status is None
+
+    def _bounding_box(self):
+        """
+        The corners of the place bounding box as an array
+        :return: numpy.ndarray
+        """
+        return array(
+            self._status_field("place")
+            ["bounding_box"]
+            ["coordinates"]
+        ).squeeze()
+
+    def _status_field(self, name):
+        """
+        Read one field of the status
+        Reads the raw dict if the Status object has not been built yet
+        (the same value that Status(**dict) would hold).
+        :param name: name of the Status attribute
+        :return: the value of that attribute
+        """
+        if self._raw_status is not None:
+            return self._raw_status.get(name)
+        return getattr(self.status, name)
+
     @property
     def as_dict(self):
         """
         Return a dictionary representation of this object
+        In lazy mode the raw status dict is returned as it was loaded.
         :return: dict
         """
-        return {"status": self.status.AsDict(),
+        if self._raw_status is not None:
+            status = self._raw_status
+        else:
+            status = self.status.AsDict()
+        return {"status": status,
                 "metadata": self.metadata.as_dict}
 
     @classmethod
-    def from_dict(cls, d):
+    def from_dict(cls, d, lazy=False):
         """
         Instantiate this class from a dictionary found in the session file
         for a particular tweet id string.
         :param d: dict returned by self.to_dict()
+        :param lazy: see __init__
         :return:
         """
         assert "status" in d
         assert "metadata" in d
-        return cls(**d)
+        return cls(lazy=lazy, **d)
 
     def has_been_coded_for(self, vname):
         """
@@ -131,7 +194,7 @@ class PrepTweet(object):
         Return the unique ID string of the Tweet
         :return: str
         """
-        return self.status.id_str
+        return self._status_field("id_str")
 
     @property
     @silence_errors_return_nothing
@@ -140,7 +203,7 @@ class PrepTweet(object):
         Return the unique ID (integer) of the Tweet
         :return: int
         """
-        return self.status.id
+        return self._status_field("id")
 
     @property
     @silence_errors_return_nothing
@@ -149,7 +212,7 @@ class PrepTweet(object):
         Return the date that the tweet was created
         :return: str (see DATETIME_FORMATS["TWITTER"])
         """
-        return self.status.created_at
+        return self._status_field("created_at")
 
     @property
     @silence_errors_return_nothing
@@ -158,7 +221,7 @@ class PrepTweet(object):
         Get the unique ID number of the user who tweeted this tweet
         :return: int
         """
-        return self.status.user["id"]
+        return self._status_field("user")["id"]
 
     @property
     @silence_errors_return_nothing
@@ -167,7 +230,7 @@ class PrepTweet(object):
         Get the unique ID number (as a string) of the user who tweeted
         :return:
         """
-        return str(self.status.user['id'])
+        return str(self._status_field("user")['id'])
 
     @property
     @silence_errors_return_nothing
@@ -176,7 +239,7 @@ class PrepTweet(object):
         Return a list of hashtags used in the text of the tweet
         :return: list
         """
-        return [tag["text"] for tag in self.status.hashtags]
+        return [tag["text"] for tag in self._status_field("hashtags")]
 
     @property
     @silence_errors_return_nothing
@@ -198,9 +261,10 @@ class PrepTweet(object):
         :return: str (may contain nuts, unicode emoticons)
         """
 
-        if self.status.full_text:
-            return self.status.full_text
-        elif self.status.text:
+        full_text = self._status_field("full_text")
+        if full_text:
+            return full_text
+        elif self._status_field("text"):
             return self.text
         else:
             return MISSING
@@ -223,7 +287,7 @@ class PrepTweet(object):
             (If available)
         :return: str
         """
-        return self.status.place["full_name"]
+        return self._status_field("place")["full_name"]
 
     @property
     def coordinates(self):
@@ -249,16 +313,14 @@ class PrepTweet(object):
         # Consider whether or not you'd want to output the categorical
         # variable indicating the source of the coordinate data or
         # make the user place coordinates a different property entirely.
+        if self._centroid is not None:
+            return self._centroid
         try:
-            bounding_box = array(
-                self.status.place
-                ["bounding_box"]
-                ["coordinates"]
-            ).squeeze()
-            centroid = bounding_box.mean(axis=0)
-            return centroid
+            centroid = self._bounding_box().mean(axis=0)
         except AttributeError:
             return zeros(2)
+        self._centroid = centroid
+        return centroid
 
     @property
     @silence_errors_return_nothing
@@ -291,7 +353,7 @@ class PrepTweet(object):
         Return the country from which the tweet originates
         :return: str
         """
-        return self.status.place['country']
+        return self._status_field("place")['country']
 
     @property
     def state(self):
@@ -300,13 +362,14 @@ class PrepTweet(object):
         :return: str
         """
         state_code = MISSING
+        place = self._status_field("place")
         try:
-            country_code = self.status.place["country_code"]
+            country_code = place["country_code"]
         except TypeError:
             return MISSING
-        place_type = self.status.place["place_type"]
+        place_type = place["place_type"]
         if country_code == "US" and place_type == "city":
-            full_name = self.status.place["full_name"]
+            full_name = place["full_name"]
             state_code = full_name.split(",")[-1].strip().upper()
             state_code = state_code if state_code in valid_state_codes else MISSING
         else:
@@ -322,7 +385,7 @@ class PrepTweet(object):
         """
 
         try:
-            city = self.status.place["full_name"].strip(r",[A-Z ]")
+            city = self._status_field("place")["full_name"].strip(r",[A-Z ]")
         except TypeError:
             city = None
         if not city:
@@ -348,7 +411,7 @@ class PrepTweet(object):
         Get the place that the user identifies as location in their profile.
         :return: str
         """
-        place = self.status.user['location']
+        place = self._status_field("user")['location']
         return place
 
     @property
@@ -418,3 +481,33 @@ class PrepTweet(object):
     @property
     def doc_sadness(self):
         return self.doc_emotion.get('sadness')
+
+
+def compute_centroids(tweets):
+    """
+    Compute and cache the bounding box centroids (PrepTweet.coordinates)
+    of many tweets at once. Bounding boxes of the same shape are stacked
+    and averaged in a single numpy operation.
+    :param tweets: iterable of PrepTweet objects
+    :return: integer; the number of centroids computed
+    """
+    groups = {}
+    for tweet in tweets:
+        if tweet._centroid is not None:
+            continue
+        try:
+            bounding_box = tweet._bounding_box()
+        except (AttributeError, TypeError, KeyError):
+            continue
+        if bounding_box.dtype.kind not in "iuf":
+            continue
+        groups.setdefault(bounding_box.shape, []).append((tweet, bounding_box))
+    n = 0
+    for shape, members in groups.items():
+        if len(shape) == 0:
+            continue
+        centroids = stack([box for _, box in members]).mean(axis=1)
+        for (tweet, _), centroid in zip(members, centroids):
+            tweet._centroid = centroid
+        n += len(members)
+    return n
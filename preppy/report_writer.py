@@ -1,9 +1,7 @@
 from numpy.random.mtrand import choice, shuffle
-from pandas import DataFrame
 from preppy import (
     TweetList, Preppy
 )
-from preppy.preptweet import PrepTweet
 from preppy.misc import write_json, enforce_extension, get_logger
 
 
@@ -26,7 +24,17 @@ class ReportWriter(object):
                 "session or a TweetList"
             )
         self.tweets = tweets
-        self.table = self.make_table()
+        self._table = None
+
+    @property
+    def table(self):
+        """
+        Table of all tweets (see make_table), built on first use
+        :return: pandas.DataFrame
+        """
+        if self._table is None:
+            self._table = self.make_table()
+        return self._table
 
     def how_many_geotagged(self):
         return self.tweets.n_geotagged
@@ -45,8 +53,9 @@ class ReportWriter(object):
 
     @property
     def table_geo(self):
-        tweets = self.tweets.as_list(only_geo=True)
-        return self.make_table(tweets)
+        columns = self.tweets.columns
+        rows = columns.sorted_rows(mask=columns.array("has_geotag"))
+        return columns.table(rows=rows)
 
     @property
     def table_nlu(self):
@@ -54,25 +63,19 @@ class ReportWriter(object):
         return self.make_table(tweets)
 
     def country_counts(self, min_count=5):
-        table = self.table
-        counts = table.country.value_counts()
+        counts = self.tweets.columns.counts("country")
         if min_count > 0:
             counts = counts[counts >= min_count]
         return counts
 
     def state_counts(self, min_count=5):
-        table = self.table
-        counts = table.state.value_counts()
+        counts = self.tweets.columns.counts("state")
         if min_count > 0:
             counts = counts[counts >= min_count]
         return counts
 
     def unique_states(self):
-        table = self.table
-        state_set = set(table.state)
-        state_set.difference_update([None])
-        states = sorted(list(state_set))
-        return states
+        return sorted(self.tweets.columns.counts("state").index)
 
     def make_table(self, tweets=None):
         """
@@ -82,54 +85,19 @@ class ReportWriter(object):
         To add a column to this report, write a property in PrepTweet class that
         can extract the information you want from itself.
 
-        Then add a tuple to the column_getters tuple:
+        Then add a tuple to REPORT_COLUMNS in preppy.tweet_columns:
         tuple[0] should contain the column name
         tuple[1] should contain the name of the property that will
             be called (using getattr)
 
-        :param tweets: list of Tweets (twitter.Status instances)
+        The values come from the column projection of the TweetList
+        (TweetList.columns), so each tweet is only evaluated once.
+
+        :param tweets: list of Tweets (PrepTweet instances)
+            If None, all tweets sorted by ID.
         :return: pandas.DataFrame
         """
-        if tweets is None:
-            tweets = self.tweets.as_list()
-
-        # Add column names and information getter functions here.
-        column_getters = (
-            ("id_string", "id_str"),
-            ("date", "date"),
-            ("user", "user_id_str"),
-            ("place", "place"),
-            ("user_place", "user_place"),
-            ("country", "country"),
-            ("longitude", "longitude"),
-            ("latitude", "latitude"),
-            ("city", "city"),
-            ("state", "state"),
-            ("us_region", "region"),
-            ("text", "text"),
-            ("hashtags", "hashtags"),
-            ("relevance", "is_relevant"),
-            ('doc_sentiment_score', 'doc_sentiment_score'),
-            ('doc_sentiment_lab', 'doc_sentiment_lab')
-        )
-        column_order = [column_getter[0]
-                        for column_getter
-                        in column_getters]
-        # -----------------------------------------------------------
-        output_dict = {
-            col_name: [
-                getattr(tweet, tweet_property_name)
-                for tweet in tweets
-            ]
-            for col_name, tweet_property_name
-            in column_getters
-        }
-        # This dict comprehension with nested list comprehensions is
-        # clever but hard to read. Don't be so obsessively Pythonic.
-        # -----------------------------------------------------------
-        output = DataFrame.from_dict(output_dict)
-        output = output[column_order]
-        return output
+        return self.tweets.columns.table(tweets)
 
     def hashtag_table(self, output_file_name=None, min_freq=None):
         """
@@ -151,10 +119,9 @@ class ReportWriter(object):
         SPECIFICITY = "SPECIFICITY"
         hashtag_table = {}
 
-        for tweet in self.tweets.as_list():
-            assert isinstance(tweet, PrepTweet)
-            relevant = tweet.relevance
-            hashtags = tweet.hashtags
+        columns = self.tweets.columns
+        for hashtags, relevant in zip(columns.values["hashtags"],
+                                      columns.values["relevance_by_coder"]):
             if not hashtags:
                 continue
             for tag in hashtags:
@@ -194,6 +161,75 @@ class ReportWriter(object):
             write_json(output, output_file_name)
         return output
 
+    def write_reports(self, all_path=None, geo_path=None, hashtag_path=None,
+                      geotagged_path=None, fmt='csv', min_freq=10, min_count=5,
+                      escape_newlines=True):
+        """
+        Write several reports from a single pass over the tweets
+        Every output is derived from the column projection of the
+        tweets (TweetList.columns), which visits each tweet once. The
+        files are the same as those of write_report_all, write_report_geo,
+        hashtag_table and TweetList.export_geotagged_tweets.
+        :param all_path: Optional. Path of the report of all tweets
+        :param geo_path: Optional. Path of the report of the geotagged tweets
+        :param hashtag_path: Optional. Path of the hashtag frequency json file
+        :param geotagged_path: Optional. Path of the geotagged tweets json file
+        :param fmt: format of the tabular reports ('csv', 'excel' or 'parquet')
+        :param min_freq: see hashtag_table
+        :param min_count: see country_counts
+        :param escape_newlines: see write_report_all
+        :return: dict of summaries: n_geotagged, country_counts,
+            state_counts and unique_states
+        """
+        columns = self.tweets.columns
+        rows = columns.sorted_rows()
+        geo_rows = rows[columns.array("has_geotag")[rows]]
+        if geotagged_path is not None:
+            id_strs = columns.values["id_string"]
+            write_json({id_strs[i]: self.tweets[id_strs[i]].as_dict
+                        for i in geo_rows}, geotagged_path)
+        if all_path is not None:
+            self._write_report(all_path, fmt, rows=rows,
+                               escape_newlines=escape_newlines)
+        if geo_path is not None:
+            self._write_report(geo_path, fmt, rows=geo_rows,
+                               escape_newlines=escape_newlines)
+        if hashtag_path is not None:
+            self.hashtag_table(hashtag_path, min_freq=min_freq)
+        return {
+            "n_geotagged": len(geo_rows),
+            "country_counts": self.country_counts(min_count),
+            "state_counts": self.state_counts(min_count),
+            "unique_states": self.unique_states()
+        }
+
+    def _write_report(self, path, fmt, tweets=None, rows=None,
+                      escape_newlines=False):
+        """
+        Write a report table in the given format
+        csv and parquet reports are streamed from the column projection
+        (see TweetColumns.write_csv, TweetColumns.write_parquet);
+        excel reports go through a pandas.DataFrame.
+        :param path: path of the file to write
+        :param fmt: 'csv', 'excel' (also 'xls') or 'parquet'
+        :param tweets: Optional. See TweetColumns.table
+        :param rows: Optional. See TweetColumns.table
+        :param escape_newlines: see TweetColumns.write_csv (csv only)
+        :return: NoneType
+        """
+        columns = self.tweets.columns
+        if fmt == 'csv':
+            columns.write_csv(path, tweets=tweets, rows=rows,
+                              escape_newlines=escape_newlines)
+        elif fmt == "excel" or fmt == "xls":
+            columns.table(tweets, rows).to_excel(path)
+        elif fmt == "parquet":
+            columns.write_parquet(path, tweets=tweets, rows=rows)
+        else:
+            raise IOError("{:} is not a valid "
+                          "output format for this "
+                          "report.".format(fmt))
+
     def select_factors(self):
         """
         Use the relevance data in conjunction with hashtag presence
@@ -210,15 +246,13 @@ class ReportWriter(object):
 
         :return: list of strings
         """
-        relevant_words = {}  # a set
-        for tweet in self.tweets.relevant:
-            assert isinstance(tweet, PrepTweet)
-            relevant_words.update(tweet.text.split())
-
-        irrelevant_words = {}  # a set
-        for tweet in self.tweets.irrelevant:
-            assert isinstance(tweet, PrepTweet)
-            irrelevant_words.update(tweet.text.split())
+        relevant_words = set()
+        for words in self.tweets.documents(self.tweets.relevant):
+            relevant_words.update(words or ())
+
+        irrelevant_words = set()
+        for words in self.tweets.documents(self.tweets.irrelevant):
+            irrelevant_words.update(words or ())
         return None
 
     def write_report_nlu(self, path, fmt='csv'):
@@ -229,17 +263,10 @@ class ReportWriter(object):
         :return:
         """
 
-        report = self.table_nlu
-        if fmt == 'csv':
-            report.to_csv(path)
-        elif fmt == "excel" or fmt == "xls":
-            report.to_excel(path)
-        else:
-            raise IOError("{:} is not a valid "
-                          "output format for this "
-                          "report.".format(fmt))
+        tweets = self.tweets.as_list(coded_for="nlu")
+        self._write_report(path, fmt, tweets=tweets)
 
-    def write_report_geo(self, path, fmt='csv'):
+    def write_report_geo(self, path, fmt='csv', escape_newlines=True):
         """
         Write a tabular report containing the tweets and their metadata
         only including geotagged tweets (geotaggedness determined from
@@ -247,17 +274,13 @@ class ReportWriter(object):
         a dict if the tweet is geotagged.
         :param path:
         :param fmt:
+        :param escape_newlines: see write_report_all
         :return:
         """
-        report = self.table_geo
-        if fmt == 'csv':
-            report.to_csv(path)
-        elif fmt == "excel" or fmt == "xls":
-            report.to_excel(path)
-        else:
-            raise IOError("{:} is not a valid "
-                          "output format for this "
-                          "report.".format(fmt))
+        columns = self.tweets.columns
+        rows = columns.sorted_rows(mask=columns.array("has_geotag"))
+        self._write_report(path, fmt, rows=rows,
+                           escape_newlines=escape_newlines)
 
     def write_report_coded(self, path, fmt=None):
         """
@@ -270,28 +293,21 @@ class ReportWriter(object):
             fmt = 'csv'
         tweets = self.tweets.relevant + self.tweets.irrelevant
         shuffle(tweets)
-        report = self.make_table(tweets)
-        if fmt == "csv":
-            report.to_csv(path)
-        elif fmt == "excel" or fmt == "xls":
-            report.to_excel(path)
-        else:
-            raise IOError("{:} is not a valid "
-                          "output format for this "
-                          "report.".format(fmt))
+        self._write_report(path, fmt, tweets=tweets)
 
-    def write_report_all(self, path, fmt=None):
+    def write_report_all(self, path, fmt=None, escape_newlines=True):
+        """
+        Write a tabular report of all tweets, sorted by ID
+        :param path: file path of the report
+        :param fmt: 'csv' (default), 'excel' or 'parquet'
+        :param escape_newlines: If True (default), line breaks in the text
+            are written as \\n so that each tweet is on one line, as
+            scripts/keyword_classify.R expects (csv only)
+        :return: NoneType
+        """
         if fmt is None:
             fmt = 'csv'
-        report = self.make_table()
-        if fmt == 'csv':
-            report.to_csv(path)
-        elif fmt == "excel" or fmt == "xls":
-            report.to_excel(path)
-        else:
-            raise IOError("{:} is not a valid "
-                          "output format for this "
-                          "report.".format(fmt))
+        self._write_report(path, fmt, escape_newlines=escape_newlines)
 
     def get_random_tweet(self):
         id_str = choice(self.tweets.id_list)
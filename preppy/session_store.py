@@ -0,0 +1,290 @@
+"""
+An indexed, on-disk alternative to the json session file.
+
+SQLiteTweetStore keeps every tweet (status and metadata) in a local
+SQLite database and behaves like the {id_str: PrepTweet} dict that
+TweetList normally holds, so it can be dropped in behind TweetList:
+
+    tweets = TweetList(store=SQLiteTweetStore("preppy_session.db"))
+
+Alongside the json blobs, each row stores a few derived columns
+(geotag status, keyword relevance, NLU status, city of interest) and
+the coded variables go into their own table. These are indexed, so
+the common TweetList filters run as index lookups and only the
+matching tweets are ever turned into PrepTweet objects.
+
+Use migrate_session_file() to convert a Format III json session file
+(and its journal) into a database.
+"""
+
+import os
+import json
+import sqlite3
+from collections.abc import MutableMapping
+from preppy.misc import get_logger, grouper, JsonObjectStream
+from preppy.metadata import place_of_interest
+from preppy.preptweet import PrepTweet
+from preppy.journal import SessionJournal
+from preppy.tweet_list import TweetList
+
+
+logger = get_logger(__file__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tweets (
+    id_str TEXT PRIMARY KEY,
+    id INTEGER,
+    status TEXT,
+    metadata TEXT,
+    has_geotag INTEGER,
+    keyword_relevant INTEGER,
+    has_nlu INTEGER,
+    city_of_interest TEXT
+);
+CREATE INDEX IF NOT EXISTS tweets_id ON tweets (id);
+CREATE INDEX IF NOT EXISTS tweets_geotag ON tweets (has_geotag);
+CREATE INDEX IF NOT EXISTS tweets_watson
+    ON tweets (keyword_relevant, has_nlu, city_of_interest);
+CREATE TABLE IF NOT EXISTS coded (
+    id_str TEXT,
+    variable TEXT,
+    coder TEXT,
+    PRIMARY KEY (id_str, variable, coder)
+);
+CREATE INDEX IF NOT EXISTS coded_variable ON coded (variable, coder);
+"""
+
+
+DATABASE_EXTENSIONS = (".db", ".sqlite")
+
+
+def is_database(file_name):
+    """
+    Say whether a session file name refers to a tweet database
+    :param file_name: path to the session file
+    :return: BoolType
+    """
+    return os.path.splitext(file_name)[1] in DATABASE_EXTENSIONS
+
+
+class SQLiteTweetStore(MutableMapping):
+    def __init__(self, path, lazy=False):
+        """
+        Open (or create) a tweet database
+        :param path: path to the SQLite database file
+        :param lazy: If True, tweets read from the database keep their
+            raw status dicts (see PrepTweet)
+        """
+        self.path = path
+        self.lazy = lazy
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def __repr__(self):
+        return "SQLiteTweetStore({:})".format(self.path)
+
+    # ----------------------------------------------------------------
+    # - Mapping interface -
+    # ----------------------------------------------------------------
+
+    def __getitem__(self, id_str):
+        row = self.connection.execute(
+            "SELECT status, metadata FROM tweets WHERE id_str = ?",
+            (id_str,)).fetchone()
+        if row is None:
+            raise KeyError(id_str)
+        return self._to_tweet(*row)
+
+    def __setitem__(self, id_str, tweet):
+        self._put_many([(id_str, tweet)])
+
+    def __delitem__(self, id_str):
+        if id_str not in self:
+            raise KeyError(id_str)
+        self.connection.execute("DELETE FROM tweets WHERE id_str = ?", (id_str,))
+        self.connection.execute("DELETE FROM coded WHERE id_str = ?", (id_str,))
+
+    def __contains__(self, id_str):
+        row = self.connection.execute(
+            "SELECT 1 FROM tweets WHERE id_str = ?", (id_str,)).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        for (id_str,) in self.connection.execute("SELECT id_str FROM tweets"):
+            yield id_str
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM tweets").fetchone()[0]
+
+    def items(self):
+        for id_str, status, metadata in self.connection.execute(
+                "SELECT id_str, status, metadata FROM tweets"):
+            yield id_str, self._to_tweet(status, metadata)
+
+    def values(self):
+        for id_str, tweet in self.items():
+            yield tweet
+
+    def update(self, other=(), **kwargs):
+        """
+        Insert or replace many tweets in a single transaction
+        :param other: dict or iterable of (id_str, PrepTweet) pairs
+        :return: NoneType
+        """
+        pairs = other.items() if hasattr(other, "items") else other
+        self._put_many(pairs)
+        self._put_many(kwargs.items())
+        self.commit()
+
+    # ----------------------------------------------------------------
+    # - Queries -
+    # ----------------------------------------------------------------
+
+    def select(self, geotagged=None, keyword_relevant=None, has_nlu=None,
+               of_interest=None, coded_for=None, coded_by=None):
+        """
+        Return the tweets that match all of the given criteria
+        Criteria that are None are ignored.
+        :param geotagged: BoolType; see PrepTweet.has_geotag
+        :param keyword_relevant: BoolType; see PrepTweet.keyword_relevant
+        :param has_nlu: BoolType; see PrepTweet.has_nlu
+        :param of_interest: BoolType; whether the city of the tweet
+            is one of the cities of interest (see place_of_interest)
+        :param coded_for: name of a variable the tweet has been coded for
+        :param coded_by: name of the coder of coded_for
+        :return: list of PrepTweet instances, sorted by id
+        """
+        query, parameters = self._where(geotagged, keyword_relevant, has_nlu,
+                                        of_interest, coded_for, coded_by)
+        rows = self.connection.execute(
+            "SELECT status, metadata FROM tweets" + query + " ORDER BY id",
+            parameters)
+        return [self._to_tweet(status, metadata) for status, metadata in rows]
+
+    def count(self, **criteria):
+        """
+        Count the tweets that match the given criteria
+        :param criteria: see select()
+        :return: int
+        """
+        query, parameters = self._where(**criteria)
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM tweets" + query, parameters).fetchone()[0]
+
+    def id_range(self):
+        """
+        The smallest and largest tweet ID in the store
+        :return: tuple of ints (None, None) if the store is empty
+        """
+        return self.connection.execute(
+            "SELECT MIN(id), MAX(id) FROM tweets").fetchone()
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    # ----------------------------------------------------------------
+    # - Protected methods -
+    # ----------------------------------------------------------------
+
+    @staticmethod
+    def _where(geotagged=None, keyword_relevant=None, has_nlu=None,
+               of_interest=None, coded_for=None, coded_by=None):
+        """
+        Build the WHERE clause for select() and count()
+        :return: tuple (str, list of query parameters)
+        """
+        clauses = []
+        parameters = []
+        for column, value in (("has_geotag", geotagged),
+                              ("keyword_relevant", keyword_relevant),
+                              ("has_nlu", has_nlu)):
+            if value is not None:
+                clauses.append("{:} = ?".format(column))
+                parameters.append(int(bool(value)))
+        if of_interest is not None:
+            clauses.append("city_of_interest IS {:}NULL"
+                           .format("NOT " if of_interest else ""))
+        if coded_for is not None:
+            sub_query = "SELECT id_str FROM coded WHERE variable = ?"
+            parameters.append(coded_for.lower())
+            if coded_by is not None:
+                sub_query += " AND coder = ?"
+                parameters.append(coded_by)
+            clauses.append("id_str IN ({:})".format(sub_query))
+        if not clauses:
+            return "", parameters
+        return " WHERE " + " AND ".join(clauses), parameters
+
+    def _to_tweet(self, status, metadata):
+        return PrepTweet(json.loads(status), json.loads(metadata), lazy=self.lazy)
+
+    def _put_many(self, pairs):
+        """
+        Insert or replace (id_str, PrepTweet) pairs
+        :return: NoneType
+        """
+        tweet_rows = []
+        coded_rows = []
+        id_strs = []
+        for id_str, tweet in pairs:
+            if not isinstance(tweet, PrepTweet):
+                tweet = PrepTweet(tweet)
+            tweet_rows.append(self._tweet_row(id_str, tweet))
+            coded_rows.extend(self._coded_rows(id_str, tweet))
+            id_strs.append((id_str,))
+        self.connection.executemany(
+            "DELETE FROM coded WHERE id_str = ?", id_strs)
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO tweets VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            tweet_rows)
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO coded VALUES (?, ?, ?)", coded_rows)
+
+    @staticmethod
+    def _tweet_row(id_str, tweet):
+        as_dict = tweet.as_dict
+        city = place_of_interest(tweet.city) or None
+        return (id_str,
+                tweet.id,
+                json.dumps(as_dict["status"]),
+                json.dumps(as_dict["metadata"]),
+                int(bool(tweet.has_geotag)),
+                int(bool(tweet.keyword_relevant)),
+                int(bool(tweet.has_nlu)),
+                city)
+
+    @staticmethod
+    def _coded_rows(id_str, tweet):
+        for variable, coders in tweet.metadata.as_dict.items():
+            if isinstance(coders, dict):
+                for coder in coders:
+                    yield id_str, variable, str(coder)
+
+
+def migrate_session_file(session_file_name, database_name, batch_size=1000):
+    """
+    One-shot migration of a Format III json session file
+    (and its journal, if there is one) into a SQLiteTweetStore
+    :param session_file_name: path to the json session file
+    :param database_name: path to the database to create or update
+    :param batch_size: number of tweets inserted per transaction
+    :return: SQLiteTweetStore
+    """
+    store = SQLiteTweetStore(database_name)
+    n = 0
+    with open(session_file_name, "r") as fh:
+        entries = JsonObjectStream(fh).items()
+        for batch in grouper(batch_size, entries):
+            store.update(
+                (id_str, PrepTweet.from_dict(entry))
+                for id_str, entry in batch)
+            n += len(batch)
+            logger.info("Migrated {:d} tweets into {:}".format(n, database_name))
+    SessionJournal.for_session_file(session_file_name).replay(TweetList(store=store))
+    store.commit()
+    return store
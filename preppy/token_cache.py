@@ -0,0 +1,272 @@
+"""
+A persisted cache of tokenized tweet texts.
+
+TokenCache splits every tweet text into words once (like PrepTweet.words),
+interns the words in a Vocabulary and keeps, for each tweet, an array of
+token IDs (column numbers of that vocabulary). The cache lives next to
+the session file (preppy_session.tokens.npz), so text features never
+re-tokenize an unchanged tweet across runs:
+
+    cache = TokenCache.for_session_file("preppy_session.json")  # read when first needed
+    tweet_list.attach_token_cache(cache)  # new tweets are tokenized as they are added
+    x = cache.matrix(tweets)  # document-term matrix over cache.vocabulary
+    cache.save()  # once, at the end of the run
+
+A crc32 fingerprint of each text is stored with its tokens, so tweets
+whose text has changed (e.g. replaced by rehydration) are tokenized again.
+Until a text feature reads the cache, added tweets are not tokenized and
+save() leaves the file alone; they are tokenized when they are first used.
+
+The npz file holds plain arrays only (no pickles):
+    vocabulary      utf-8 bytes of the words, separated by newlines
+    ids             int64 tweet IDs
+    fingerprints    uint32 crc32 of each text
+    offsets         int64; tokens[offsets[i]:offsets[i + 1]] belong to ids[i]
+    tokens          int32 token IDs
+"""
+
+import os
+import zlib
+import numpy
+from scipy.sparse import csr_matrix
+from preppy.features import Vocabulary
+from preppy.misc import get_logger, enforce_extension
+
+
+logger = get_logger(__file__)
+
+
+TOKEN_CACHE_VERSION = 1
+
+
+def token_cache_file_name(session_file_name):
+    """
+    Name of the token cache file that belongs to a session file
+    :param session_file_name: path to the session file
+    :return: str
+    """
+    return enforce_extension(session_file_name, ".tokens.npz")
+
+
+def tokenize(text):
+    """
+    Split a tweet text into words (see PrepTweet.words)
+    :param text: str or None
+    :return: list of strings
+    """
+    if not isinstance(text, str):
+        return []
+    return text.split()
+
+
+def text_fingerprint(text):
+    """
+    :param text: str or None
+    :return: int; crc32 of the utf-8 text (0 for None)
+    """
+    if not isinstance(text, str):
+        return 0
+    return zlib.crc32(text.encode("utf-8", "surrogatepass"))
+
+
+class TokenCache(object):
+    def __init__(self, path=None, lazy=False):
+        """
+        An empty token cache
+        :param path: file to save the cache to (see save())
+        :param lazy: If True, read the cache from path the first time
+            tokens are needed (see for_session_file)
+        """
+        self.path = path
+        self._vocabulary = Vocabulary()
+        self._tokens = {}  # id_str: int32 array of token IDs
+        self._fingerprints = {}  # id_str: crc32 of the tokenized text
+        self._loaded = not lazy
+        self.changed = False
+
+    @property
+    def vocabulary(self):
+        self._ensure_loaded()
+        return self._vocabulary
+
+    @property
+    def tokens(self):
+        self._ensure_loaded()
+        return self._tokens
+
+    @property
+    def fingerprints(self):
+        self._ensure_loaded()
+        return self._fingerprints
+
+    @classmethod
+    def for_session_file(cls, session_file_name):
+        """
+        The token cache that belongs to a session file
+        The file is only read when tokens are first needed, so runs
+        that do not use text features do not pay for it.
+        :param session_file_name: path to the session file
+        :return: an instance of this class (empty if there is no cache yet)
+        """
+        return cls(token_cache_file_name(session_file_name), lazy=True)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a token cache written by save()
+        A missing or unreadable file gives an empty cache.
+        :param path: path to the npz file
+        :return: an instance of this class
+        """
+        cache = cls(path, lazy=True)
+        cache._ensure_loaded()
+        return cache
+
+    def save(self, path=None):
+        """
+        Write the cache to an npz file, if it has changed
+        The file is replaced atomically. The whole cache is written, so
+        save at the end of a run (see Preppy.write_session_file) rather
+        than after every change. A cache that was never read is not
+        written: nothing has been tokenized in this run.
+        :param path: path to the npz file (default: self.path)
+        :return: BoolType; whether the file was written
+        """
+        path = path or self.path
+        if path is None:
+            return False
+        if path == self.path:
+            if not self._loaded:
+                return False
+            if not self.changed and os.path.isfile(path):
+                return False
+        self._ensure_loaded()
+        id_strs = list(self._tokens.keys())
+        lengths = numpy.fromiter((len(self._tokens[id_str]) for id_str in id_strs),
+                                 dtype=numpy.int64, count=len(id_strs))
+        offsets = numpy.zeros(len(id_strs) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        tokens = numpy.concatenate([self._tokens[id_str] for id_str in id_strs]) \
+            if id_strs else numpy.zeros(0, dtype=numpy.int32)
+        vocabulary = "\n".join(self._vocabulary.words).encode("utf-8", "surrogatepass")
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as fh:
+            numpy.savez(
+                fh,
+                version=numpy.array(TOKEN_CACHE_VERSION),
+                vocabulary=numpy.frombuffer(vocabulary, dtype=numpy.uint8),
+                ids=numpy.array([int(id_str) for id_str in id_strs], dtype=numpy.int64),
+                fingerprints=numpy.array([self._fingerprints[id_str] for id_str in id_strs],
+                                         dtype=numpy.uint32),
+                offsets=offsets,
+                tokens=tokens.astype(numpy.int32, copy=False)
+            )
+        os.replace(temp_path, path)
+        self.path = path
+        self.changed = False
+        return True
+
+    def update(self, tweets):
+        """
+        Tokenize the tweets that are new to the cache or whose text has changed
+        :param tweets: iterable of PrepTweet objects
+        :return: int; number of tweets tokenized (0 if the cache has not
+            been read yet: the tweets are then tokenized when first used)
+        """
+        if not self._loaded:
+            return 0
+        n = 0
+        for tweet in tweets:
+            text = tweet.text
+            fingerprint = text_fingerprint(text)
+            id_str = tweet.id_str
+            if self.fingerprints.get(id_str) == fingerprint and id_str in self.tokens:
+                continue
+            self._tokenize(id_str, text, fingerprint)
+            n += 1
+        return n
+
+    def token_ids(self, tweet):
+        """
+        The token IDs of a tweet, tokenizing it if it is not in the cache
+        or its text has changed
+        :param tweet: PrepTweet
+        :return: int32 array
+        """
+        text = tweet.text
+        fingerprint = text_fingerprint(text)
+        tokens = self.tokens.get(tweet.id_str)
+        if tokens is None or self._fingerprints[tweet.id_str] != fingerprint:
+            tokens = self._tokenize(tweet.id_str, text, fingerprint)
+        return tokens
+
+    def words(self, tweet):
+        """
+        The words of a tweet (the same as PrepTweet.words)
+        :param tweet: PrepTweet
+        :return: list of strings
+        """
+        words = self.vocabulary.words
+        return [words[i] for i in self.token_ids(tweet).tolist()]
+
+    def documents(self, tweets):
+        """
+        :param tweets: iterable of PrepTweet objects
+        :return: list of lists of words, one per tweet
+        """
+        return [self.words(tweet) for tweet in tweets]
+
+    def matrix(self, tweets, dtype=numpy.int8):
+        """
+        The document-term matrix of some tweets over the whole vocabulary
+        of the cache, built from the token IDs without touching the words
+        (the same as document_term_matrix(documents, self.vocabulary)).
+        :param tweets: iterable of PrepTweet objects
+        :param dtype: numpy dtype of the matrix
+        :return: scipy.sparse.csr_matrix of shape (tweets, len(self.vocabulary))
+        """
+        rows = [numpy.unique(self.token_ids(tweet)) for tweet in tweets]
+        indptr = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(row) for row in rows], out=indptr[1:])
+        indices = numpy.concatenate(rows).astype(numpy.int32, copy=False) \
+            if rows else numpy.zeros(0, dtype=numpy.int32)
+        return csr_matrix((numpy.ones(len(indices), dtype=dtype), indices, indptr),
+                          shape=(len(rows), len(self.vocabulary)))
+
+    def _ensure_loaded(self):
+        """
+        Read the cache file, if that has not been done yet
+        :return: NoneType
+        """
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.path is not None and os.path.isfile(self.path):
+            self._read(self.path)
+
+    def _read(self, path):
+        try:
+            with numpy.load(path) as npz:
+                if int(npz["version"]) != TOKEN_CACHE_VERSION:
+                    raise ValueError("Unknown token cache version {}".format(npz["version"]))
+                text = npz["vocabulary"].tobytes().decode("utf-8", "surrogatepass")
+                ids, fingerprints = npz["ids"], npz["fingerprints"]
+                offsets, tokens = npz["offsets"], npz["tokens"]
+        except (IOError, ValueError, KeyError) as e:
+            logger.warning("Ignoring token cache {:}: {:}".format(path, e))
+            return
+        self._vocabulary.update(text.split("\n") if text else [])
+        for i, (id_int, fingerprint) in enumerate(zip(ids.tolist(), fingerprints.tolist())):
+            id_str = str(id_int)
+            self._tokens[id_str] = tokens[offsets[i]:offsets[i + 1]]
+            self._fingerprints[id_str] = fingerprint
+        logger.info("Loaded the tokens of {:d} tweets from {:}".format(len(self._tokens), path))
+
+    def _tokenize(self, id_str, text, fingerprint):
+        words = tokenize(text)
+        tokens = numpy.fromiter(map(self._vocabulary.add, words),
+                                dtype=numpy.int32, count=len(words))
+        self._tokens[id_str] = tokens
+        self._fingerprints[id_str] = fingerprint
+        self.changed = True
+        return tokens
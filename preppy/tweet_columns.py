@@ -0,0 +1,478 @@
+"""
+A column oriented projection of a TweetList for reporting.
+
+Each report column is extracted from every PrepTweet exactly once and
+kept in a list, from which the reports are written as they are. Typed
+numpy arrays are made the first time a column is asked for (int64 ids,
+datetime64 dates, float64 coordinates and relevance, categorical
+country, state and region) and are then kept up to date: when tweets
+are added or their metadata changes, only those rows are extracted
+again and converted into the arrays (see TweetList.columns).
+"""
+
+import os
+import csv
+from datetime import datetime
+from numbers import Integral, Real
+from numpy import array, argsort, bincount, datetime64, empty, nan
+from pandas import Categorical, DataFrame, Index, Series
+from preppy.preptweet import compute_centroids
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # parquet reports are optional
+    pyarrow = None
+
+
+# (column name, PrepTweet property) in report order.
+# To add a column to the reports, write a property in PrepTweet
+# and add a tuple here.
+REPORT_COLUMNS = (
+    ("id_string", "id_str"),
+    ("date", "date"),
+    ("user", "user_id_str"),
+    ("place", "place"),
+    ("user_place", "user_place"),
+    ("country", "country"),
+    ("longitude", "longitude"),
+    ("latitude", "latitude"),
+    ("city", "city"),
+    ("state", "state"),
+    ("us_region", "region"),
+    ("text", "text"),
+    ("hashtags", "hashtags"),
+    ("relevance", "is_relevant"),
+    ('doc_sentiment_score', 'doc_sentiment_score'),
+    ('doc_sentiment_lab', 'doc_sentiment_lab')
+)
+
+# Columns that are kept for filtering but are not part of the reports
+EXTRA_COLUMNS = (
+    ("has_geotag", "has_geotag"),
+    ("relevance_by_coder", "relevance"),
+)
+
+FLOAT_COLUMNS = ("longitude", "latitude", "relevance", "doc_sentiment_score")
+
+# Columns with few distinct values, kept as category codes (see TweetColumns.array)
+CATEGORY_COLUMNS = ("country", "state", "us_region")
+
+# created_at, e.g. "Wed Oct 10 20:19:24 +0000 2018"
+TWITTER_DATE_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+
+def parse_date(value):
+    """
+    :param value: created_at string (see TWITTER_DATE_FORMAT) or None
+    :return: timezone aware datetime, or None if value is not a date
+    """
+    try:
+        return datetime.strptime(value, TWITTER_DATE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def parquet_schema():
+    """
+    The schema of the parquet reports: the report columns with a
+    leading integer "id" column, typed dates, floats and hashtag lists
+    (all other columns are strings)
+    :return: pyarrow.Schema
+    """
+    types = {
+        "date": pyarrow.timestamp("ms", tz="UTC"),
+        "hashtags": pyarrow.list_(pyarrow.string())
+    }
+    types.update((name, pyarrow.float64()) for name in FLOAT_COLUMNS)
+    return pyarrow.schema(
+        [("id", pyarrow.int64())] +
+        [(name, types.get(name, pyarrow.string())) for name, _ in REPORT_COLUMNS])
+
+
+def parquet_value(value, name):
+    """
+    Convert a report value to the type of its parquet column
+    Values that do not fit the column type become null.
+    :param value: the value
+    :param name: name of the column
+    :return: the converted value
+    """
+    if value is None:
+        return None
+    try:
+        if name == "date":
+            return parse_date(value)
+        if name in FLOAT_COLUMNS:
+            return float(value)
+        if name == "hashtags":
+            return [str(tag) for tag in value]
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+class ColumnKind(object):
+    """
+    The type that pandas gives a column made of the values seen by
+    add(), which decides how DataFrame.to_csv writes them:
+    'int', 'float' (None becomes nan), 'bool' or 'object'
+    """
+    def __init__(self):
+        self.has_none = self.has_bool = self.has_int = self.has_float = False
+        self.has_other = False
+
+    def add(self, value):
+        if value is None:
+            self.has_none = True
+        elif isinstance(value, bool):
+            self.has_bool = True
+        elif isinstance(value, Integral):
+            self.has_int = True
+        elif isinstance(value, Real):
+            self.has_float = True
+        else:
+            self.has_other = True
+
+    @property
+    def kind(self):
+        if self.has_other:
+            return "object"
+        if self.has_bool:
+            mixed = self.has_none or self.has_int or self.has_float
+            return "object" if mixed else "bool"
+        if self.has_float or (self.has_int and self.has_none):
+            return "float"
+        if self.has_int:
+            return "int"
+        return "object"
+
+
+def csv_cell(value, kind, escape_newlines=False):
+    """
+    Format a value the way DataFrame.to_csv does (missing values are "")
+    :param value: the value
+    :param kind: see ColumnKind
+    :param escape_newlines: If True, line breaks in text are written
+        as the two characters \\n (or \\r) so that every row is one line
+    :return: str
+    """
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    if kind == "float":
+        return str(float(value))
+    output = str(value)
+    if escape_newlines:
+        output = output.replace("\r", "\\r").replace("\n", "\\n")
+    return output
+
+
+class TweetColumns(object):
+    def __init__(self):
+        """
+        An empty column store. Fill it with update().
+        """
+        self.getters = REPORT_COLUMNS + EXTRA_COLUMNS
+        self.column_order = [name for name, _ in REPORT_COLUMNS]
+        self.values = {name: [] for name, _ in self.getters}
+        self.ids = []  # integer tweet IDs, one per row
+        self.row = {}  # primary key: id_str, value: row number
+        self._arrays = {}  # name: typed array, possibly longer than the store
+        self._categories = {}  # name: (list of categories, {category: code})
+
+    def __len__(self):
+        return len(self.ids)
+
+    def update(self, tweets):
+        """
+        Extract the columns of new or changed tweets
+        :param tweets: iterable of (id_str, PrepTweet) pairs
+        :return: NoneType
+        """
+        tweets = list(tweets)
+        compute_centroids(tweet for _, tweet in tweets)
+        start = len(self.ids)
+        changed = []
+        for id_str, tweet in tweets:
+            values = self.extract(tweet)
+            i = self.row.get(id_str)
+            if i is None:
+                self.row[id_str] = len(self.ids)
+                self.ids.append(int(id_str))
+                for name, value in zip(self.values, values):
+                    self.values[name].append(value)
+            else:
+                changed.append(i)
+                for name, value in zip(self.values, values):
+                    self.values[name][i] = value
+        self._update_arrays(start, changed)
+
+    def extract(self, tweet):
+        """
+        Evaluate the column getters for one tweet
+        :param tweet: PrepTweet
+        :return: list of values in the order of self.values
+        """
+        return [getattr(tweet, tweet_property_name)
+                for _, tweet_property_name
+                in self.getters]
+
+    def array(self, name):
+        """
+        Return a column as a typed array
+        "id" gives the integer tweet IDs, "date" is datetime64 (UTC,
+        NaT if missing), float columns use nan for missing values,
+        CATEGORY_COLUMNS are pandas.Categorical (missing values are
+        nan) and all other columns are object arrays.
+        The array is built on first use and then updated with the
+        changed rows only, so do not modify it.
+        :param name: name of the column
+        :return: numpy.ndarray or pandas.Categorical
+        """
+        if name not in self._arrays:
+            self._arrays[name] = self._typed(name, range(len(self)))
+        column = self._arrays[name][:len(self)]
+        if name in CATEGORY_COLUMNS:
+            return Categorical.from_codes(column, self._categories[name][0])
+        return column
+
+    def counts(self, name):
+        """
+        Count the rows of each value of a category column
+        :param name: one of CATEGORY_COLUMNS
+        :return: pandas.Series of counts indexed by value, largest first
+            (missing values are not counted)
+        """
+        self.array(name)
+        codes = self._arrays[name][:len(self)]
+        categories = self._categories[name][0]
+        counts = Series(bincount(codes[codes >= 0], minlength=len(categories)),
+                        index=Index(categories, dtype=object, name=name), name="count")
+        return counts[counts > 0].sort_values(ascending=False, kind="stable")
+
+    def _typed(self, name, rows):
+        """
+        Convert some rows of a column for its typed array (see array())
+        :param name: name of the column
+        :param rows: iterable of row numbers
+        :return: numpy.ndarray (category codes for CATEGORY_COLUMNS)
+        """
+        if name == "id":
+            return array([self.ids[i] for i in rows], dtype="int64")
+        values = [self.values[name][i] for i in rows]
+        if name in FLOAT_COLUMNS:
+            return array([nan if value is None else value for value in values],
+                         dtype="float64")
+        if name == "has_geotag":
+            return array([bool(value) for value in values], dtype=bool)
+        if name == "date":
+            dates = map(parse_date, values)
+            return array([datetime64("NaT") if date is None else
+                          datetime64(date.replace(tzinfo=None) - date.utcoffset(), "ms")
+                          for date in dates], dtype="datetime64[ms]")
+        if name in CATEGORY_COLUMNS:
+            categories, codes = self._categories.setdefault(name, ([], {}))
+            output = empty(len(values), dtype="int32")
+            for k, value in enumerate(values):
+                if value is None:
+                    output[k] = -1
+                    continue
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(categories)
+                    categories.append(value)
+                output[k] = code
+            return output
+        output = empty(len(values), dtype=object)
+        for k, value in enumerate(values):
+            output[k] = value
+        return output
+
+    def _update_arrays(self, start, changed):
+        """
+        Bring the typed arrays that have been built up to date after
+        update(): convert the rows appended from start and the changed rows
+        Arrays grow by doubling, so adding tweets one at a time is cheap.
+        :param start: number of rows before update()
+        :param changed: row numbers that were extracted again
+        :return: NoneType
+        """
+        n = len(self)
+        for name, column in list(self._arrays.items()):
+            if n > len(column):
+                grown = empty(max(n, 2 * len(column)), dtype=column.dtype)
+                grown[:start] = column[:start]
+                column = self._arrays[name] = grown
+            if n > start:
+                column[start:n] = self._typed(name, range(start, n))
+            if changed:
+                column[changed] = self._typed(name, changed)
+
+    def series(self, name):
+        """
+        Return a column as a pandas.Series (values as stored)
+        :param name: name of the column
+        :return: pandas.Series
+        """
+        return Series(self.values[name], name=name)
+
+    def sorted_rows(self, mask=None):
+        """
+        Row numbers ordered by tweet ID
+        :param mask: Optional. Boolean array selecting rows
+        :return: numpy array of row numbers
+        """
+        rows = argsort(self.array("id"), kind="stable")
+        if mask is not None:
+            rows = rows[mask[rows]]
+        return rows
+
+    def records(self, tweets=None, rows=None):
+        """
+        Iterate over the report rows, one list of values per tweet
+        in the order of the report columns
+        :param tweets: Optional. See table()
+        :param rows: Optional. See table()
+        :return: generator of lists
+        """
+        columns = [self.values[name] for name in self.column_order]
+        for ref in self._selection(tweets, rows):
+            if isinstance(ref, int):
+                yield [column[ref] for column in columns]
+            else:
+                yield ref
+
+    def write_csv(self, path, tweets=None, rows=None, escape_newlines=False,
+                  chunk_size=10000):
+        """
+        Write the report table as csv without building a DataFrame
+        The output is the same as table(tweets, rows).to_csv(path).
+        The values are read from this column store, which is already in
+        memory: the column types are inferred in one pass over the
+        stored columns, then the rows are formatted and written
+        chunk_size at a time, so no copy of the table is made.
+        :param path: path of the csv file
+        :param tweets: Optional. See table()
+        :param rows: Optional. See table()
+        :param escape_newlines: see csv_cell
+        :param chunk_size: number of rows written at a time
+        :return: integer; number of rows written
+        """
+        selection = self._selection(tweets, rows)
+        kinds = []
+        for j, name in enumerate(self.column_order):
+            column = self.values[name]
+            kind = ColumnKind()
+            for ref in selection:
+                kind.add(column[ref] if isinstance(ref, int) else ref[j])
+            kinds.append(kind.kind)
+        columns = [self.values[name] for name in self.column_order]
+        n = 0
+        with open(path, "w", newline="", encoding="utf-8") as fh:
+            writer = csv.writer(fh, lineterminator=os.linesep)
+            writer.writerow([""] + self.column_order)
+            chunk = []
+            for ref in selection:
+                record = [column[ref] for column in columns] if isinstance(ref, int) else ref
+                chunk.append([n] + [csv_cell(value, kind, escape_newlines)
+                                    for value, kind in zip(record, kinds)])
+                n += 1
+                if len(chunk) >= chunk_size:
+                    writer.writerows(chunk)
+                    chunk = []
+            writer.writerows(chunk)
+        return n
+
+    def _selection(self, tweets=None, rows=None):
+        """
+        The rows of a report: for each tweet, its row number in this
+        store, or (for tweets that are not in it) its values in the
+        order of the report columns
+        :param tweets: Optional. See table()
+        :param rows: Optional. See table()
+        :return: list of ints and lists
+        """
+        if tweets is None:
+            if rows is None:
+                rows = self.sorted_rows()
+            return [int(i) for i in rows]
+        names = list(self.values)
+        positions = [names.index(name) for name in self.column_order]
+        selection = []
+        for tweet in tweets:
+            i = self.row.get(tweet.id_str)
+            if i is None:
+                values = self.extract(tweet)
+                selection.append([values[j] for j in positions])
+            else:
+                selection.append(i)
+        return selection
+
+    def write_parquet(self, path, tweets=None, rows=None, row_group_size=50000):
+        """
+        Write the report table as a parquet file (requires pyarrow)
+        Rows are converted and written one row group at a time.
+        See parquet_schema for the column types.
+        :param path: path of the parquet file
+        :param tweets: Optional. See table()
+        :param rows: Optional. See table()
+        :param row_group_size: number of rows per row group
+        :return: integer; number of rows written
+        """
+        if pyarrow is None:
+            raise ImportError("Parquet reports require the pyarrow package")
+        schema = parquet_schema()
+        names = schema.names
+
+        def write_group(group):
+            arrays = [pyarrow.array(column, type=schema.field(name).type)
+                      for name, column in zip(names, zip(*group))]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+
+        n = 0
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            group = []
+            for record in self.records(tweets, rows):
+                values = [parquet_value(value, name)
+                          for value, name in zip(record, names[1:])]
+                id_str = record[0]
+                group.append([int(id_str) if id_str else None] + values)
+                n += 1
+                if len(group) >= row_group_size:
+                    write_group(group)
+                    group = []
+            if group:
+                write_group(group)
+        return n
+
+    def table(self, tweets=None, rows=None):
+        """
+        Return a pandas.DataFrame with the report columns
+        :param tweets: Optional. list of PrepTweet objects; one table row per
+            tweet, in that order. Tweets not in this store are evaluated
+            directly.
+        :param rows: Optional. row numbers to include (see sorted_rows)
+            Default is every tweet, sorted by ID.
+        :return: pandas.DataFrame
+        """
+        if tweets is not None:
+            records = [
+                [values[self.row[tweet.id_str]] for values in self.values.values()]
+                if tweet.id_str in self.row else self.extract(tweet)
+                for tweet in tweets
+            ]
+            output_dict = {
+                name: [record[j] for record in records]
+                for j, name in enumerate(self.values)
+                if name in self.column_order
+            }
+        else:
+            if rows is None:
+                rows = self.sorted_rows()
+            output_dict = {
+                name: [self.values[name][i] for i in rows]
+                for name in self.column_order
+            }
+        output = DataFrame.from_dict(output_dict)
+        output = output[self.column_order]
+        return output
@@ -0,0 +1,93 @@
+"""
+Secondary indexes over a TweetList.
+
+TweetIndex keeps, for each filter that TweetList offers, the set of
+tweet IDs that pass it, so that the filters no longer have to evaluate
+the properties of every PrepTweet. Keys are tuples:
+
+    ("geotagged",)                  PrepTweet.has_geotag
+    ("keyword_relevant",)           PrepTweet.keyword_relevant
+    ("has_nlu",)                    PrepTweet.has_nlu
+    ("relevance", value)            PrepTweet.relevance (hashable values only)
+    ("coded", variable)             variables the tweet has been coded for
+    ("coded_by", variable, coder)   ... and by whom
+    ("city", city)                  city of interest (see place_of_interest)
+    ("of_interest",)                any city of interest
+
+TweetList keeps its index current (see TweetList.index).
+"""
+
+from collections import defaultdict
+from preppy.metadata import place_of_interest
+
+
+class TweetIndex(object):
+    def __init__(self):
+        """
+        An empty index. Fill it with update().
+        """
+        self.sets = defaultdict(set)  # key: set of id_str
+        self.keys = {}  # id_str: keys the tweet is filed under
+
+    def update(self, tweets):
+        """
+        (Re-)index new or changed tweets
+        :param tweets: iterable of (id_str, PrepTweet) pairs
+        :return: NoneType
+        """
+        for id_str, tweet in tweets:
+            self.discard(id_str)
+            keys = self.index_keys(tweet)
+            for key in keys:
+                self.sets[key].add(id_str)
+            self.keys[id_str] = keys
+
+    def discard(self, id_str):
+        """
+        Remove a tweet from the index
+        :param id_str: tweet ID string
+        :return: NoneType
+        """
+        for key in self.keys.pop(id_str, ()):
+            ids = self.sets[key]
+            ids.discard(id_str)
+            if not ids:
+                del self.sets[key]
+
+    def lookup(self, *key):
+        """
+        The IDs of the tweets filed under a key
+        :param key: see module docstring, e.g. lookup("coded", "relevance")
+        :return: set of id strings (do not modify)
+        """
+        return self.sets.get(key, frozenset())
+
+    @staticmethod
+    def index_keys(tweet):
+        """
+        The keys a tweet should be filed under
+        :param tweet: PrepTweet
+        :return: list of tuples
+        """
+        keys = []
+        for name, value in (("geotagged", tweet.has_geotag),
+                            ("keyword_relevant", tweet.keyword_relevant),
+                            ("has_nlu", tweet.has_nlu)):
+            if value:
+                keys.append((name,))
+        relevance = tweet.relevance
+        try:
+            hash(relevance)
+        except TypeError:
+            pass  # e.g. a dict of {coder: value}, which equals no value
+        else:
+            keys.append(("relevance", relevance))
+        for variable, coders in tweet.metadata.as_dict.items():
+            if isinstance(coders, dict) and coders:
+                keys.append(("coded", variable))
+                keys.extend(("coded_by", variable, coder) for coder in coders)
+        city = place_of_interest(tweet.city)
+        if city:
+            keys.append(("city", city))
+            keys.append(("of_interest",))
+        return keys
@@ -1,8 +1,13 @@
+import os
+import time
 from twitter import Status
 from numpy.random import shuffle
 from preppy.preptweet import PrepTweet
-from preppy.metadata import MetaData, CODE_BOOK, place_of_interest, AIDSVU_CITIES
-from preppy.misc import read_json, write_json, get_logger
+from preppy.metadata import MetaData, CODE_BOOK
+from preppy.tweet_columns import TweetColumns
+from preppy.tweet_index import TweetIndex
+from preppy.journal import SessionJournal
+from preppy.misc import write_json, get_logger, JsonObjectStream
 
 
 logger = get_logger(__file__)
@@ -15,19 +20,45 @@ class TweetList(object):
     not present, and writing files.
     """
 
-    def __init__(self, tweets=None):
+    def __init__(self, tweets=None, store=None, lazy=False):
         """
         Return an instance of the TweetList class
         this populates the tweets attribute with a dict of PrepTweet objects
         :param tweets: dict
             {'tweet_id_01': {tweet dict},
              'tweet_id_02': {tweet dict},...}
-        """
-        self.tweets = {
-            id_str: PrepTweet.from_dict(pt_dict)
+        :param store: Optional. A mapping to keep the tweets in instead
+            of a dict, e.g. SQLiteTweetStore. If the store has a select()
+            method, filters like geotagged() are delegated to it.
+        :param lazy: If True, the tweets keep their raw status dicts
+            and only build Status objects when needed (see PrepTweet)
+        """
+        tweets = {
+            id_str: PrepTweet.from_dict(pt_dict, lazy=lazy)
             for id_str, pt_dict
             in tweets.items()
         } if tweets is not None else {}
+        if store is not None:
+            store.update(tweets)
+            tweets = store
+        self.tweets = tweets
+        # running smallest / largest tweet ID (see min_id, max_id)
+        self._min_id = None
+        self._max_id = None
+        if self.has_store:
+            self._min_id, self._max_id = self.tweets.id_range()
+        else:
+            self._track_ids(self.tweets.keys())
+        # SessionJournal recording changes to this list (see attach_journal)
+        self.journal = None
+        # TokenCache kept up to date with this list (see attach_token_cache)
+        self.token_cache = None
+        # column projection for reports (see columns)
+        self._columns = None
+        self._stale_ids = set()
+        # secondary indexes for the filters (see index)
+        self._index = None
+        self._stale_index_ids = set()
 
     def __getitem__(self, i):
         try:
@@ -42,10 +73,14 @@ class TweetList(object):
         return self.n
 
     @classmethod
-    def from_session_file(cls, path=None):
+    def from_session_file(cls, path=None, report_every=10000, lazy=False, journal=True):
         """
         Instantiate this class using a session file
 
+        The session file is parsed incrementally, one tweet at a time,
+        so that peak memory depends on the size of a single tweet rather
+        than on the size of the whole file.
+
         Format I:
         {
             id_str: {
@@ -75,33 +110,142 @@ class TweetList(object):
             },...
         }
         :param path: path to a valid json file
+        :param report_every: log loading progress every this many tweets
+            (0 to only log when loading is finished)
+        :param lazy: If True, do not build the twitter.Status objects
+            until they are needed (see PrepTweet). Much faster and
+            lighter for read-only work such as reports.
+        :param journal: If True, replay the journal of the session file
+            (the changes not yet compacted into it) and record further
+            changes in it (see attach_journal)
         :return: An instance of this class
         """
         if path is None:
             path = "preppy_session.json"
-        _d = read_json(path)
-        if _d is not None:
-            fmt = cls.detect_format(_d)
-            if fmt == 1:
-                raise NotImplementedError("Instantiation from format I session files not yet supported")
-            elif fmt == 2:
-                raise NotImplementedError("Instantiation from format II session files not yet supported")
-            elif fmt == 3:
-                return cls(_d)
-            else:
-                raise IOError("Unable to parse session file")
-        else:
+        tweet_list = cls._read_session_file(path, report_every, lazy)
+        if journal:
+            n = tweet_list.attach_journal(SessionJournal.for_session_file(path))
+            if n:
+                logger.info("Replayed {:d} changes from {:}".format(n, tweet_list.journal.path))
+        return tweet_list
+
+    @classmethod
+    def _read_session_file(cls, path, report_every, lazy):
+        """
+        Read a session file, without its journal (see from_session_file)
+        """
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
             return cls()
+        tweet_list = cls()
+        file_size = os.path.getsize(path)
+        start_time = time.time()
+        with open(path, "r") as fh:
+            stream = JsonObjectStream(fh)
+            try:
+                for id_str, entry in stream.items():
+                    if tweet_list.n == 0:
+                        fmt = cls.detect_format({id_str: entry})
+                        if fmt == 1:
+                            raise NotImplementedError("Instantiation from format I session files not yet supported")
+                        elif fmt == 2:
+                            raise NotImplementedError("Instantiation from format II session files not yet supported")
+                    tweet_list.tweets[id_str] = PrepTweet.from_dict(entry, lazy=lazy)
+                    tweet_list._track_ids((id_str,))
+                    if report_every and tweet_list.n % report_every == 0:
+                        cls._log_load_progress(tweet_list.n, stream.position, file_size, start_time)
+            except ValueError as e:
+                raise IOError("Unable to parse session file {:}: {:}".format(path, e))
+        cls._log_load_progress(tweet_list.n, stream.position, file_size, start_time)
+        return tweet_list
+
+    @staticmethod
+    def _log_load_progress(n, position, file_size, start_time):
+        """
+        Log how far along the loading of a session file is
+        :param n: number of tweets loaded so far
+        :param position: number of bytes of the file consumed so far
+        :param file_size: total size of the file in bytes
+        :param start_time: time.time() when loading started
+        :return: NoneType
+        """
+        elapsed = max(time.time() - start_time, 1e-6)
+        logger.info("Loaded {:d} tweets ({:.1f}% of {:.1f} MB) "
+                    "at {:.0f} tweets/s, {:.1f} MB/s"
+                    .format(n,
+                            100. * position / max(file_size, 1),
+                            file_size / 1e6,
+                            n / elapsed,
+                            position / 1e6 / elapsed))
+
+    @classmethod
+    def from_database(cls, path, lazy=False):
+        """
+        Instantiate this class backed by a SQLite tweet database
+        See preppy.session_store
+        :param path: path to the database file
+        :param lazy: see from_session_file
+        :return: An instance of this class
+        """
+        from preppy.session_store import SQLiteTweetStore
+        return cls(store=SQLiteTweetStore(path, lazy=lazy))
+
+    @property
+    def has_store(self):
+        """
+        Say whether the tweets live in a queryable store (see __init__)
+        :return: BoolType
+        """
+        return hasattr(self.tweets, "select")
+
+    def attach_journal(self, journal):
+        """
+        Replay the changes stored in a SessionJournal onto this list,
+        then record all further changes (add_tweets, record_metadata,
+        clear_metadata) in that journal.
+        :param journal: SessionJournal instance
+        :return: integer; number of changes replayed
+        """
+        self.journal = None
+        n = journal.replay(self)
+        self.journal = journal
+        return n
+
+    def attach_token_cache(self, token_cache):
+        """
+        Keep a TokenCache up to date with this list: tweets added
+        (add_tweets) or changed (replace_status) from now on are
+        tokenized right away. Tweets the cache has not seen yet are
+        tokenized when their tokens are first needed.
+        :param token_cache: TokenCache instance
+        :return: NoneType
+        """
+        self.token_cache = token_cache
+
+    def documents(self, tweets):
+        """
+        The words of some tweets, from the token cache if there is one
+        :param tweets: iterable of PrepTweet objects
+        :return: list of lists of words (see PrepTweet.words)
+        """
+        if self.token_cache is not None:
+            return self.token_cache.documents(tweets)
+        return [tweet.words for tweet in tweets]
 
     @staticmethod
     def detect_format(_d):
         """
         Detect the format of a dictionary read from a session file
         For format spec, see from_session_file() classmethod
+        Only the first entry of the dictionary is inspected.
         :param _d: dictionary produced by reading json session file
         :return: integer
         """
-        # TODO: detect the format of the dict
+        for key, value in _d.items():
+            if key in ("metadata", "tweets"):
+                return 2
+            if isinstance(value, dict) and "status" in value:
+                return 3
+            return 1
         return 3
 
     @property
@@ -116,6 +260,67 @@ class TweetList(object):
         ids.sort()
         return ids
 
+    @property
+    def columns(self):
+        """
+        Column oriented projection of the tweets for reporting
+        Built on first access; later accesses only re-extract the
+        tweets that were added or changed in the meantime.
+        :return: TweetColumns
+        """
+        if self._columns is None:
+            self._columns = TweetColumns()
+            self._columns.update(self.tweets.items())
+        elif self._stale_ids:
+            self._columns.update(
+                (id_str, self.tweets[id_str])
+                for id_str in self._stale_ids
+                if id_str in self.tweets)
+        self._stale_ids = set()
+        return self._columns
+
+    @property
+    def index(self):
+        """
+        Secondary indexes (ID sets) for the filters of this list
+        Built on first access; later accesses only re-index the
+        tweets that were added or changed in the meantime.
+        :return: TweetIndex
+        """
+        if self._index is None:
+            self._index = TweetIndex()
+            self._index.update(self.tweets.items())
+        elif self._stale_index_ids:
+            for id_str in self._stale_index_ids:
+                if id_str in self.tweets:
+                    self._index.update([(id_str, self.tweets[id_str])])
+                else:
+                    self._index.discard(id_str)
+        self._stale_index_ids = set()
+        return self._index
+
+    def _mark_stale(self, id_strs):
+        """
+        Note that tweets were added or changed after self.columns
+        or self.index was built
+        :param id_strs: iterable of tweet ID strings
+        :return: NoneType
+        """
+        if self._columns is not None or self._index is not None:
+            id_strs = list(id_strs)
+        if self._columns is not None:
+            self._stale_ids.update(id_strs)
+        if self._index is not None:
+            self._stale_index_ids.update(id_strs)
+
+    def _sorted_tweets(self, id_strs):
+        """
+        The tweets with the given IDs, sorted by ID
+        :param id_strs: iterable of tweet ID strings
+        :return: list of PrepTweet instances
+        """
+        return [self.tweets[id_str] for id_str in sorted(id_strs, key=int)]
+
     @property
     def as_dict(self):
         """
@@ -140,30 +345,59 @@ class TweetList(object):
         as a list
         :return: list of PrepTweet instances
         """
-        output = [tweet for tweet in self.tweets.values()
-                  if tweet.relevance == 1]
-        output.sort(key=lambda _tweet: _tweet.id)
-        return output
+        return self._sorted_tweets(self.index.lookup("relevance", 1))
 
-    def get_tweets_for_watson(self, sample_size=None, randomize=False):
+    def get_tweets_for_watson(self, sample_size=None, randomize=False, cache=None):
         """
         Return a list of tweets that keyword_classify.R coded as relevant
         and have not yet been run through watson
         :param sample_size: number of tweets to return
         :param randomize: uses numpy.random.shuffle
+        :param cache: Optional. NLUCache. Tweets whose text is in the
+            cache get the cached NLU data recorded and are left out
+            (they count as cache hits); the tweets returned count as
+            cache misses.
         :return: list of PrepTweet instances
         """
-        output = [tweet for tweet in self.tweets.values()
-                  if tweet.keyword_relevant
-                  and not tweet.has_nlu
-                  and place_of_interest(tweet.city)]
+        if self.has_store:
+            output = self.tweets.select(keyword_relevant=True,
+                                        has_nlu=False,
+                                        of_interest=True)
+        else:
+            index = self.index
+            output = self._sorted_tweets(
+                (index.lookup("keyword_relevant") & index.lookup("of_interest"))
+                - index.lookup("has_nlu"))
+        if cache is not None:
+            output = self._fill_from_cache(output, cache)
         if randomize:
             shuffle(output)
         if sample_size:
             output = output[:sample_size]
+        if cache is not None:
+            cache.misses += len(output)
         logger.info(msg="Got %d tweets for watson" % len(output))
         return output
 
+    def _fill_from_cache(self, tweets, cache):
+        """
+        Record the cached NLU data of tweets
+        :param tweets: list of PrepTweet instances
+        :param cache: NLUCache
+        :return: list of the tweets that are not in the cache
+        """
+        remaining = []
+        for tweet in tweets:
+            response = cache.get(tweet.text, count=False)
+            if response is None:
+                remaining.append(tweet)
+            else:
+                cache.hits += 1
+                self.record_metadata(tweet.id_str, 'nlu', 'watson_nlu', response)
+        logger.info("Filled in NLU data of {:d} tweets from the cache"
+                    .format(len(tweets) - len(remaining)))
+        return remaining
+
     @property
     def irrelevant(self):
         """
@@ -171,10 +405,7 @@ class TweetList(object):
         as a list
         :return: list of PrepTweet instances
         """
-        output = [tweet for tweet in self.tweets.values()
-                  if tweet.relevance == 0]
-        output.sort(key=lambda _tweet: _tweet.id)
-        return output
+        return self._sorted_tweets(self.index.lookup("relevance", 0))
 
     def as_list(self, only_geo=False, randomize=False, coded_for=None):
         """
@@ -186,16 +417,20 @@ class TweetList(object):
             If true, shuffle the tweets randomly
         :return: list of twitter.Status objects
         """
-        if only_geo:
-            output = [tweet
-                      for tweet
-                      in self.tweets.values()
-                      if tweet.has_geotag]
+        if self.has_store:
+            output = self.tweets.select(geotagged=True if only_geo else None,
+                                        coded_for=coded_for)
         else:
-            output = list(self.tweets.values())
-        if coded_for is not None:
-            output = [tweet for tweet
-                      in output if tweet.has_been_coded_for(coded_for)]
+            if only_geo or coded_for is not None:
+                ids = None
+                if only_geo:
+                    ids = self.index.lookup("geotagged")
+                if coded_for is not None:
+                    coded = self.index.lookup("coded", coded_for.lower())
+                    ids = coded if ids is None else ids & coded
+                output = [self.tweets[id_str] for id_str in ids]
+            else:
+                output = list(self.tweets.values())
         if randomize:
             shuffle(output)
         else:
@@ -211,7 +446,9 @@ class TweetList(object):
         """
         The number of tweets that are geotagged
         """
-        return len(self.geotagged())
+        if self.has_store:
+            return self.tweets.count(geotagged=True)
+        return len(self.index.lookup("geotagged"))
 
     def geotagged(self, tweet_format="Status"):
         """
@@ -228,10 +465,14 @@ class TweetList(object):
         else:
             msg = 'Tweet format can be \'dict\' or \'Status\''
             raise ValueError(msg)
-        geo_tweets = {id_str: fn(tweet)
-                      for id_str, tweet
-                      in self.tweets.items()
-                      if tweet.has_geotag}
+        if self.has_store:
+            geo_tweets = {tweet.id_str: fn(tweet)
+                          for tweet
+                          in self.tweets.select(geotagged=True)}
+        else:
+            geo_tweets = {id_str: fn(self.tweets[id_str])
+                          for id_str
+                          in sorted(self.index.lookup("geotagged"), key=int)}
         return geo_tweets
 
     def export_geotagged_tweets(self, path=None):
@@ -252,12 +493,7 @@ class TweetList(object):
         This corresponds to the newest tweet.
         :return: int
         """
-        ids = [int(i) for i in self.id_list]
-        if ids:
-            max_id = max(ids)
-        else:
-            max_id = None
-        return max_id
+        return self._max_id
 
     @property
     def min_id(self):
@@ -266,12 +502,23 @@ class TweetList(object):
         This correspond to the oldest tweet.
         :return: int
         """
-        ids = [int(i) for i in self.id_list]
-        if ids:
-            min_id = min(ids)
-        else:
-            min_id = None
-        return min_id
+        return self._min_id
+
+    def _track_ids(self, id_strs):
+        """
+        Update the running smallest and largest tweet IDs
+        Called whenever tweets are added to self.tweets
+        :param id_strs: iterable of tweet ID strings
+        :return: NoneType
+        """
+        ids = [int(i) for i in id_strs]
+        if not ids:
+            return
+        low, high = min(ids), max(ids)
+        if self._min_id is None or low < self._min_id:
+            self._min_id = low
+        if self._max_id is None or high > self._max_id:
+            self._max_id = high
 
     def add_tweets(self, tweets):
         """
@@ -306,6 +553,35 @@ class TweetList(object):
         else:
             raise TypeError("Unable to add tweets from {}".format(type(tweets)))
         self.tweets.update(tweet_dict)
+        self._track_ids(tweet_dict.keys())
+        self._mark_stale(tweet_dict.keys())
+        if self.journal is not None:
+            for tweet in tweet_dict.values():
+                self.journal.log_tweet(tweet)
+        if self.token_cache is not None:
+            self.token_cache.update(tweet_dict.values())
+
+    def replace_status(self, id_str, status):
+        """
+        Replace the status of a tweet (e.g. after rehydration)
+        while keeping its metadata. Tweets that are not in this
+        list yet are added.
+        :param id_str: the id of the tweet
+        :param status: twitter.Status
+        :return: NoneType
+        """
+        tweet = self.tweets.get(id_str)
+        if tweet is None:
+            self.add_tweets([PrepTweet(status)])
+            return
+        tweet.status = status
+        if self.has_store:
+            self.tweets[id_str] = tweet
+        if self.journal is not None:
+            self.journal.log_tweet(tweet)
+        if self.token_cache is not None:
+            self.token_cache.update([tweet])
+        self._mark_stale((id_str,))
 
     def user_has_encoded(self, user_id, variable_name, id_str):
         """
@@ -380,9 +656,14 @@ class TweetList(object):
         :return: NoneType
         """
         assert param in CODE_BOOK.variable_names
+        if self.journal is not None:
+            self.journal.log_clear(id_str, param)
+        self._mark_stale((id_str,))
         if param is None:
             try:
-                self.tweets[id_str].metadata = MetaData()
+                pt = self.tweets[id_str]
+                pt.metadata = MetaData()
+                self.tweets[id_str] = pt
             except:
                 logger.warning("Did not clear metadata for tweet {}".format(id_str))
         else:
@@ -392,6 +673,7 @@ class TweetList(object):
                 md = pt.metadata
                 assert isinstance(md, MetaData)
                 setattr(md, param, {})
+                self.tweets[id_str] = pt
             except:
                 logger.warning("Did not clear metadata for param {}, tweet {}".format(param, id_str))
 
@@ -406,6 +688,12 @@ class TweetList(object):
         tweet = self.tweets.get(id_str)
         if tweet is not None:
             tweet.metadata.record(param, user_id, value)
+            if self.has_store:
+                # the store hands out copies, so write the change back
+                self.tweets[id_str] = tweet
+            if self.journal is not None:
+                self.journal.log_record(id_str, param, user_id, value)
+            self._mark_stale((id_str,))
 
     def tweets_coded(self, variable_name):
         """
@@ -417,11 +705,9 @@ class TweetList(object):
         if variable_name not in CODE_BOOK.__dict__:
             raise ValueError("{:} is not in the Code Book"
                              .format(variable_name))
-        n = 0
-        for preptweet in self.tweets.values():
-            if preptweet.has_been_coded_for(variable_name):
-                n += 1
-        return n
+        if self.has_store:
+            return self.tweets.count(coded_for=variable_name)
+        return len(self.index.lookup("coded", variable_name.lower()))
 
     def tweets_coding_status(self):
         """
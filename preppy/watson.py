@@ -7,8 +7,42 @@ Outputs: appends subdict within a tweet dict called 'nlu',
          contains Watsons NLU output for the tweet. 
 """
 
-import watson_developer_cloud
+import time
 import json
+import random
+import requests
+import watson_developer_cloud
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from watson_developer_cloud.natural_language_understanding_v1 import Features, SentimentOptions
+from watson_developer_cloud.watson_service import WatsonApiException, get_error_message
+from preppy.httpclient import shared_client
+from preppy.misc import get_logger
+
+
+logger = get_logger(__file__)
+
+
+# The version of watson-developer-cloud preppy is tested with
+WATSON_SDK_VERSION = "2.10.1"
+
+
+def features_to_dict(features):
+    """
+    The json form of a watson Features object (or of its options)
+    The SDK models keep each field in a public attribute named like its
+    json key, so the dict is built from those attributes (skipping
+    unset ones) rather than with the SDK's private _to_dict().
+    :param features: Features, an options model or a plain value
+    :return: dict, list or the value itself
+    """
+    if isinstance(features, list):
+        return [features_to_dict(item) for item in features]
+    if not hasattr(features, "__dict__"):
+        return features
+    return {name: features_to_dict(value)
+            for name, value in vars(features).items()
+            if not name.startswith("_") and value is not None}
+
 
 class Watson(object):
     """Base class to interface preppy with watson_developer_cloud"""
@@ -29,17 +63,163 @@ class NLU(Watson):
     """Interface to Watson's Natural Language Understanding service"""
     def __init__(self, *args, **kwargs):
         Watson.__init__(self, *args, **kwargs)
+        if watson_developer_cloud.__version__ != WATSON_SDK_VERSION:
+            logger.warning("preppy is tested with watson-developer-cloud {}, found {}"
+                           .format(WATSON_SDK_VERSION, watson_developer_cloud.__version__))
 
     def _get_api(self):
-        api = watson_developer_cloud.NaturalLanguageUnderstandingV1(
+        kwargs = dict(
             username=self.creds.get('username'),
             password=self.creds.get('password'),
             version=self.creds.get('version'))
+        if self.creds.get('url'):
+            # e.g. a regional endpoint or a local fake server for benchmarks
+            kwargs['url'] = self.creds.get('url')
+        api = watson_developer_cloud.NaturalLanguageUnderstandingV1(**kwargs)
         return api
 
-    def analyze(self, *args, **kwargs):
-        result = self.api.analyze(*args, **kwargs)
-        return result
+    def analyze(self, features, text, client=None, **kwargs):
+        """
+        Analyze a text
+        The request goes through a shared HttpClient (kept-alive
+        connections and timeouts) instead of the SDK, which opens a new
+        connection for every request. It is not retried here; see
+        NLUEnricher for retries.
+        :param features: watson Features object
+        :param text: the text to analyze
+        :param client: Optional. HttpClient
+            (default: the "watson" shared client, without retries)
+        :param kwargs: other analyze parameters, e.g. language
+        :return: dict; the NLU response
+        """
+        data = dict(kwargs, features=features_to_dict(features), text=text)
+        client = client or shared_client("watson", max_retries=0)
+        response = client.post(
+            self.api.url + '/v1/analyze',
+            params={'version': self.api.version},
+            json=data,
+            auth=(self.creds.get('username'), self.creds.get('password')),
+            headers={'Accept': 'application/json'})
+        if not 200 <= response.status_code <= 299:
+            raise WatsonApiException(response.status_code,
+                                     get_error_message(response),
+                                     httpResponse=response)
+        return response.json()
+
+
+def is_retryable(error):
+    """
+    Say whether a failed NLU request is worth trying again
+    Rate limiting (429), server errors and connection problems are;
+    other Watson errors (e.g. 422, unsupported text language) are not.
+    :param error: the exception raised by the request
+    :return: BoolType
+    """
+    if isinstance(error, WatsonApiException):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, requests.RequestException)
+
+
+class NLUEnricher(object):
+    def __init__(self, analyze, max_workers=8, max_retries=4,
+                 backoff=1., max_backoff=60., features=None):
+        """
+        Run tweets through Watson NLU concurrently
+        :param analyze: the function that makes one request, called as
+            analyze(features=..., text=...); usually NLU(...).analyze
+        :param max_workers: number of requests in flight
+        :param max_retries: number of times a tweet is retried after
+            a retryable error (see is_retryable)
+        :param backoff: delay before the first retry in seconds. The delay
+            doubles with every retry (with random jitter) up to max_backoff.
+        :param max_backoff: longest delay between two retries in seconds
+        :param features: Optional. watson Features object
+            (default: document sentiment)
+        """
+        self.analyze = analyze
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.features = features or Features(sentiment=SentimentOptions())
+
+    def run(self, tweets, on_result, on_checkpoint=None, checkpoint_every=100):
+        """
+        Analyze the text of each tweet
+        Results are handed to on_result as they arrive (in the calling
+        thread, so on_result does not need to be thread safe). A tweet that
+        fails for good is logged and skipped; it does not stop the run.
+        :param tweets: iterable of PrepTweet instances
+        :param on_result: function(tweet, response)
+        :param on_checkpoint: Optional. function() called after every
+            checkpoint_every results and at the end of the run, e.g.
+            to save the results gathered so far
+        :param checkpoint_every: number of results between checkpoints
+        :return: tuple of ints (number of tweets analyzed, number failed)
+        """
+        tweets = iter(tweets)
+        n_done = n_failed = n_since_checkpoint = 0
+        pending = {}
+        executor = ThreadPoolExecutor(self.max_workers)
+        try:
+            self._submit(executor, tweets, pending)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tweet = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        logger.warning("NLU failed on tweet {:}: {:}".format(tweet.id_str, e))
+                        n_failed += 1
+                        continue
+                    on_result(tweet, response)
+                    n_done += 1
+                    n_since_checkpoint += 1
+                if on_checkpoint is not None and n_since_checkpoint >= checkpoint_every:
+                    on_checkpoint()
+                    n_since_checkpoint = 0
+                self._submit(executor, tweets, pending)
+        except KeyboardInterrupt:
+            logger.info("User interrupted the NLU run after {:d} tweets".format(n_done))
+            for future in pending:
+                future.cancel()
+        finally:
+            executor.shutdown(wait=False)
+            if on_checkpoint is not None and n_since_checkpoint:
+                on_checkpoint()
+        return n_done, n_failed
+
+    def _submit(self, executor, tweets, pending):
+        """
+        Keep twice as many requests queued as there are workers,
+        so that the workers never wait but the tweets are not all
+        submitted at once
+        """
+        while len(pending) < 2 * self.max_workers:
+            try:
+                tweet = next(tweets)
+            except StopIteration:
+                return
+            pending[executor.submit(self._analyze, tweet.text)] = tweet
+
+    def _analyze(self, text):
+        """
+        Make one request, retrying with exponential backoff
+        :param text: text to analyze
+        :return: the NLU response (dict)
+        """
+        attempt = 0
+        while True:
+            try:
+                response = self.analyze(features=self.features, text=text)
+                return getattr(response, "get_result", lambda: response)()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.))
+                attempt += 1
 
 
 def read_ids(id_file):
@@ -1,7 +1,16 @@
+import os
 import shutil
-from preppy.misc import get_latest_file
+from preppy.misc import get_latest_file, enforce_extension
 
 
-latest_backup_path = get_latest_file("backups")
+latest_backup_path = get_latest_file("backups", ext=".json")
 
 shutil.copyfile(latest_backup_path, "./preppy_session.json")
+
+# The journal backed up alongside that session file (if any)
+# holds the changes that had not yet been compacted into it.
+journal_backup_path = enforce_extension(latest_backup_path, ".journal")
+if os.path.isfile(journal_backup_path):
+    shutil.copyfile(journal_backup_path, "./preppy_session.journal")
+elif os.path.isfile("./preppy_session.journal"):
+    os.remove("./preppy_session.journal")
@@ -5,7 +5,6 @@ from preppy import (
 from preppy.report_writer import ReportWriter
 import argparse
 import logging
-import subprocess
 
 
 def _parse_args():
@@ -16,6 +15,9 @@ def _parse_args():
     parser.add_argument("-wd", "--wd",
                         help="Working directory path",
                         default=".")
+    parser.add_argument("-session", "--session",
+                        help="Session file name (.json, or .db for a SQLite tweet database)",
+                        default="preppy_session.json")
     parser.add_argument("-encode", "--encode",
                         help="The name of the variable to encode",
                         default="", type=str)
@@ -27,8 +29,8 @@ def _parse_args():
                         help="How many tweets? can be used for -encode",
                         default=None, type=int)
     parser.add_argument("-google_max",
-                        help="How many google api calls? can be used for -encode",
-                        default=0, type=int)
+                        help="How many google api calls? can be used for -encode (-1 for no limit)",
+                        default=100, type=int)
     parser.add_argument("-updatetweets",
                         action="store_true",
                         default=False)
@@ -41,7 +43,7 @@ def _parse_args():
                         action="store_true",
                         default=False)
     parser.add_argument("-keyword_classify", "--keyword_classify", "-keyword", "--keyword",
-                        help="Preppy will write a csv report, run keyword_classify.R, and store the results",
+                        help="Classify the relevance of new tweets with the keyword rules of keyword_classify.R",
                         action="store_true",
                         default=False)
     parser.add_argument("-watson", "--watson",
@@ -57,6 +59,7 @@ def _parse_args():
 args = _parse_args()
 terms = args.terms
 wd = args.wd
+session_file = args.session
 encode = args.encode
 debug = args.debug
 report = args.report
@@ -83,12 +86,12 @@ logger.addHandler(sh)
 
 with cd(wd):
     logger.info("Starting Preppy Session")
-    session_file = "preppy_session.json"
 
     Session = Preppy(
         session_file_path=session_file,
         config_file='config.json',
-        backup_dir='backups'
+        backup_dir='backups',
+        lazy=True
     )
 
     logger.info("Opened {:} session file"
@@ -102,10 +105,7 @@ with cd(wd):
         logger.info("Retrieving new tweets")
         Session.get_more_tweets(terms)
     if keyword_classify:
-        reportwriter = ReportWriter(Session)
-        reportwriter.write_report_all("all_tweet_report.csv", fmt='csv')
-        subprocess.call(["Rscript", "./scripts/keyword_classify.R", "all_tweet_report.csv"])
-        Session.encode_rscript_results()
+        Session.encode_keyword_relevance()
 
     if encode:
         if encode == "user_place":
@@ -124,15 +124,19 @@ with cd(wd):
         report_writer.write_report_nlu("watson_report.csv")
 
     if report:
-        Session.tweets.export_geotagged_tweets("geotagged_tweets.json")
         reportwriter = ReportWriter(Session)
-        reportwriter.write_report_all("all_tweets_report.csv", fmt='csv')
-        reportwriter.write_report_geo("geo_tweet_report.csv", fmt='csv')
-        reportwriter.hashtag_table("hashtag_frequencies.json", min_freq=10)
-        logger.info("There are {:} geotagged tweets".format(reportwriter.how_many_geotagged()))
-        logger.info(reportwriter.country_counts())
-        logger.info(reportwriter.state_counts())
-        unique_states = reportwriter.unique_states()
+        summary = reportwriter.write_reports(
+            all_path="all_tweets_report.csv",
+            geo_path="geo_tweet_report.csv",
+            hashtag_path="hashtag_frequencies.json",
+            geotagged_path="geotagged_tweets.json",
+            fmt='csv',
+            min_freq=10
+        )
+        logger.info("There are {:} geotagged tweets".format(summary["n_geotagged"]))
+        logger.info(summary["country_counts"])
+        logger.info(summary["state_counts"])
+        unique_states = summary["unique_states"]
         logger.info("There are {:} unique states".format(unique_states.__len__()))
     if not noclean:
         Session.cleanup_session()
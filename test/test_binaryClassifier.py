@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import joblib
+from unittest import TestCase
+from numpy import array
+from preppy.binaryclassifier import TweetClassifier
+from preppy.crossvalidator import CrossValidator, classification_metrics
+from preppy.features import Vocabulary, document_term_matrix
+from preppy.preptweet import PrepTweet
+from preppy.tweet_list import TweetList
+from sklearn.ensemble import RandomForestClassifier
+
+
+def make_tweet(id_int, text, relevance):
+    return PrepTweet.from_dict({
+        "status": {"id": id_int, "id_str": str(id_int), "full_text": text},
+        "metadata": {"relevance": {"coder": relevance}}
+    })
+
+
+def make_tweets(n=40):
+    tweets = []
+    for i in range(n):
+        if i % 2:
+            tweets.append(make_tweet(i, "ask about truvada and PrEP {:d}".format(i), "1"))
+        else:
+            tweets.append(make_tweet(i, "meal prep for the week {:d}".format(i), "0"))
+    return tweets
+
+
+class TestFeatures(TestCase):
+    def test_matrix_matches_indicators(self):
+        documents = [["a", "b", "a"], None, [], ["c", "zz"]]
+        vocabulary = Vocabulary(["c", "a", "b"])
+        x = document_term_matrix(documents, vocabulary)
+        self.assertEqual(x.shape, (4, 3))
+        tc = TweetClassifier("relevance")
+        tc.indicator_words = vocabulary.words
+        self.assertEqual(x.toarray().tolist(),
+                         [tc.evaluate_indicators(d) for d in documents])
+
+
+class TestTweetClassifier(TestCase):
+    def test_train_predict(self):
+        tweets = make_tweets()
+        tc = TweetClassifier("relevance")
+        tc.train(tweets)
+        self.assertIn("truvada", tc.indicator_words)
+        self.assertNotIn("about", tc.words["0.0"])
+        predicted = tc.predict(tweets)
+        self.assertEqual(predicted.tolist(), [t.lookup("relevance") for t in tweets])
+        self.assertEqual(tc.predict(tweets[1]).tolist(), [1.])
+        self.assertEqual(tc.predict(tweets[:1]), array(0.))
+        self.assertEqual(CrossValidator(tc).misclass_rate(tweets), 0.)
+
+    def test_predict_batches(self):
+        tweets = make_tweets()
+        tc = TweetClassifier("relevance")
+        tc.train(tweets)
+        tweet_list = TweetList()
+        tweet_list.add_tweets(tweets)
+        batches = list(tc.predict_batches(tweet_list, batch_size=15))
+        self.assertEqual([len(ids) for ids, predictions, probabilities in batches], [15, 15, 10])
+        for ids, predictions, probabilities in batches:
+            self.assertEqual(probabilities.shape, (len(ids), 2))
+            self.assertEqual(predictions.tolist(), tc.predict([tweets[int(i)] for i in ids]).tolist())
+
+    def test_save_load(self):
+        tweets = make_tweets()
+        tc = TweetClassifier("relevance")
+        tc.train(tweets)
+        directory = tempfile.mkdtemp()
+        try:
+            fname = tc.save(os.path.join(directory, "relevance_model"))
+            loaded = TweetClassifier.load(fname)
+            self.assertEqual(loaded.indicator_words, tc.indicator_words)
+            self.assertEqual(loaded.training["n_tweets"], 40)
+            self.assertEqual(loaded.predict(tweets).tolist(), tc.predict(tweets).tolist())
+            tc.to_json(os.path.join(directory, "relevance_model"))
+            from_json = TweetClassifier.from_json(os.path.join(directory, "relevance_model.json"))
+            self.assertEqual(from_json.words, tc.words)
+            self.assertIsInstance(tc.model, RandomForestClassifier)
+            for payload in (RandomForestClassifier(), {"version": 0}):
+                joblib.dump(payload, os.path.join(directory, "other.joblib"))
+                with self.assertRaisesRegex(ValueError, "other.joblib.*expected version 1"):
+                    TweetClassifier.load(os.path.join(directory, "other"))
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestCrossValidator(TestCase):
+    def test_metrics(self):
+        metrics = classification_metrics(array([1., 1., 0., 0.]), array([1., 0., 1., 0.]))
+        self.assertEqual((metrics["accuracy"], metrics["precision"], metrics["recall"]),
+                         (.5, .5, .5))
+
+    def test_parallel_matches_serial(self):
+        tweets = make_tweets(30)
+        tweets[3] = make_tweet(3, "meal prep ideas", "1")
+        cv = CrossValidator(TweetClassifier("relevance"))
+        serial = cv.cross_validate(tweets, kfolds=5, max_workers=1, random_state=0)
+        parallel = cv.cross_validate(tweets, kfolds=5, max_workers=2, random_state=0)
+        self.assertEqual(serial["n"], 30)
+        self.assertEqual(serial["misclass"], parallel["misclass"])
+        self.assertLess(serial["misclass"], .5)
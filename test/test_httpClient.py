@@ -0,0 +1,73 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from preppy.httpclient import HttpClient
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Fails the first two requests with 503 (Retry-After: 0), then answers"""
+    protocol_version = "HTTP/1.1"  # keep connections alive
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.client_address)
+        if self.path == "/limited":
+            self.reply(429, b"slow down", {"Retry-After": "0"})
+        elif len(self.requests) <= 2:
+            self.reply(503, b"busy", {"Retry-After": "0"})
+        elif self.path == "/missing":
+            self.reply(404, b"not found")
+        else:
+            self.reply(200, b"ok")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.requests.append(self.client_address)
+        self.reply(503, b"busy", {"Retry-After": "0"})
+
+    def reply(self, code, body, headers=()):
+        self.send_response(code)
+        for key, value in dict(headers).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpClient(TestCase):
+    def setUp(self):
+        FlakyHandler.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{:d}".format(self.server.server_port)
+        self.client = HttpClient(backoff=0.01)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_retry_and_keep_alive(self):
+        response = self.client.get(self.url + "/ok")
+        self.assertEqual((response.status_code, response.text), (200, "ok"))
+        self.assertEqual(len(FlakyHandler.requests), 3)
+        self.assertEqual(self.client.get(self.url + "/missing").status_code, 404)
+        self.assertEqual(len(FlakyHandler.requests), 4)
+        # all four requests went over one connection
+        self.assertEqual(len(set(FlakyHandler.requests)), 1)
+
+    def test_retries_run_out(self):
+        client = HttpClient(max_retries=1, backoff=0.01)
+        self.assertEqual(client.get(self.url + "/ok").status_code, 503)
+        self.assertEqual(len(FlakyHandler.requests), 2)
+        client.close()
+
+    def test_no_retries_on_429_or_post(self):
+        self.assertEqual(self.client.get(self.url + "/limited").status_code, 429)
+        self.assertEqual(self.client.post(self.url + "/analyze", data=b"x").status_code, 503)
+        self.assertEqual(len(FlakyHandler.requests), 2)
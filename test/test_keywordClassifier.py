@@ -0,0 +1,28 @@
+from unittest import TestCase
+from preppy.keyword_classifier import KEYWORD_CODER, is_keyword_relevant, classify_tweets
+from preppy.tweet_list import TweetList
+
+
+class TestKeywordClassifier(TestCase):
+    def test_patterns(self):
+        relevant = ["Ask your doctor about PrEP", "get tested for STDs? no, STD!",
+                    "HIV testing today", "Truvada works", "living with hiv/aids",
+                    "#CDCgov guidance", "insurance won't cover it"]
+        irrelevant = ["meal prep sunday", "PREP school", "archived", "megayacht",
+                      "sexy", None]
+        for text in relevant:
+            self.assertTrue(is_keyword_relevant(text), text)
+        for text in irrelevant:
+            self.assertFalse(is_keyword_relevant(text), text)
+
+    def test_incremental(self):
+        session = {
+            "1": {"status": {"id": 1, "id_str": "1", "full_text": "truvada"}, "metadata": {}},
+            "2": {"status": {"id": 2, "id_str": "2", "full_text": "meal prep"}, "metadata": {}}
+        }
+        tweets = TweetList(session)
+        self.assertEqual(classify_tweets(tweets), (2, 1))
+        self.assertEqual(tweets["1"].metadata.relevance, {KEYWORD_CODER: 1})
+        self.assertEqual(tweets["2"].metadata.relevance, {KEYWORD_CODER: 0})
+        self.assertEqual(classify_tweets(tweets), (0, 0))
+        self.assertEqual(classify_tweets(tweets, reclassify=True), (2, 1))
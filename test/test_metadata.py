@@ -0,0 +1,28 @@
+import re
+from unittest import TestCase
+from preppy.metadata import place_of_interest, AIDSVU_CITIES
+
+
+def reference_place_of_interest(place_name):
+    """One re.search per city of interest"""
+    for city, state in AIDSVU_CITIES:
+        if re.search(pattern=city, string=place_name):
+            return city
+    return False
+
+
+class TestPlaceOfInterest(TestCase):
+    def test_matches_city_by_city_search(self):
+        places = ["New Haven, CT", "Jacksonville, FL", "Miami <-> Atlanta",
+                  "Atlantaa", "Orlando, FL", "🌈 everywhere", "", "NYC"]
+        for place in places:
+            self.assertEqual(place_of_interest(place),
+                             reference_place_of_interest(place), place)
+
+    def test_list_order_wins(self):
+        # Atlanta comes before Miami in cities_of_interest.csv
+        self.assertEqual(place_of_interest("Miami, then Atlanta"), "Atlanta")
+
+    def test_not_a_string(self):
+        self.assertFalse(place_of_interest(None))
+        self.assertFalse(place_of_interest(12345))
@@ -1,5 +1,10 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 from unittest import TestCase
 from preppy import PlaceInfo
+from preppy.dataobjects import CacheEntry
 
 
 class TestPlaceCoordinates(TestCase):
@@ -25,3 +30,96 @@ class TestPlaceCoordinates(TestCase):
         place = "17 Hillhouse Ave. New Haven, CT, USA"
         zc = info.get_zip_code(place)
         self.assertTrue(zc == "06511")
+
+
+class GeocodeStub(BaseHTTPRequestHandler):
+    """Answers like the Google Geocoding API; counts the queries it gets"""
+    queries = []
+
+    def do_GET(self):
+        address = parse_qs(urlparse(self.path).query)["address"][0]
+        self.queries.append(address)
+        if address.startswith("nowhere"):
+            body = {"results": [], "status": "ZERO_RESULTS"}
+        else:
+            body = {"results": [{"geometry": {"location": {"lat": 41.3, "lng": -72.9}}}],
+                    "status": "OK"}
+        output = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBatchGeocoding(TestCase):
+    def setUp(self):
+        GeocodeStub.queries = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), GeocodeStub)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{:d}/geocode/json".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_get_coordinates_batch(self):
+        info = PlaceInfo(url=self.url, max_workers=4)
+        places = ["New Haven, CT", "new haven,  CT ", "Atlanta, GA",
+                  "nowhere", None, "Atlanta, GA"]
+        coords = info.get_coordinates_batch(places, rate=100)
+        self.assertEqual(sorted(GeocodeStub.queries),
+                         ["atlanta, ga", "new haven, ct", "nowhere"])
+        self.assertEqual(info.api_counter, 3)
+        self.assertEqual(coords["new haven,  CT "], (41.3, -72.9))
+        self.assertIsNone(coords["nowhere"])
+        self.assertNotIn(None, coords)
+        # everything is cached now
+        info.get_coordinates_batch(places, rate=100)
+        self.assertEqual(info.api_counter, 3)
+
+    def test_max_calls(self):
+        info = PlaceInfo(url=self.url)
+        coords = info.get_coordinates_batch(["a", "b", "c"], max_calls=2, rate=100)
+        self.assertEqual(sorted(coords), ["a", "b"])
+        self.assertEqual(info.api_counter, 2)
+
+    def test_negative_cache(self):
+        info = PlaceInfo(url=self.url, negative_ttl=60)
+        places = ["nowhere", "\U0001f308 everywhere", "Planet Earth!!", "..."]
+        coords = info.get_coordinates_batch(places, rate=100)
+        self.assertEqual(GeocodeStub.queries, ["nowhere"])
+        self.assertEqual(coords, {place: None for place in places})
+        self.assertEqual(info.data["nowhere"].status, CacheEntry.ZERO_RESULTS)
+        self.assertIsNone(info.get_coordinates("nowhere"))
+        self.assertEqual(info.api_counter, 1)
+        # the miss is looked up again once it has expired
+        info.data["nowhere"].timestamp -= 61
+        info.get_coordinates_batch(places, rate=100)
+        self.assertEqual(info.api_counter, 2)
+
+    def test_legacy_entries_and_eviction(self):
+        legacy = {"new haven, ct": {"geometry": {"location": {"lat": 1., "lng": 2.}}},
+                  "failed": {}}
+        info = PlaceInfo(legacy, url=self.url, max_entries=2, low_water=1.)
+        self.assertEqual(info.get_coordinates("New Haven, CT"), (1., 2.))
+        self.assertEqual(info.get_coordinates("failed"), (41.3, -72.9))
+        info.get_coordinates("atlanta")
+        info.get_coordinates("nowhere")
+        self.assertEqual(info.api_counter, 3)
+        self.assertEqual(sorted(info.data), ["atlanta", "failed"])
+        entry = CacheEntry.from_dict(info.data["atlanta"].as_dict)
+        self.assertTrue(entry.is_hit)
+        self.assertFalse(entry.is_expired(None))
+
+        info = PlaceInfo({str(i): {"results": [], "status": CacheEntry.OK, "timestamp": i}
+                          for i in range(10)}, url=self.url, max_entries=10)
+        info.get_coordinates("atlanta")
+        self.assertEqual(sorted(info.data), ["2", "3", "4", "5", "6", "7", "8", "9", "atlanta"])
+        info.get_coordinates("nowhere")
+        self.assertEqual(len(info.data), 10)
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from twitter.api import Api
+from twitter.ratelimit import EndpointRateLimit
+from preppy.misc import rehydrate_tweets
+from test.test_tweetList import make_status
+
+
+class FakeResponse(object):
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeApi(Api):
+    """statuses/lookup for tweets with even IDs; the others are deleted"""
+    def __init__(self):
+        self.requested = []
+
+    def CheckRateLimit(self, url):
+        return EndpointRateLimit(limit=900, remaining=900, reset=0)
+
+    def _RequestUrl(self, url, verb, data=None, json=None, enforce_auth=True):
+        ids = data["id"].split(",")
+        self.requested.extend(ids)
+        return FakeResponse([make_status(int(i)) for i in ids if int(i) % 2 == 0])
+
+
+class TestRehydrate(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.dir, "preppy_session.rehydrated")
+        self.ids = [str(i) for i in range(250)]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_rehydrate(self):
+        output = rehydrate_tweets(self.ids, FakeApi())
+        self.assertEqual(sorted(output, key=int), [str(i) for i in range(0, 250, 2)])
+        self.assertEqual(output["42"].full_text, "tweet number 42 about #PrEP")
+
+    def test_resume(self):
+        applied = {}
+
+        def crash_on_second_batch(tweets):
+            if len(applied) >= 50:
+                raise RuntimeError("crash")
+            applied.update(tweets)
+
+        with self.assertRaises(RuntimeError):
+            rehydrate_tweets(self.ids, FakeApi(), self.checkpoint,
+                             on_batch=crash_on_second_batch)
+        self.assertEqual(len(applied), 50)
+
+        api = FakeApi()
+        output = rehydrate_tweets(self.ids, api, self.checkpoint, on_batch=applied.update)
+        self.assertEqual(output, {})
+        self.assertEqual(api.requested, self.ids[100:])
+        self.assertEqual(len(applied), 125)
+        # everything was hydrated before since, so it is all done again
+        api = FakeApi()
+        rehydrate_tweets(self.ids, api, self.checkpoint, since=2 ** 40)
+        self.assertEqual(api.requested, self.ids)
+
+    def test_old_batches_are_pruned(self):
+        with open(self.checkpoint, "w") as fh:
+            fh.write(json.dumps({"time": 0, "ids": self.ids[:100]}) + "\n")
+        api = FakeApi()
+        rehydrate_tweets(self.ids, api, self.checkpoint, since=1, on_batch=dict)
+        self.assertEqual(api.requested, self.ids)
+        with open(self.checkpoint) as fh:
+            entries = [json.loads(line) for line in fh]
+        self.assertEqual(len(entries), 3)
+        self.assertTrue(all(entry["time"] >= 1 for entry in entries))
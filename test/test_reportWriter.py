@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from pandas import DataFrame
+from preppy.preptweet import PrepTweet
+from preppy.report_writer import ReportWriter
+from preppy.tweet_columns import REPORT_COLUMNS, TweetColumns
+from preppy.tweet_list import TweetList
+from test.test_sessionStore import make_session, PLACE
+from test.test_tweetList import make_status
+
+
+def reference_table(tweets):
+    """The report table built one getattr at a time"""
+    output_dict = {
+        col_name: [getattr(tweet, tweet_property_name) for tweet in tweets]
+        for col_name, tweet_property_name in REPORT_COLUMNS
+    }
+    output = DataFrame.from_dict(output_dict)
+    return output[[name for name, _ in REPORT_COLUMNS]]
+
+
+class TestReportWriter(TestCase):
+    def setUp(self):
+        self.tweets = TweetList(make_session())
+        self.writer = ReportWriter(self.tweets)
+
+    def assertSameTable(self, a, b):
+        self.assertEqual(a.to_csv(), b.to_csv())
+
+    def test_tables(self):
+        self.assertSameTable(self.writer.make_table(),
+                             reference_table(self.tweets.as_list()))
+        self.assertSameTable(self.writer.table_geo,
+                             reference_table(self.tweets.as_list(only_geo=True)))
+        subset = self.tweets.as_list(randomize=True)[:4]
+        self.assertSameTable(self.writer.make_table(subset),
+                             reference_table(subset))
+
+    def test_columns_follow_changes(self):
+        self.writer.make_table()
+        self.tweets.record_metadata("2", "relevance", "coder", "1")
+        self.tweets.add_tweets([PrepTweet(make_status(11, place=PLACE))])
+        self.assertSameTable(self.writer.make_table(),
+                             reference_table(self.tweets.as_list()))
+
+    def test_typed_arrays_follow_changes(self):
+        names = ("id", "date", "latitude", "relevance", "has_geotag",
+                 "state", "us_region", "text")
+        for name in names:
+            self.tweets.columns.array(name)
+        self.tweets.record_metadata("2", "relevance", "coder", "1")
+        for i in range(11, 20):
+            self.tweets.add_tweets([PrepTweet(make_status(
+                i, place=PLACE, created_at="Wed Oct 10 20:19:24 +0200 2018"))])
+        columns = self.tweets.columns
+        fresh = TweetColumns()
+        fresh.update(self.tweets.tweets.items())
+        for name in names:
+            a = columns.array(name)[columns.sorted_rows()]
+            b = fresh.array(name)[fresh.sorted_rows()]
+            self.assertEqual(len(a), self.tweets.n, name)
+            self.assertEqual(list(map(str, a)), list(map(str, b)), name)
+        self.assertEqual(columns.array("date").dtype, "datetime64[ms]")
+        self.assertEqual(str(columns.array("date")[columns.row["19"]]),
+                         "2018-10-10T18:19:24.000")
+        self.assertEqual(list(columns.array("state").categories), ["GA"])
+        self.assertEqual(columns.counts("state").to_dict(), {"GA": 14})
+
+    def test_counts(self):
+        self.assertEqual(self.writer.country_counts(min_count=0).to_dict(),
+                         {"United States": 5})
+        self.assertEqual(self.writer.state_counts(min_count=0).to_dict(),
+                         {"GA": 5})
+        self.assertEqual(self.writer.unique_states(), ["GA"])
+
+    def test_write_reports(self):
+        self.tweets.record_metadata("2", "relevance", "coder", "1")
+        self.tweets.add_tweets([PrepTweet(make_status(
+            12, place=PLACE, full_text="PrEP\nworks",
+            hashtags=[{"text": "PrEP"}, {"text": "HIV"}]))])
+        out = tempfile.mkdtemp()
+        try:
+            def path(name):
+                return os.path.join(out, name)
+            self.tweets.export_geotagged_tweets(path("geo_a.json"))
+            self.writer.write_report_all(path("all_a.csv"))
+            self.writer.write_report_geo(path("geo_a.csv"))
+            self.writer.hashtag_table(path("tags_a.json"), min_freq=1)
+            summary = ReportWriter(self.tweets).write_reports(
+                path("all_b.csv"), path("geo_b.csv"), path("tags_b.json"),
+                path("geo_b.json"), min_freq=1, min_count=0)
+            for a, b in (("all_a.csv", "all_b.csv"), ("geo_a.csv", "geo_b.csv"),
+                         ("tags_a.json", "tags_b.json"), ("geo_a.json", "geo_b.json")):
+                with open(path(a), "rb") as fa, open(path(b), "rb") as fb:
+                    self.assertEqual(fa.read(), fb.read(), b)
+            with open(path("all_b.csv"), "r", newline="") as fh:
+                self.assertEqual(len(fh.read().splitlines()), self.tweets.n + 1)
+            self.assertEqual(summary["n_geotagged"], self.tweets.n_geotagged)
+            self.assertEqual(summary["unique_states"], ["GA"])
+        finally:
+            shutil.rmtree(out)
+
+    def test_streaming_csv_matches_pandas(self):
+        self.tweets.add_tweets([PrepTweet(make_status(
+            12, place=PLACE, full_text='line one\nline "two", three\r\nend',
+            hashtags=[{"text": "PrEP"}]))])
+        self.tweets.record_metadata("3", "relevance", "coder", "1")
+        columns = self.tweets.columns
+        outside = PrepTweet(make_status(99))
+        out = tempfile.mkdtemp()
+        try:
+            path = os.path.join(out, "report.csv")
+            for kwargs in ({}, {"rows": columns.sorted_rows()[:1]},
+                           {"tweets": self.tweets.as_list()[::-2] + [outside]}):
+                columns.write_csv(path, chunk_size=3, **kwargs)
+                columns.table(**kwargs).to_csv(path + ".pandas")
+                with open(path, "rb") as fa, open(path + ".pandas", "rb") as fb:
+                    self.assertEqual(fa.read(), fb.read(), kwargs)
+            columns.write_csv(path, escape_newlines=True)
+            with open(path, "r", newline="") as fh:
+                lines = fh.read().splitlines()
+            self.assertEqual(len(lines), self.tweets.n + 1)
+            self.assertIn('"line one\\nline ""two"", three\\r\\nend"', lines[-1])
+        finally:
+            shutil.rmtree(out)
+
+    def test_parquet_report(self):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        self.tweets.add_tweets([PrepTweet(make_status(
+            12, place=PLACE, created_at="Wed Oct 10 20:19:24 +0000 2018",
+            hashtags=[{"text": "PrEP"}, {"text": "HIV"}]))])
+        out = tempfile.mkdtemp()
+        try:
+            path = os.path.join(out, "report.parquet")
+            self.writer.write_report_all(path, fmt="parquet")
+            table = pyarrow.parquet.read_table(path)
+            self.assertEqual(table.num_rows, self.tweets.n)
+            self.assertEqual(str(table.schema.field("date").type), "timestamp[ms, tz=UTC]")
+            report = table.to_pandas()
+            expected = self.writer.make_table()
+            self.assertEqual(list(report["id"]), [int(i) for i in expected["id_string"]])
+            self.assertEqual(list(report.columns[1:]), list(expected.columns))
+            last = report.iloc[-1]
+            self.assertEqual(list(last["hashtags"]), ["PrEP", "HIV"])
+            self.assertEqual(str(last["date"]), "2018-10-10 20:19:24+00:00")
+            self.assertEqual(list(report["latitude"].fillna(-1)),
+                             list(expected["latitude"].fillna(-1)))
+            self.assertEqual(set(pyarrow.parquet.read_table(path, columns=["text"]).column_names),
+                             {"text"})
+        finally:
+            shutil.rmtree(out)
@@ -0,0 +1,56 @@
+import time
+import threading
+from unittest import TestCase
+from twitter import Status
+from preppy.prep import Preppy
+from preppy.tweet_list import TweetList
+from test.test_tweetList import make_status
+
+
+class FakeApi(object):
+    """GetSearch over a fixed set of tweet IDs per term"""
+    def __init__(self, ids_by_term):
+        self.ids_by_term = ids_by_term
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def GetSearch(self, term, count, lang, result_type, since_id=None, max_id=None):
+        with self.lock:
+            self.calls.append(term)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.02)
+        ids = sorted((i for i in self.ids_by_term[term]
+                      if (since_id is None or i > since_id)
+                      and (max_id is None or i <= int(max_id))), reverse=True)
+        with self.lock:
+            self.in_flight -= 1
+        return [Status(**make_status(i)) for i in ids[:count]]
+
+
+class TestSearchTerms(TestCase):
+    def setUp(self):
+        self.session = Preppy.__new__(Preppy)
+        self.session.tweets = TweetList()
+        self.session.api = FakeApi({
+            "prep": list(range(1, 251)),
+            "truvada": list(range(200, 451)),
+            "nothing": []
+        })
+
+    def test_search_terms(self):
+        self.session.search_terms(["prep", "truvada", "nothing"], calls_per_window=1000, window=1)
+        self.assertEqual(self.session.tweets.n, 450)
+        self.assertEqual((self.session.tweets.min_id, self.session.tweets.max_id), (1, 450))
+        self.assertEqual(self.session.api.calls.count("prep"), 4)
+        self.assertEqual(self.session.api.calls.count("nothing"), 1)
+        self.assertGreater(self.session.api.max_in_flight, 1)
+
+    def test_last_session_backstop(self):
+        self.session.tweets.add_tweets([Status(**make_status(440))])
+        self.session.search_terms(["prep", "truvada"], last_session_backstop=True,
+                                  calls_per_window=1000, window=1)
+        self.assertEqual(self.session.tweets.n, 11)
+        self.assertEqual(self.session.api.calls.count("prep"), 1)
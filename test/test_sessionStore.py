@@ -0,0 +1,75 @@
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+from preppy.session_store import SQLiteTweetStore, migrate_session_file
+from preppy.tweet_list import TweetList
+from test.test_tweetList import make_status
+
+
+PLACE = {
+    "full_name": "Atlanta, GA",
+    "country": "United States",
+    "country_code": "US",
+    "place_type": "city",
+    "bounding_box": {"coordinates": [[[-84.5, 33.6], [-84.3, 33.6],
+                                      [-84.3, 33.9], [-84.5, 33.9]]]}
+}
+
+
+def make_session():
+    session = {}
+    for i in range(1, 11):
+        status = make_status(i, place=PLACE) if i % 2 else make_status(i)
+        metadata = {"relevance": {"keyword_classify.R": i % 3 != 0}}
+        if i == 5:
+            metadata["nlu"] = {"watson_nlu": {"sentiment": {}}}
+        if i % 2 == 0:
+            metadata["user_city"] = {"google_geocoding": "Baltimore"}
+        session[str(i)] = {"status": status, "metadata": metadata}
+    return session
+
+
+class TestSQLiteTweetStore(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.json_path = os.path.join(self.dir, "preppy_session.json")
+        self.db_path = os.path.join(self.dir, "preppy_session.db")
+        with open(self.json_path, "w") as fh:
+            json.dump(make_session(), fh)
+        self.in_memory = TweetList.from_session_file(self.json_path)
+        self.store = migrate_session_file(self.json_path, self.db_path)
+        self.on_disk = TweetList(store=self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def assertSameTweets(self, a, b):
+        self.assertEqual(sorted(t.id_str for t in a), sorted(t.id_str for t in b))
+
+    def test_migration(self):
+        self.assertEqual(self.on_disk.n, 10)
+        self.assertEqual(self.on_disk.as_dict, self.in_memory.as_dict)
+        self.assertEqual((self.on_disk.min_id, self.on_disk.max_id), (1, 10))
+
+    def test_queries_match_in_memory(self):
+        self.assertSameTweets(self.on_disk.as_list(only_geo=True),
+                              self.in_memory.as_list(only_geo=True))
+        self.assertEqual(self.on_disk.n_geotagged, 5)
+        self.assertEqual(len(self.on_disk.get_tweets_for_watson()), 4)
+        self.assertSameTweets(self.on_disk.get_tweets_for_watson(),
+                              self.in_memory.get_tweets_for_watson())
+        self.assertSameTweets(self.on_disk.as_list(coded_for="nlu"),
+                              self.in_memory.as_list(coded_for="nlu"))
+        self.assertEqual(self.on_disk.tweets_coded("RELEVANCE"),
+                         self.in_memory.tweets_coded("RELEVANCE"))
+
+    def test_record_metadata_is_stored(self):
+        self.on_disk.record_metadata("1", "nlu", "watson_nlu", {"sentiment": {}})
+        self.store.commit()
+        reopened = SQLiteTweetStore(self.db_path)
+        self.assertTrue(reopened["1"].has_nlu)
+        self.assertEqual(reopened.count(has_nlu=True), 2)
+        reopened.close()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from twitter import Status
+from preppy.binaryclassifier import TweetClassifier
+from preppy.features import document_term_matrix
+from preppy.preptweet import PrepTweet
+from preppy.token_cache import TokenCache, token_cache_file_name
+from preppy.tweet_list import TweetList
+from test.test_binaryClassifier import make_tweets
+from test.test_tweetList import make_status
+
+
+class TestTokenCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = token_cache_file_name(os.path.join(self.dir, "preppy_session.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_incremental_and_persisted(self):
+        tweets = TweetList()
+        cache = TokenCache(self.path)
+        tweets.attach_token_cache(cache)
+        tweets.add_tweets([PrepTweet(make_status(1, full_text="PrEP  works\\n é")),
+                           PrepTweet(make_status(2, full_text="ask about PrEP"))])
+        self.assertEqual(len(cache.tokens), 2)
+        self.assertTrue(cache.save())
+        self.assertFalse(cache.save())
+
+        loaded = TokenCache.for_session_file(os.path.join(self.dir, "preppy_session.json"))
+        unread = TweetList()
+        unread.attach_token_cache(loaded)
+        unread.add_tweets([PrepTweet(make_status(4, full_text="not read yet"))])
+        tweets.add_tweets([unread["4"]])
+        mtime = os.stat(self.path).st_mtime_ns
+        self.assertFalse(loaded.save())
+        self.assertFalse(loaded._loaded)
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+        self.assertEqual(loaded.words(tweets["4"]), ["not", "read", "yet"])
+        self.assertEqual(loaded.vocabulary.words[:len(cache.vocabulary)], cache.vocabulary.words)
+        for tweet in tweets.tweets.values():
+            self.assertEqual(loaded.words(tweet), tweet.words)
+        tweets.attach_token_cache(loaded)
+        self.assertEqual(loaded.update(tweets.tweets.values()), 0)
+        tweets.replace_status("2", Status(**make_status(2, full_text="new text")))
+        tweets.add_tweets([PrepTweet(make_status(3, full_text="PrEP"))])
+        self.assertEqual(loaded.words(tweets["2"]), ["new", "text"])
+        self.assertEqual(len(loaded.tokens), 4)
+        self.assertTrue(loaded.changed)
+
+    def test_matrix(self):
+        tweets = make_tweets(20)
+        cache = TokenCache()
+        x = cache.matrix(tweets)
+        expected = document_term_matrix([t.words for t in tweets], cache.vocabulary)
+        self.assertEqual((x != expected).nnz, 0)
+        with_cache, without = TweetClassifier("relevance"), TweetClassifier("relevance")
+        with_cache.train(tweets, token_cache=cache)
+        without.train(tweets)
+        self.assertEqual(with_cache.indicator_words, without.indicator_words)
@@ -0,0 +1,230 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+from preppy.misc import JsonObjectStream
+from preppy.journal import SessionJournal
+from preppy.metadata import place_of_interest
+from preppy.preptweet import PrepTweet, compute_centroids
+from twitter import Status
+from preppy.tweet_list import TweetList
+
+
+def make_status(id_int, **kwargs):
+    status = {
+        "id": id_int,
+        "id_str": str(id_int),
+        "full_text": "tweet number {:d} about #PrEP".format(id_int),
+        "user": {"id": 1000 + id_int, "location": "New Haven, CT"}
+    }
+    status.update(kwargs)
+    return status
+
+
+def make_session(ids):
+    return {
+        str(i): {"status": make_status(i), "metadata": {}}
+        for i in ids
+    }
+
+
+class TestJsonObjectStream(TestCase):
+    def test_items_match_json_load(self):
+        d = {"a": [1, 2, {"b": "}{,:"}], "c": 12345, "d": {}, "e": "é"}
+        text = json.dumps(d, indent=4)
+        for chunk_size in (1, 2, 7, 1024):
+            stream = JsonObjectStream(io.StringIO(text), chunk_size=chunk_size)
+            self.assertEqual(dict(stream.items()), d)
+            self.assertEqual(stream.position, len(text))
+
+    def test_empty_object(self):
+        stream = JsonObjectStream(io.StringIO(" { } "), chunk_size=1)
+        self.assertEqual(list(stream.items()), [])
+
+    def test_truncated_file_raises(self):
+        text = json.dumps({"a": {"b": 1}, "c": {"d": 2}})[:-3]
+        stream = JsonObjectStream(io.StringIO(text), chunk_size=4)
+        with self.assertRaises(ValueError):
+            list(stream.items())
+
+
+class TestTweetList(TestCase):
+    def test_min_max_id(self):
+        tweets = TweetList()
+        self.assertIsNone(tweets.min_id)
+        self.assertIsNone(tweets.max_id)
+        tweets = TweetList(make_session([7, 30, 12]))
+        self.assertEqual((tweets.min_id, tweets.max_id), (7, 30))
+        tweets.add_tweets([PrepTweet(make_status(i)) for i in (3, 100, 50)])
+        self.assertEqual((tweets.min_id, tweets.max_id), (3, 100))
+
+
+class TestTweetIndex(TestCase):
+    place = {"full_name": "Atlanta, GA",
+             "bounding_box": {"coordinates": [[[-84.5, 33.6], [-84.3, 33.6],
+                                               [-84.3, 33.9], [-84.5, 33.9]]]}}
+
+    def scan(self, tweets):
+        values = list(tweets.tweets.values())
+        return {
+            "geo": sorted(t.id_str for t in values if t.has_geotag),
+            "coded": sorted(t.id_str for t in values if t.has_been_coded_for("relevance")),
+            "watson": sorted(t.id_str for t in values if t.keyword_relevant
+                             and not t.has_nlu and place_of_interest(t.city)),
+            "relevant": sorted(t.id_str for t in values if t.relevance == 1)
+        }
+
+    def filters(self, tweets):
+        return {
+            "geo": sorted(tweets.geotagged()),
+            "coded": sorted(t.id_str for t in tweets.as_list(coded_for="RELEVANCE")),
+            "watson": sorted(t.id_str for t in tweets.get_tweets_for_watson()),
+            "relevant": sorted(t.id_str for t in tweets.relevant)
+        }
+
+    def test_filters_match_scans(self):
+        session = make_session(range(1, 9))
+        for i in (2, 3, 5):
+            session[str(i)]["status"]["place"] = self.place
+            session[str(i)]["metadata"] = {"relevance": {"keyword_classify.R": 1}}
+        for i in (6, 8):
+            session[str(i)]["metadata"] = {"relevance": {"keyword_classify.R": 1},
+                                           "user_city": {"google_geocoding": "Atlanta, GA"}}
+        tweets = TweetList(session)
+        self.assertEqual(self.filters(tweets), self.scan(tweets))
+        self.assertEqual(tweets.n_geotagged, 3)
+        self.assertEqual(len(tweets.get_tweets_for_watson()), 2)
+
+        tweets.record_metadata("6", "nlu", "watson_nlu", {"sentiment": {}})
+        tweets.record_metadata("7", "relevance", "coder", "1")
+        tweets.add_tweets([PrepTweet(make_status(9, place=self.place))])
+        tweets.replace_status("2", Status(**make_status(2)))
+        tweets.clear_metadata("5", "RELEVANCE")
+        self.assertEqual(self.filters(tweets), self.scan(tweets))
+        self.assertEqual(tweets.tweets_coded("relevance"), 6)
+        self.assertEqual(tweets.index.lookup("city", "Atlanta"), {"6", "8"})
+        self.assertEqual(tweets.index.lookup("has_nlu"), {"6"})
+
+
+class TestLazyPrepTweet(TestCase):
+    properties = ("id_str", "id", "date", "user_id", "user_id_str", "hashtags",
+                  "text", "words", "place", "latitude", "longitude", "country",
+                  "state", "city", "region", "user_place", "has_geotag")
+
+    def test_lazy_matches_eager(self):
+        place = {
+            "full_name": "Atlanta, GA",
+            "country": "United States",
+            "country_code": "US",
+            "place_type": "city",
+            "bounding_box": {"coordinates": [[[-84.5, 33.6], [-84.3, 33.6],
+                                              [-84.3, 33.9], [-84.5, 33.9]]]}
+        }
+        status = make_status(42, place=place, hashtags=[{"text": "PrEP"}],
+                             created_at="Wed Oct 10 20:19:24 +0000 2018")
+        for d in ({"status": status, "metadata": {}},
+                  {"status": make_status(43), "metadata": {}}):
+            eager = PrepTweet.from_dict(d)
+            lazy = PrepTweet.from_dict(d, lazy=True)
+            for name in self.properties:
+                self.assertEqual(repr(getattr(lazy, name)),
+                                 repr(getattr(eager, name)), name)
+            self.assertFalse(lazy.is_hydrated)
+            self.assertEqual(lazy.as_dict, eager.as_dict)
+            self.assertEqual(lazy.status.AsDict(), eager.status.AsDict())
+            self.assertTrue(lazy.is_hydrated)
+
+    def test_centroid_cache(self):
+        def place(x):
+            return {"bounding_box": {"coordinates": [[[x, 1.], [x + 2., 1.],
+                                                      [x + 2., 3.], [x, 3.]]]}}
+        tweets = TweetList(make_session([1, 2]))
+        tweets.replace_status("1", Status(**make_status(1, place=place(0.))))
+        tweets.record_metadata("1", "relevance", "coder", "1")
+        self.assertEqual(compute_centroids(tweets.as_list()), 1)
+        self.assertEqual(list(tweets["1"].coordinates), [1., 2.])
+        tweets.replace_status("1", Status(**make_status(1, place=place(10.))))
+        self.assertEqual(list(tweets["1"].coordinates), [11., 2.])
+        self.assertEqual(tweets["1"].metadata.relevance, {"coder": "1"})
+
+
+class TestSessionFile(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "preppy_session.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_from_session_file(self):
+        session = make_session([5, 3, 11])
+        with open(self.path, "w") as fh:
+            json.dump(session, fh, indent=4, sort_keys=True)
+        tweets = TweetList.from_session_file(self.path, report_every=1)
+        self.assertEqual(tweets.n, 3)
+        self.assertEqual(tweets.id_list, ["11", "3", "5"])
+        self.assertEqual((tweets.min_id, tweets.max_id), (3, 11))
+        self.assertEqual(tweets["3"].text, "tweet number 3 about #PrEP")
+
+    def test_missing_session_file(self):
+        tweets = TweetList.from_session_file(self.path)
+        self.assertEqual(tweets.n, 0)
+
+    def test_corrupt_session_file(self):
+        with open(self.path, "w") as fh:
+            fh.write(json.dumps(make_session([1, 2]))[:-10])
+        with self.assertRaises(IOError):
+            TweetList.from_session_file(self.path)
+
+
+class TestSessionJournal(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "preppy_session.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_replay(self):
+        tweets = TweetList(make_session([1, 2]))
+        tweets.attach_journal(SessionJournal(self.path))
+        tweets.add_tweets([PrepTweet(make_status(3))])
+        tweets.record_metadata("1", "relevance", "coder", "1")
+        tweets.record_metadata("3", "nlu", "watson_nlu", {"sentiment": {}})
+        self.assertEqual(tweets.journal.flush(), 3)
+
+        replayed = TweetList(make_session([1, 2]))
+        self.assertEqual(replayed.attach_journal(SessionJournal(self.path)), 3)
+        self.assertEqual(replayed.as_dict, tweets.as_dict)
+
+    def test_partial_line_is_skipped(self):
+        journal = SessionJournal(self.path)
+        journal.log_record("1", "relevance", "coder", "0")
+        journal.flush()
+        with open(self.path, "a") as fh:
+            fh.write('{"op": "record", "id_str": "1", "par')
+        journal.log_record("2", "relevance", "coder", "1")
+        journal.flush()
+
+        tweets = TweetList(make_session([1, 2]))
+        self.assertEqual(tweets.attach_journal(journal), 2)
+        self.assertEqual(tweets["1"].metadata.relevance, {"coder": "0"})
+        self.assertEqual(tweets["2"].metadata.relevance, {"coder": "1"})
+
+    def test_plain_loader_replays_journal(self):
+        session_path = os.path.join(self.dir, "preppy_session.json")
+        with open(session_path, "w") as fh:
+            json.dump(make_session([1, 2]), fh)
+        tweets = TweetList.from_session_file(session_path)
+        self.assertEqual(tweets.journal.path, self.path)
+        tweets.record_metadata("1", "relevance", "coder", "1")
+        tweets.add_tweets([PrepTweet(make_status(3))])
+        tweets.journal.flush()
+
+        reloaded = TweetList.from_session_file(session_path)
+        self.assertEqual(reloaded.tweets_coded("relevance"), 1)
+        self.assertEqual(reloaded.n, 3)
+        without = TweetList.from_session_file(session_path, journal=False)
+        self.assertEqual(without.tweets_coded("relevance"), 0)
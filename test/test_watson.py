@@ -0,0 +1,168 @@
+import json
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from watson_developer_cloud.natural_language_understanding_v1 import (
+    Features, SentimentOptions, KeywordsOptions, EmotionOptions, EntitiesOptions,
+    SemanticRolesOptions, MetadataOptions)
+from preppy.dataobjects import NLUCache
+from preppy.prep import Preppy
+from preppy.preptweet import PrepTweet
+from preppy.tweet_list import TweetList
+from preppy.watson import NLU, NLUEnricher, features_to_dict
+from test.test_tweetList import make_status
+
+
+class FakeNLU(BaseHTTPRequestHandler):
+    """Answers like Watson NLU; fails once on texts containing 'flaky',
+    always rate limits texts containing 'busy'"""
+    texts = []
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        text = body["text"]
+        with self.lock:
+            first_time = text not in self.texts
+            self.texts.append(text)
+        if "busy" in text:
+            self.reply(429, {"error": "Too many requests", "code": 429})
+        elif "flaky" in text and first_time:
+            self.reply(503, {"error": "Service unavailable", "code": 503})
+        elif "gibberish" in text:
+            self.reply(422, {"error": "unsupported text language", "code": 422})
+        else:
+            self.reply(200, {"language": "en",
+                             "sentiment": {"document": {"score": 0.5, "label": "positive"}}})
+
+    def reply(self, code, body):
+        output = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestNLUCache(TestCase):
+    def test_retweets_share_an_entry(self):
+        self.assertEqual(
+            NLUCache.key("PrEP works  https://t.co/abc"),
+            NLUCache.key("RT @someone: prep works https://t.co/xyz"))
+        self.assertNotEqual(NLUCache.key("PrEP works"), NLUCache.key("PrEP fails"))
+
+    def test_get_tweets_for_watson(self):
+        metadata = {"relevance": {"keyword_classify.R": 1},
+                    "user_city": {"google_geocoding": "Atlanta, GA"}}
+        texts = ["RT @a: PrEP is great http://t.co/1", "PrEP is GREAT", "new text"]
+        tweets = TweetList({
+            str(i): {"status": make_status(i, full_text=text), "metadata": metadata}
+            for i, text in enumerate(texts)
+        })
+        cache = NLUCache()
+        cache.put("prep is great", {"sentiment": {"document": {"score": 0.9}}})
+        output = tweets.get_tweets_for_watson(cache=cache)
+        self.assertEqual([tweet.id_str for tweet in output], ["2"])
+        self.assertEqual(tweets["1"].metadata.nlu,
+                         {"watson_nlu": {"sentiment": {"document": {"score": 0.9}}}})
+        self.assertAlmostEqual(cache.hit_rate, 2 / 3.)
+        self.assertEqual(tweets.get_tweets_for_watson(cache=cache), output)
+
+    def test_rate_counts_the_sample_only(self):
+        metadata = {"relevance": {"keyword_classify.R": 1},
+                    "user_city": {"google_geocoding": "Atlanta, GA"}}
+        texts = ["cached one", "cached two", "same text", "same text", "other text"]
+        texts += ["pool text {:d}".format(i) for i in range(20)]
+        directory = tempfile.mkdtemp()
+        session = Preppy.__new__(Preppy)
+        session.tweets = TweetList({
+            str(i): {"status": make_status(i, full_text=text), "metadata": metadata}
+            for i, text in enumerate(texts)
+        })
+        session.journal = None
+        session.nlu = SimpleNamespace(analyze=lambda features, text: {"sentiment": {}})
+        session.nlu_cache = NLUCache()
+        session.nlu_cache.put("cached one", {"sentiment": {"document": {"score": 0.1}}})
+        session.nlu_cache.put("cached two", {"sentiment": {"document": {"score": 0.2}}})
+        session.nlu_cache_path = directory + "/nlu_cache.json"
+        try:
+            # 2 cache hits, then a sample of 4 tweets with 3 unique texts
+            rate = session.get_nlu_data(sample_size=4, max_workers=2)
+        finally:
+            shutil.rmtree(directory)
+        self.assertAlmostEqual(rate, 3 / 6.)
+        self.assertAlmostEqual(session.nlu_cache.hit_rate, 2 / 6.)
+        self.assertEqual(session.tweets.index.lookup("has_nlu"), {"0", "1", "2", "3", "4", "5"})
+
+
+class TestFeaturesToDict(TestCase):
+    def test_same_as_sdk(self):
+        for features in (
+                Features(sentiment=SentimentOptions()),
+                Features(sentiment=SentimentOptions(document=True, targets=["PrEP"]),
+                         keywords=KeywordsOptions(limit=5, emotion=True),
+                         emotion=EmotionOptions(targets=["HIV", "PrEP"]),
+                         entities=EntitiesOptions(mentions=False),
+                         semantic_roles=SemanticRolesOptions(keywords=True),
+                         metadata=MetadataOptions())):
+            self.assertEqual(features_to_dict(features), features._to_dict())
+
+
+class TestNLUEnricher(TestCase):
+    def setUp(self):
+        FakeNLU.texts = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeNLU)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.dir = tempfile.mkdtemp()
+        self.config_file = self.dir + "/config.json"
+        with open(self.config_file, "w") as fh:
+            json.dump({"watson": {
+                "username": "user", "password": "pass", "version": "2018-03-16",
+                "url": "http://127.0.0.1:{:d}".format(self.server.server_port)
+            }}, fh)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.dir)
+
+    def test_run(self):
+        tweets = [PrepTweet(make_status(i)) for i in range(20)]
+        tweets.append(PrepTweet(make_status(20, full_text="a flaky one")))
+        tweets.append(PrepTweet(make_status(21, full_text="gibberish")))
+        results = {}
+        checkpoints = []
+        enricher = NLUEnricher(NLU(self.config_file).analyze, max_workers=4, backoff=0.01)
+        n, n_failed = enricher.run(
+            tweets,
+            on_result=lambda tweet, response: results.update({tweet.id_str: response}),
+            on_checkpoint=lambda: checkpoints.append(len(results)),
+            checkpoint_every=5)
+        self.assertEqual((n, n_failed), (21, 1))
+        self.assertEqual(sorted(results, key=int), [str(i) for i in range(21)])
+        self.assertEqual(results["20"]["sentiment"]["document"]["label"], "positive")
+        self.assertEqual(FakeNLU.texts.count("a flaky one"), 2)
+        self.assertEqual(FakeNLU.texts.count("gibberish"), 1)
+        self.assertEqual(checkpoints[-1], 21)
+        self.assertTrue(all(b - a >= 5 for a, b in zip(checkpoints, checkpoints[1:-1])))
+
+    def test_retries_in_one_layer(self):
+        tweets = [PrepTweet(make_status(1, full_text="always busy")),
+                  PrepTweet(make_status(2, full_text="a flaky one"))]
+        results = {}
+        enricher = NLUEnricher(NLU(self.config_file).analyze, max_workers=2,
+                               max_retries=2, backoff=0.01)
+        n, n_failed = enricher.run(
+            tweets, on_result=lambda tweet, response: results.update({tweet.id_str: response}))
+        self.assertEqual((n, n_failed), (1, 1))
+        # one request per attempt: the enricher retries, the http client does not
+        self.assertEqual(FakeNLU.texts.count("always busy"), 3)
+        self.assertEqual(FakeNLU.texts.count("a flaky one"), 2)